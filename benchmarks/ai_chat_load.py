@@ -0,0 +1,244 @@
+"""
+AI chat load test.
+
+Drives AIChat.on_message with synthetic Discord messages at a target rate against
+the fake Ollama server and reports end-to-end latency, backend queueing delay and
+storage time. Runs in a temporary data directory, so real chat history is untouched.
+
+    python -m benchmarks.ai_chat_load --rate 5 --messages 200 --users 20
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.fake_ollama import add_server_arguments, server_from_arguments  # noqa: E402
+from cogs.utils import metrics  # noqa: E402
+from cogs.utils.messages import remember_bot_message  # noqa: E402
+from cogs.utility import ai_chat, ai_chat_utils  # noqa: E402
+
+BOT_ID = 1000
+GUILD_ID = 2000
+CHANNEL_ID = 3000
+
+PROMPTS = [
+    "hey how are you", "what are you doing tonight", "do you play mobile legends",
+    "tell me something funny", "who is your favorite player", "hello!",
+    "can you remember my name is Alex", "what did I just say", "i'm bored",
+]
+
+# Per-message timing record for the task currently handling a message
+_current = contextvars.ContextVar('current_message_stats')
+_message_ids = itertools.count(10_000)
+
+
+class StubUser:
+    def __init__(self, user_id, bot=False):
+        self.id = user_id
+        self.bot = bot
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class StubTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class StubChannel:
+    id = CHANNEL_ID
+
+    def typing(self):
+        return StubTyping()
+
+
+class StubGuild:
+    id = GUILD_ID
+
+
+class StubReference:
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.resolved = None
+
+
+class StubMessage:
+    def __init__(self, author, content, mentions=(), reference=None, on_reply=None):
+        self.id = next(_message_ids)
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.reference = reference
+        self.guild = StubGuild()
+        self.channel = StubChannel()
+        self._on_reply = on_reply
+
+    async def reply(self, content, mention_author=True):
+        sent = StubMessage(StubUser(BOT_ID, bot=True), content)
+        remember_bot_message(sent.id)
+        if self._on_reply:
+            self._on_reply(self, sent)
+        return sent
+
+
+class StubBot:
+    def __init__(self):
+        self.user = StubUser(BOT_ID, bot=True)
+
+
+def _timed_storage(func):
+    """Wrap an ai_chat storage call so its time is charged to the current message"""
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            stats = _current.get(None)
+            if stats is not None:
+                stats['storage'] += time.perf_counter() - start
+    return wrapper
+
+
+def _timed_backend(func):
+    """Wrap the Ollama call so its time is charged to the current message"""
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            stats = _current.get(None)
+            if stats is not None:
+                stats['backend'] += time.perf_counter() - start
+    return wrapper
+
+
+def _instrument():
+    for name in ('start_conversation', 'add_message', 'get_conversation_history', 'is_ai_enabled_channel'):
+        setattr(ai_chat, name, _timed_storage(getattr(ai_chat, name)))
+    ai_chat_utils._ollama_generate = _timed_backend(ai_chat_utils._ollama_generate)
+
+
+async def run(args):
+    server = server_from_arguments(args)
+    base_url = await server.start()
+    ai_chat_utils.OLLAMA_API = f"{base_url}/api/generate"
+    _instrument()
+
+    await ai_chat_utils.set_ai_channel(GUILD_ID, CHANNEL_ID)
+
+    bot = StubBot()
+    cog = ai_chat.AIChat(bot)
+    rng = random.Random(args.seed)
+    users = [StubUser(5000 + i) for i in range(args.users)]
+    last_reply = {}   # user id -> id of the bot's last reply to them
+    results = []
+
+    def on_reply(message, sent):
+        last_reply[message.author.id] = sent.id
+        stats = _current.get(None)
+        if stats is not None and stats.get('replied') is None:
+            stats['replied'] = time.perf_counter()
+
+    async def drive(message, arrived):
+        stats = {'arrived': arrived, 'storage': 0.0, 'backend': 0.0, 'replied': None}
+        _current.set(stats)
+        await cog.on_message(message)
+        stats['done'] = time.perf_counter()
+        results.append(stats)
+
+    tasks = []
+    interval = 1.0 / args.rate
+    start = time.perf_counter()
+    for i in range(args.messages):
+        # Open-loop arrivals: schedule against the clock, not against completions
+        target = start + i * interval
+        delay = target - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        user = rng.choice(users)
+        prompt = rng.choice(PROMPTS)
+        if user.id in last_reply and rng.random() < args.reply_ratio:
+            message = StubMessage(user, prompt, reference=StubReference(last_reply[user.id]), on_reply=on_reply)
+        else:
+            message = StubMessage(user, f"<@{BOT_ID}> {prompt}", mentions=[bot.user], on_reply=on_reply)
+        tasks.append(asyncio.create_task(drive(message, time.perf_counter())))
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await server.stop()
+
+    e2e = [(r['replied'] or r['done']) - r['arrived'] for r in results]
+    return {
+        'messages': len(results),
+        'target_rate': args.rate,
+        'achieved_rate': len(results) / elapsed if elapsed else 0.0,
+        'backend_requests': server.requests,
+        'backend_failures': server.failures,
+        'response_cache_hit_rate': metrics.hit_rate('ai.response_cache'),
+        'e2e_ms': _ms(metrics.summarize(e2e)),
+        'queue_ms': _ms(metrics.summarize(server.queue_waits)),
+        'storage_ms': _ms(metrics.summarize([r['storage'] for r in results])),
+        'backend_ms': _ms(metrics.summarize([r['backend'] for r in results])),
+        'prompt_chars': metrics.summarize(server.prompt_chars),
+    }
+
+
+def _ms(summary):
+    return {k: (round(v * 1000, 2) if k != 'count' and v is not None else v) for k, v in summary.items()}
+
+
+def print_report(report):
+    print(f"Messages: {report['messages']}  target {report['target_rate']:.1f}/s  "
+          f"achieved {report['achieved_rate']:.1f}/s")
+    print(f"Backend requests: {report['backend_requests']}  failures: {report['backend_failures']}")
+    if report['response_cache_hit_rate'] is not None:
+        print(f"Response cache hit rate: {report['response_cache_hit_rate']:.1%}")
+    print(f"{'metric':<12}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for key in ('e2e_ms', 'queue_ms', 'storage_ms', 'backend_ms'):
+        s = report[key]
+        print(f"{key:<12}{s['p50']:>10}{s['p95']:>10}{s['p99']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI chat load test against a fake Ollama server")
+    parser.add_argument('--rate', type=float, default=5.0, help="messages per second")
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--reply-ratio', type=float, default=0.7, help="share of messages that reply to the bot")
+    parser.add_argument('--json', help="write the report to this file")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    # Keep chat history and settings out of the real data directory
+    workdir = tempfile.mkdtemp(prefix='shizu-ai-load-')
+    os.chdir(workdir)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(Path(ROOT, args.json) if not os.path.isabs(args.json) else args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Long-term memory index benchmark.
+
+Fills a guild memory index with synthetic exchanges using the offline hashing
+embedder and reports index size, insert throughput, query latency and recall
+of a planted fact for several index sizes.
+
+    python -m benchmarks.ai_memory_bench --sizes 1000 10000 50000 --users 200
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from cogs.utils import metrics  # noqa: E402
+from cogs.utility.ai_memory_utils import HashingEmbedder, MemoryIndex, format_exchange  # noqa: E402
+
+TOPICS = [
+    "mobile legends ranked", "my cat", "school exams", "pizza toppings", "anime", "football",
+    "my birthday", "music playlist", "the weekend", "a new phone", "homework", "my sister",
+]
+PLANTED = ("my dog is called Biscuit", "aww Biscuit is such a cute name")
+PLANTED_QUERY = "what is my dog called"
+
+
+async def bench_size(size, users, queries, seed):
+    rng = random.Random(seed)
+    embedder = HashingEmbedder()
+    index = MemoryIndex(embedder.name, embedder.dimensions)
+
+    exchanges = []
+    owners = []
+    for i in range(size):
+        topic = rng.choice(TOPICS)
+        exchanges.append((f"let's talk about {topic} #{i}", f"omg {topic} is the best"))
+        owners.append(rng.randrange(users))
+
+    # Plant one fact for user 0 in the middle of their history
+    exchanges[size // 2] = PLANTED
+    owners[size // 2] = 0
+    texts = [format_exchange(prompt, response) for prompt, response in exchanges]
+
+    start = time.perf_counter()
+    vectors = await embedder.embed([f"{prompt}\n{response}" for prompt, response in exchanges])
+    embed_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(size):
+        index.add(owners[i], vectors[i], texts[i], float(i))
+    insert_time = time.perf_counter() - start
+
+    query_vector = (await embedder.embed([PLANTED_QUERY]))[0]
+    query_times = []
+    for _ in range(queries):
+        user = rng.randrange(users)
+        start = time.perf_counter()
+        index.search(user, query_vector)
+        query_times.append(time.perf_counter() - start)
+
+    found = any("Biscuit" in text for text, _ in index.search(0, query_vector))
+
+    timings = metrics.summarize(query_times)
+    return {
+        'size': size,
+        'index_bytes': index.nbytes(),
+        'vector_bytes': index.vectors.nbytes,
+        'embed_per_item_us': round(embed_time / size * 1e6, 2),
+        'insert_per_item_us': round(insert_time / size * 1e6, 2),
+        'query_p50_us': round(timings['p50'] * 1e6, 2),
+        'query_p95_us': round(timings['p95'] * 1e6, 2),
+        'planted_fact_recalled': found,
+    }
+
+
+async def run(args):
+    return [await bench_size(size, args.users, args.queries, args.seed) for size in args.sizes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-term memory index benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"{'size':>8}{'index KB':>12}{'embed us':>10}{'insert us':>11}{'query p50':>11}{'query p95':>11}  recall")
+    for r in results:
+        print(f"{r['size']:>8}{r['index_bytes'] / 1024:>12.1f}{r['embed_per_item_us']:>10}"
+              f"{r['insert_per_item_us']:>11}{r['query_p50_us']:>11}{r['query_p95_us']:>11}  {r['planted_fact_recalled']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Local stand-in for the Ollama /api/generate endpoint.
+
+Replies with generated filler text after a configurable latency and token rate,
+optionally streaming, with injectable failures. Useful for measuring AI chat
+latency without a real model behind a tunnel.
+
+Run standalone:
+    python -m benchmarks.fake_ollama --port 11434 --latency 0.3 --tps 40
+and point the bot at it with OLLAMA_TUNNEL_URL=http://127.0.0.1:11434
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+WORDS = [
+    "omg", "lol", "same", "wait", "what", "no", "way", "honestly", "idk", "maybe",
+    "mobile", "legends", "tonight", "sae", "is", "so", "cute", "help", "bestie", "fr",
+]
+
+
+class FakeOllama:
+    """Configurable fake Ollama server"""
+
+    def __init__(self, latency=0.2, jitter=0.05, tokens=24, tps=40.0, parallel=1,
+                 fail_rate=0.0, hang_rate=0.0, hang_seconds=30.0, seed=None):
+        self.latency = latency          # Seconds before the first token (prompt eval)
+        self.jitter = jitter            # Random +/- seconds added to latency
+        self.tokens = tokens            # Tokens generated per response
+        self.tps = tps                  # Tokens per second once generating
+        self.fail_rate = fail_rate      # Fraction of requests answered with HTTP 500
+        self.hang_rate = hang_rate      # Fraction of requests that hang for hang_seconds
+        self.hang_seconds = hang_seconds
+        self.random = random.Random(seed)
+
+        # Ollama serves a limited number of requests at once, the rest wait
+        self._slots = asyncio.Semaphore(parallel)
+
+        self.requests = 0
+        self.failures = 0
+        self.queue_waits = []           # Seconds each request waited for a slot
+        self.prompt_chars = []          # Size of each received prompt
+
+        self.app = web.Application()
+        self.app.router.add_post('/api/generate', self.generate)
+        self._runner = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start serving, returns the base URL"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        """Stop serving"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _make_tokens(self):
+        return [self.random.choice(WORDS) + " " for _ in range(self.tokens)]
+
+    async def generate(self, request):
+        """Handle POST /api/generate"""
+        body = await request.json()
+        self.requests += 1
+        self.prompt_chars.append(len(body.get('prompt', '')))
+        model = body.get('model', 'fake')
+        stream = body.get('stream', True)  # Ollama streams by default
+
+        arrived = time.perf_counter()
+        async with self._slots:
+            self.queue_waits.append(time.perf_counter() - arrived)
+
+            roll = self.random.random()
+            if roll < self.fail_rate:
+                self.failures += 1
+                return web.json_response({"error": "injected failure"}, status=500)
+            if roll < self.fail_rate + self.hang_rate:
+                self.failures += 1
+                await asyncio.sleep(self.hang_seconds)
+                return web.json_response({"error": "injected hang"}, status=503)
+
+            started = time.perf_counter()
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+            tokens = self._make_tokens()
+
+            if not stream:
+                await asyncio.sleep(len(tokens) / self.tps)
+                return web.json_response(self._final(model, "".join(tokens).strip(), started, len(tokens)))
+
+            response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+            await response.prepare(request)
+            for token in tokens:
+                await asyncio.sleep(1 / self.tps)
+                chunk = {"model": model, "created_at": _now(), "response": token, "done": False}
+                await response.write((json.dumps(chunk) + "\n").encode())
+            await response.write((json.dumps(self._final(model, "", started, len(tokens))) + "\n").encode())
+            await response.write_eof()
+            return response
+
+    def _final(self, model, text, started, count):
+        return {
+            "model": model,
+            "created_at": _now(),
+            "response": text,
+            "done": True,
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "eval_count": count,
+        }
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def add_server_arguments(parser):
+    """Add the fake server options to an argument parser"""
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument('--jitter', type=float, default=0.05, help="random +/- seconds on latency")
+    parser.add_argument('--tokens', type=int, default=24, help="tokens per response")
+    parser.add_argument('--tps', type=float, default=40.0, help="tokens per second")
+    parser.add_argument('--parallel', type=int, default=1, help="requests served at once")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of HTTP 500 responses")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument('--hang-seconds', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def server_from_arguments(args):
+    """Build a FakeOllama from parsed arguments"""
+    return FakeOllama(
+        latency=args.latency, jitter=args.jitter, tokens=args.tokens, tps=args.tps,
+        parallel=args.parallel, fail_rate=args.fail_rate, hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds, seed=args.seed,
+    )
+
+
+async def _serve(args):
+    server = server_from_arguments(args)
+    url = await server.start(args.host, args.port)
+    print(f"Fake Ollama listening on {url}/api/generate")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    add_server_arguments(parser)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
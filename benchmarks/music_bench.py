@@ -0,0 +1,176 @@
+"""
+Music playback CPU benchmark.
+
+Plays local audio files through the music cog's audio sources the way discord.py's
+AudioPlayer would (read every 20ms frame, Opus-encode it in Python on the PCM path) and
+reports CPU time per stream, including the FFmpeg processes. Streams are read as fast as
+possible, so CPU is reported per second of audio: "% core" is the share of one core a
+single real-time stream needs, and "streams/core" how many voice guilds one core could serve.
+
+Fixtures are generated with FFmpeg (an Opus/WebM file like YouTube's format 251 and an
+AAC/M4A file) unless --audio points at real files. Needs ffmpeg on PATH and libopus
+for the PCM path.
+
+    python -m benchmarks.music_bench --streams 4 --seconds 60
+    python -m benchmarks.music_bench --audio song.webm --only opus
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import discord  # noqa: E402
+
+from cogs.utility import music  # noqa: E402
+
+
+def make_fixture(directory, name, codec_args, seconds):
+    """Generate a stereo test tone with some noise so encoders have real work to do"""
+    path = Path(directory) / name
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+         '-f', 'lavfi', '-i', f"anoisesrc=color=pink:amplitude=0.1:duration={seconds}",
+         '-filter_complex', 'amix=inputs=2,aformat=channel_layouts=stereo',
+         *codec_args, str(path)],
+        check=True,
+    )
+    return path
+
+
+def fixtures(seconds, audio=None):
+    """{label: (path, acodec as yt-dlp would report it)}"""
+    if audio:
+        codec = 'opus' if audio.endswith(('.webm', '.opus', '.ogg')) else None
+        return {'file': (Path(audio), codec)}
+    directory = tempfile.mkdtemp(prefix='shizu-music-bench-')
+    return {
+        'webm-opus': (make_fixture(directory, 'tone.webm', ['-c:a', 'libopus', '-b:a', '160k'], seconds), 'opus'),
+        'm4a-aac': (make_fixture(directory, 'tone.m4a', ['-c:a', 'aac', '-b:a', '128k'], seconds), 'mp4a.40.2'),
+    }
+
+
+def pcm_stream(data, volume):
+    """PCM path: FFmpeg decodes, discord.py scales volume and encodes Opus in Python"""
+    source = music.YTDLSource.from_data(data, volume=volume)
+    encoder = discord.opus.Encoder()
+
+    def read():
+        pcm = source.read()
+        if not pcm:
+            return False
+        encoder.encode(pcm, encoder.SAMPLES_PER_FRAME)
+        return True
+    return source, read
+
+
+def opus_stream(data, volume):
+    """Opus path: FFmpeg copies or encodes Opus, discord.py sends packets as they are"""
+    source = music.YTDLOpusSource(data, codec=data.get('acodec'), volume=volume)
+    return source, lambda: bool(source.read())
+
+
+SCENARIOS = {
+    # name: (stream factory, fixture label, volume)
+    'pcm-opus-100': (pcm_stream, 'webm-opus', 1.0),
+    'pcm-opus-50': (pcm_stream, 'webm-opus', 0.5),
+    'pcm-aac-100': (pcm_stream, 'm4a-aac', 1.0),
+    'opus-copy-100': (opus_stream, 'webm-opus', 1.0),
+    'opus-filter-50': (opus_stream, 'webm-opus', 0.5),
+    'opus-aac-100': (opus_stream, 'm4a-aac', 1.0),
+}
+
+
+def run_scenario(name, files, streams):
+    """Play `streams` copies of a file concurrently and measure wall and CPU time"""
+    factory, label, volume = SCENARIOS[name]
+    path, codec = files.get(label) or files['file']
+    data = {'url': str(path), 'title': path.name, 'acodec': codec}
+
+    frames = [0] * streams
+    sources = []
+
+    def play(index, read):
+        while read():
+            frames[index] += 1
+
+    before = os.times()
+    start = time.perf_counter()
+    threads = []
+    for i in range(streams):
+        source, read = factory(data, volume)
+        sources.append(source)
+        threads.append(threading.Thread(target=play, args=(i, read)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for source in sources:
+        source.cleanup()  # Waits for FFmpeg, so its CPU time lands in children_*
+    wall = time.perf_counter() - start
+    after = os.times()
+
+    python_cpu = (after.user - before.user) + (after.system - before.system)
+    ffmpeg_cpu = (after.children_user - before.children_user) + (after.children_system - before.children_system)
+    audio_seconds = sum(frames) * music.FRAME_SECONDS
+    per_stream = (python_cpu + ffmpeg_cpu) / audio_seconds if audio_seconds else 0.0
+    return {
+        'scenario': name,
+        'streams': streams,
+        'audio_s': round(audio_seconds, 1),
+        'wall_s': round(wall, 2),
+        'python_cpu_s': round(python_cpu, 2),
+        'ffmpeg_cpu_s': round(ffmpeg_cpu, 2),
+        'core_pct_per_stream': round(per_stream * 100, 3),
+        'streams_per_core': round(1 / per_stream) if per_stream else None,
+    }
+
+
+def print_report(results):
+    print(f"{'scenario':<18}{'audio s':>9}{'python s':>10}{'ffmpeg s':>10}{'% core':>9}{'streams/core':>14}")
+    for r in results:
+        print(f"{r['scenario']:<18}{r['audio_s']:>9}{r['python_cpu_s']:>10}{r['ffmpeg_cpu_s']:>10}"
+              f"{r['core_pct_per_stream']:>9}{r['streams_per_core'] or '-':>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU per voice stream for the PCM and Opus playback paths")
+    parser.add_argument('--streams', type=int, default=4, help="concurrent streams per scenario")
+    parser.add_argument('--seconds', type=int, default=60, help="length of the generated fixtures")
+    parser.add_argument('--audio', help="use this audio file instead of generated fixtures")
+    parser.add_argument('--only', help="run scenarios whose name contains this")
+    parser.add_argument('--json', help="also write results to this file")
+    args = parser.parse_args()
+
+    names = [name for name in SCENARIOS if not args.only or args.only in name]
+    if any(name.startswith('pcm') for name in names) and not discord.opus.is_loaded():
+        try:
+            discord.opus._load_default()
+        except Exception:
+            pass
+        if not discord.opus.is_loaded():
+            print("libopus not found, skipping the PCM path")
+            names = [name for name in names if not name.startswith('pcm')]
+
+    files = fixtures(args.seconds, args.audio)
+    if args.audio:
+        # One file: run each path once at 100% and once with the volume filter
+        names = [name for name in names if SCENARIOS[name][1] == 'webm-opus']
+    results = [run_scenario(name, files, args.streams) for name in names]
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'streams': args.streams, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Image rendering benchmark suite.
+
+Renders quotes through Quote.generate_quote_image and family trees through
+Marriage.tree using stub Discord objects. Quotes use the avatars in pfp/ plus
+synthetic animated avatars, banners and long texts. Also times text wrapping
+of long messages against the old textbbox-per-word loop. Each scenario runs
+in its own process so peak RSS is per scenario. Results are written as JSON
+(benchmarks/results/<commit>.json by default) so runs can be compared across
+commits.
+
+    python -m benchmarks.render_bench --iterations 5
+    python -m benchmarks.render_bench --only quote --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from cogs.utils import metrics  # noqa: E402
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+SHORT_TEXT = "this bot is actually so good i can't lie"
+LONG_TEXT = ("ok so hear me out, if we rotate the tank to the side lane every third wave and the "
+             "mage holds ult for the turtle fight we actually win most of those games ") * 12
+
+_ids = itertools.count(100_000)
+
+
+# ---------------------------------------------------------------- fixtures
+
+def pfp_avatar(index=0, size=256):
+    """An avatar from pfp/, resized like the Discord CDN would"""
+    paths = sorted(Path(ROOT, 'pfp').glob('*.jpg'))
+    img = Image.open(paths[index % len(paths)]).convert('RGB').resize((size, size))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def animated_avatar(frames=10, size=256):
+    """Synthetic animated GIF avatar with a moving circle"""
+    images = []
+    for i in range(frames):
+        img = Image.new('RGB', (size, size), (30 + (i * 15) % 200, 40, 120))
+        draw = ImageDraw.Draw(img)
+        x = int(size * i / frames)
+        draw.ellipse((x - 40, 80, x + 40, 160), fill=(250, 200, 40))
+        images.append(img)
+    buffer = io.BytesIO()
+    images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:], duration=100, loop=0)
+    return buffer.getvalue()
+
+
+def synthetic_banner(width=600, height=240):
+    """Gradient banner like a Nitro profile banner"""
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def family_fixture(ancestors, descendants, children_per_person):
+    """
+    Build family_tree.json / marriages.json data around user 1.
+    ancestors / descendants: generations above and below user 1. Everyone above has two
+    married parents; everyone below (and user 1) is married with children_per_person children.
+    """
+    tree = {}
+    marriages = {}
+    next_id = itertools.count(2)
+
+    def person(user_id):
+        return tree.setdefault(str(user_id), {"parent_ids": [], "children_ids": []})
+
+    def link(parent, child):
+        person(parent)["children_ids"].append(str(child))
+        person(child)["parent_ids"].append(str(parent))
+
+    def marry(a, b):
+        married_at = datetime.datetime(2024, 1, 1).isoformat()
+        marriages[str(a)] = {"partner_id": str(b), "married_at": married_at, "joint_balance": False}
+        marriages[str(b)] = {"partner_id": str(a), "married_at": married_at, "joint_balance": False}
+
+    generation = [1]
+    for _ in range(ancestors):
+        parents = []
+        for child in generation:
+            mother, father = next(next_id), next(next_id)
+            link(mother, child)
+            link(father, child)
+            marry(mother, father)
+            parents += [mother, father]
+        generation = parents
+
+    generation = [1]
+    for _ in range(descendants):
+        children = []
+        for parent in generation:
+            spouse = next(next_id)
+            marry(parent, spouse)
+            for _ in range(children_per_person):
+                child = next(next_id)
+                link(parent, child)
+                link(spouse, child)
+                children.append(child)
+        generation = children
+
+    person(1)
+    return tree, marriages
+
+
+# ---------------------------------------------------------------- discord stubs
+
+class StubAsset:
+    def __init__(self, key, data):
+        self.key = key
+        self._data = data
+
+    def with_size(self, size):
+        return self
+
+    async def read(self):
+        return self._data
+
+
+class StubUser:
+    def __init__(self, user_id, avatar=None, banner=None, decoration=None):
+        self.id = user_id
+        self.bot = False
+        self.name = f"user{user_id}"
+        self.display_name = f"User {user_id}"
+        self._avatar = avatar
+        self.banner = banner
+        self.avatar_decoration = decoration
+
+    @property
+    def display_avatar(self):
+        if self._avatar is None:
+            self._avatar = StubAsset(f"avatar{self.id}", pfp_avatar(self.id))
+        return self._avatar
+
+
+class StubMessage:
+    def __init__(self, author, content):
+        self.id = next(_ids)
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.created_at = datetime.datetime(2026, 10, 19)
+        self.edited_at = None
+
+
+class StubCommandTree:
+    def add_command(self, *args, **kwargs):
+        pass
+
+
+class StubBot:
+    def __init__(self):
+        self.tree = StubCommandTree()
+        self.users = {}
+
+    def get_user(self, user_id):
+        return None  # Nothing cached, every name goes through fetch_user
+
+    async def fetch_user(self, user_id):
+        if int(user_id) not in self.users:
+            self.users[int(user_id)] = StubUser(int(user_id))
+        return self.users[int(user_id)]
+
+
+class StubResponse:
+    async def defer(self, *args, **kwargs):
+        pass
+
+
+class StubFollowup:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, *args, file=None, **kwargs):
+        self.sent.append(file.fp.getvalue() if file else b"")
+
+
+class StubInteraction:
+    def __init__(self, user):
+        self.user = user
+        self.response = StubResponse()
+        self.followup = StubFollowup()
+
+
+# ---------------------------------------------------------------- scenarios
+# Each scenario is an async setup() returning an async run() that returns the output size
+
+def quote_scenario(avatar=None, banner=None, content=SHORT_TEXT, repeat=False):
+    async def setup():
+        from cogs.utility.quote import Quote
+        bot = StubBot()
+        cog = Quote(bot)
+        author = StubUser(1, avatar=avatar and StubAsset('a_bench', avatar),
+                          banner=banner and StubAsset('banner_bench', banner))
+        bot.users[author.id] = author
+        same_message = StubMessage(author, content)
+
+        async def run():
+            # A new message id each time (unless repeat), so only asset caches are warm
+            message = same_message if repeat else StubMessage(author, content)
+            buffer, _ = await cog.generate_quote_image(message)
+            return len(buffer.getvalue())
+        return run
+    return setup
+
+
+def tree_scenario(ancestors, descendants, children_per_person, repeat=False):
+    async def setup():
+        tree, marriages = family_fixture(ancestors, descendants, children_per_person)
+        os.makedirs('data', exist_ok=True)
+        with open('data/family_tree.json', 'w') as f:
+            json.dump(tree, f)
+        with open('data/marriages.json', 'w') as f:
+            json.dump(marriages, f)
+
+        from cogs.fun.marriage import Marriage
+        bot = StubBot()
+        cog = Marriage(bot)
+
+        async def run():
+            if not repeat:
+                cog.tree_cache.clear()
+            interaction = StubInteraction(StubUser(1))
+            await cog.tree.callback(cog, interaction, 3)
+            return len(interaction.followup.sent[-1])
+        return run
+    return setup
+
+
+def textbbox_wrap(text, font, max_width):
+    """The old quote wrapping loop: re-measure the whole line for every word"""
+    draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    lines, current_line = [], []
+    for word in text.split():
+        test_line = ' '.join(current_line + [word])
+        bbox = draw.textbbox((0, 0), test_line, font=font)
+        if bbox[2] - bbox[0] <= max_width:
+            current_line.append(word)
+        else:
+            lines.append(' '.join(current_line))
+            current_line = [word]
+    lines.append(' '.join(current_line))
+    return lines
+
+
+def layout_scenario(new_layout):
+    async def setup():
+        from cogs.utils.fonts import get_font
+        from cogs.utils.text_layout import fit_text
+        from cogs.utility.quote_utils import QUOTE_FONT, TEXT_BOX_HEIGHT, TEXT_BOX_WIDTH
+
+        font = get_font(QUOTE_FONT, 45)
+
+        async def run():
+            if new_layout:
+                _, lines, _ = fit_text(LONG_TEXT, QUOTE_FONT, TEXT_BOX_WIDTH, TEXT_BOX_HEIGHT, 24, 60)
+            else:
+                lines = textbbox_wrap(LONG_TEXT, font, TEXT_BOX_WIDTH)
+            return len('\n'.join(lines).encode())
+        return run
+    return setup
+
+
+SCENARIOS = {
+    'quote-static': lambda: quote_scenario(),
+    'quote-long-text': lambda: quote_scenario(content=LONG_TEXT),
+    'quote-banner': lambda: quote_scenario(banner=synthetic_banner()),
+    'quote-animated-10': lambda: quote_scenario(avatar=animated_avatar(10)),
+    'quote-animated-30': lambda: quote_scenario(avatar=animated_avatar(30)),
+    'quote-repeat': lambda: quote_scenario(avatar=animated_avatar(10), repeat=True),
+    'tree-single': lambda: tree_scenario(0, 0, 0),
+    'tree-3-generations': lambda: tree_scenario(1, 1, 3),
+    'tree-5-generations': lambda: tree_scenario(2, 2, 3),
+    'tree-7-generations': lambda: tree_scenario(3, 3, 2),
+    'tree-repeat': lambda: tree_scenario(2, 2, 3, repeat=True),
+    'layout-textbbox-wrap': lambda: layout_scenario(False),
+    'layout-fit-text': lambda: layout_scenario(True),
+}
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if unknown"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except Exception:
+        return None
+
+
+async def run_scenario(name, iterations):
+    """Run one scenario in this process and return its result"""
+    # Render in-process so the RSS and wall time include the Pillow work
+    from cogs.utils import render
+    render._service = render.RenderService(workers=0)
+
+    run = await SCENARIOS[name]()()
+    times = []
+    size = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        size = await run()
+        times.append(time.perf_counter() - start)
+
+    summary = metrics.summarize(times)
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'first_ms': round(times[0] * 1000, 2),
+        'p50_ms': round(summary['p50'] * 1000, 2),
+        'p95_ms': round(summary['p95'] * 1000, 2),
+        'peak_rss_mb': peak_rss_mb(),
+        'output_bytes': size,
+    }
+
+
+def run_isolated(name, iterations):
+    """Run a scenario in a fresh interpreter so its peak RSS isn't shared with others"""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.render_bench', '--run-scenario', name,
+         '--iterations', str(iterations)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(results, baseline=None):
+    before = {r['scenario']: r for r in (baseline or {}).get('results', [])}
+    print(f"{'scenario':<22}{'first ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'rss MB':>9}{'bytes':>10}"
+          + (f"{'p50 vs base':>13}" if before else ''))
+    for r in results:
+        line = (f"{r['scenario']:<22}{r['first_ms']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+                f"{r['peak_rss_mb'] or '-':>9}{r['output_bytes']:>10}")
+        old = before.get(r['scenario'])
+        if old and old['p50_ms']:
+            line += f"{(r['p50_ms'] / old['p50_ms'] - 1):>+13.0%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quote and family tree rendering benchmarks")
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--only', help="run scenarios whose name contains this")
+    parser.add_argument('--json', help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        # Child process: keep data files and caches out of the real data directory
+        os.chdir(tempfile.mkdtemp(prefix='shizu-render-bench-'))
+        print(json.dumps(asyncio.run(run_scenario(args.run_scenario, args.iterations))))
+        return
+
+    names = [name for name in SCENARIOS if not args.only or args.only in name]
+    results = [run_isolated(name, args.iterations) for name in names]
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    commit = git_commit()
+    path = Path(args.json) if args.json else RESULTS_DIR / f"{commit}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'commit': commit, 'iterations': args.iterations, 'results': results}, f, indent=2)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Family tree image rendering.
+Runs inside the render pool, so it only receives ids, display names and links, and returns PNG bytes.
+"""
+import io
+from PIL import Image, ImageDraw
+
+from ..utils.fonts import get_font
+from ..utils.text_layout import text_width
+
+TREE_FONT = "arial.ttf"
+BACKGROUND = '#2C2F33'
+BOX_WIDTH = 180
+BOX_HEIGHT = 50
+H_GAP = 30
+V_GAP = 90
+MARGIN = 60
+TITLE_HEIGHT = 70
+MIN_WIDTH = 1200
+
+USER_COLOR = '#5865F2'
+SPOUSE_COLOR = '#ED4245'
+PARENT_COLOR = '#57F287'
+ANCESTOR_COLOR = '#9B59B6'
+CHILD_COLOR = '#FEE75C'
+
+
+def _fit_name(name, font, max_width):
+    """Shorten a name with an ellipsis until it fits max_width"""
+    if text_width(font, name) <= max_width:
+        return name
+    while name and text_width(font, name + "…") > max_width:
+        name = name[:-1]
+    return name + "…"
+
+
+def _box_style(generation, is_user, is_spouse):
+    """(fill, text colour) for a box by its generation relative to the user (-1 = parents)"""
+    if is_user:
+        return USER_COLOR, 'white'
+    if is_spouse:
+        return SPOUSE_COLOR, 'white'
+    if generation == -1:
+        return PARENT_COLOR, 'white'
+    if generation < -1:
+        return ANCESTOR_COLOR, 'white'
+    return CHILD_COLOR, 'black'
+
+
+def layout_tree(layers):
+    """Centre of every box, one row per generation. Returns ({id: (x, y)}, (width, height))"""
+    widest = max(len(layer) for layer in layers)
+    width = max(MIN_WIDTH, widest * (BOX_WIDTH + H_GAP) - H_GAP + 2 * MARGIN)
+    height = len(layers) * (BOX_HEIGHT + V_GAP) - V_GAP + 2 * MARGIN + TITLE_HEIGHT
+
+    positions = {}
+    for row, layer in enumerate(layers):
+        y = MARGIN + row * (BOX_HEIGHT + V_GAP) + BOX_HEIGHT // 2
+        row_width = len(layer) * (BOX_WIDTH + H_GAP) - H_GAP
+        start_x = (width - row_width) // 2 + BOX_WIDTH // 2
+        for i, member in enumerate(layer):
+            positions[member] = (start_x + i * (BOX_WIDTH + H_GAP), y)
+    return positions, (width, height)
+
+
+def render_family_tree(tree: dict) -> bytes:
+    """
+    Render a family tree image with one row per generation.
+
+    tree keys: user (id), spouse (id or None), title, layers (lists of ids, oldest generation first,
+    the user's row holding the user and spouse), user_layer (index of that row),
+    edges ((parent id, child id) pairs), names (id -> display name)
+    """
+    layers = tree['layers']
+    positions, (img_width, img_height) = layout_tree(layers)
+
+    img = Image.new('RGB', (img_width, img_height), color=BACKGROUND)
+    draw = ImageDraw.Draw(img)
+
+    font = get_font(TREE_FONT, 20)
+    font_small = get_font(TREE_FONT, 16)
+
+    # Links first so boxes are drawn over the line ends
+    for parent_id, child_id in tree['edges']:
+        px, py = positions[parent_id]
+        cx, cy = positions[child_id]
+        draw.line([px, py + BOX_HEIGHT // 2, cx, cy - BOX_HEIGHT // 2], fill='white', width=2)
+
+    user_id, spouse_id = tree['user'], tree.get('spouse')
+    if spouse_id in positions:
+        ux, uy = positions[user_id]
+        sx, _ = positions[spouse_id]
+        draw.line([min(ux, sx) + BOX_WIDTH // 2, uy, max(ux, sx) - BOX_WIDTH // 2, uy], fill='white', width=2)
+
+    for row, layer in enumerate(layers):
+        generation = row - tree['user_layer']
+        for member in layer:
+            x, y = positions[member]
+            is_user = member == user_id
+            fill, text_fill = _box_style(generation, is_user, member == spouse_id)
+            draw.rectangle(
+                [x - BOX_WIDTH // 2, y - BOX_HEIGHT // 2, x + BOX_WIDTH // 2, y + BOX_HEIGHT // 2],
+                fill=fill, outline='white', width=3 if is_user else 2
+            )
+            box_font = font if generation == 0 else font_small
+            name = _fit_name(tree['names'].get(member, "Unknown"), box_font, BOX_WIDTH - 16)
+            draw.text((x, y), name, fill=text_fill, font=box_font, anchor='mm')
+
+    # Add title
+    draw.text((img_width // 2, img_height - TITLE_HEIGHT // 2 - 10), tree['title'], fill='white', font=font, anchor='mm')
+
+    # Save to bytes
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format='PNG')
+    return img_bytes.getvalue()
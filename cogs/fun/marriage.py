@@ -6,14 +6,18 @@ from discord.ext import commands
 from discord import app_commands
 from datetime import datetime
 import logging
+import asyncio
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
 import io
 
+from ..utils import metrics
+from ..utils.lru import ByteLRU
+from ..utils.render import get_render_service
+from .family_tree_utils import render_family_tree
 from .marriage_utils import (
     is_married, get_partner, marry_users, divorce_users,
     get_marriage_data, toggle_joint_balance, get_couple_leaderboard,
-    get_family_data, add_child, can_adopt, get_full_family,
+    get_family_data, add_child, adoption_blocker, get_family_view,
     remove_child, remove_from_family
 )
 
@@ -26,6 +30,16 @@ except ImportError:
 
 logger = logging.getLogger('DiscordBot.Marriage')
 
+TREE_CACHE_BYTES = 8 * 1024 * 1024  # Rendered family tree images kept in memory
+
+ADOPTION_ERRORS = {
+    "self": "❌ You can't adopt yourself!",
+    "two_parents": "❌ {child} already has 2 parents!",
+    "already_child": "❌ {child} is already your child!",
+    "ancestor": "❌ You can't adopt {child}, they're already your parent or grandparent!",
+    "partner": "❌ You can't adopt your partner!",
+}
+
 
 class ProposalView(discord.ui.View):
     """Interactive view for marriage proposals"""
@@ -110,6 +124,15 @@ class AdoptionView(discord.ui.View):
             await interaction.response.send_message("This adoption request isn't for you!", ephemeral=True)
             return
         
+        # The family may have changed while the request was open
+        blocker = adoption_blocker(self.parent.id, self.child.id)
+        if blocker:
+            self.stop()
+            await interaction.response.edit_message(
+                content=ADOPTION_ERRORS[blocker].format(child=self.child.mention), embed=None, view=None
+            )
+            return
+        
         self.value = True
         self.stop()
         
@@ -148,6 +171,7 @@ class Marriage(commands.Cog):
     
     def __init__(self, bot):
         self.bot = bot
+        self.tree_cache = ByteLRU(TREE_CACHE_BYTES)
     
     @app_commands.command(name="propose", description="Propose marriage to another user")
     @app_commands.describe(user="User to propose to")
@@ -339,8 +363,9 @@ class Marriage(commands.Cog):
             await interaction.response.send_message("❌ You can't adopt a bot!", ephemeral=True)
             return
         
-        if not can_adopt(interaction.user.id, user.id):
-            await interaction.response.send_message(f"❌ {user.mention} already has 2 parents!", ephemeral=True)
+        blocker = adoption_blocker(interaction.user.id, user.id)
+        if blocker:
+            await interaction.response.send_message(ADOPTION_ERRORS[blocker].format(child=user.mention), ephemeral=True)
             return
         
         # Create adoption embed
@@ -414,114 +439,61 @@ class Marriage(commands.Cog):
         else:
             await interaction.response.send_message("❌ Failed to leave family. Please try again.", ephemeral=True)
     
-    @app_commands.command(name="tree", description="View your family tree")
-    async def tree(self, interaction: discord.Interaction):
-        """Generate and display family tree image"""
-        await interaction.response.defer()
-        
-        # Get family data
-        family = get_full_family(interaction.user.id)
-        
-        # Create image
-        img_width = 1200
-        img_height = 800
-        img = Image.new('RGB', (img_width, img_height), color='#2C2F33')
-        draw = ImageDraw.Draw(img)
-        
-        # Try to load a font
-        try:
-            font = ImageFont.truetype("arial.ttf", 20)
-            font_small = ImageFont.truetype("arial.ttf", 16)
-        except:
-            font = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-        
-        # Define positions
-        center_x = img_width // 2
-        user_y = 400
-        
-        # Draw user (highlighted in blue)
-        user_name = interaction.user.display_name
-        draw.rectangle([center_x - 100, user_y - 30, center_x + 100, user_y + 30], fill='#5865F2', outline='white', width=3)
-        draw.text((center_x, user_y), user_name, fill='white', font=font, anchor='mm')
+    async def fetch_names(self, user_ids):
+        """Display names for user IDs (id -> name), from the client cache first and then fetched concurrently"""
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            user = self.bot.get_user(int(user_id))
+            if user:
+                names[user_id] = user.display_name
+            else:
+                missing.append(user_id)
         
-        # Draw spouse
-        if family["spouse"]:
+        async def fetch_name(user_id):
             try:
-                spouse = await self.bot.fetch_user(int(family["spouse"]))
-                spouse_name = spouse.display_name
-                spouse_x = center_x + 250
-                draw.rectangle([spouse_x - 100, user_y - 30, spouse_x + 100, user_y + 30], fill='#ED4245', outline='white', width=2)
-                draw.text((spouse_x, user_y), spouse_name, fill='white', font=font, anchor='mm')
-                # Draw connection line
-                draw.line([center_x + 100, user_y, spouse_x - 100, user_y], fill='white', width=2)
+                user = await self.bot.fetch_user(int(user_id))
+                return user.display_name
             except:
-                pass
+                return None
         
-        # Draw parents
-        if family["parents"]:
-            parent_y = 200
-            parent_spacing = 250
-            start_x = center_x - (len(family["parents"]) - 1) * parent_spacing // 2
-            
-            for i, parent_id in enumerate(family["parents"][:2]):
-                try:
-                    parent = await self.bot.fetch_user(int(parent_id))
-                    parent_name = parent.display_name
-                    parent_x = start_x + i * parent_spacing
-                    draw.rectangle([parent_x - 80, parent_y - 25, parent_x + 80, parent_y + 25], fill='#57F287', outline='white', width=2)
-                    draw.text((parent_x, parent_y), parent_name, fill='white', font=font_small, anchor='mm')
-                    # Draw line to user
-                    draw.line([parent_x, parent_y + 25, center_x, user_y - 30], fill='white', width=2)
-                except:
-                    pass
-        
-        # Draw children
-        if family["children"]:
-            child_y = 600
-            child_spacing = 200
-            num_children = min(len(family["children"]), 5)
-            start_x = center_x - (num_children - 1) * child_spacing // 2
-            
-            for i, child_id in enumerate(family["children"][:5]):
-                try:
-                    child = await self.bot.fetch_user(int(child_id))
-                    child_name = child.display_name
-                    child_x = start_x + i * child_spacing
-                    draw.rectangle([child_x - 70, child_y - 25, child_x + 70, child_y + 25], fill='#FEE75C', outline='white', width=2)
-                    draw.text((child_x, child_y), child_name, fill='black', font=font_small, anchor='mm')
-                    # Draw line from user
-                    draw.line([center_x, user_y + 30, child_x, child_y - 25], fill='white', width=2)
-                except:
-                    pass
-        
-        # Draw grandparents
-        if family["grandparents"]:
-            gp_y = 50
-            gp_spacing = 200
-            num_gp = min(len(family["grandparents"]), 4)
-            start_x = center_x - (num_gp - 1) * gp_spacing // 2
-            
-            for i, gp_id in enumerate(family["grandparents"][:4]):
-                try:
-                    gp = await self.bot.fetch_user(int(gp_id))
-                    gp_name = gp.display_name[:10]
-                    gp_x = start_x + i * gp_spacing
-                    draw.rectangle([gp_x - 60, gp_y - 20, gp_x + 60, gp_y + 20], fill='#9B59B6', outline='white', width=2)
-                    draw.text((gp_x, gp_y), gp_name, fill='white', font=font_small, anchor='mm')
-                except:
-                    pass
-        
-        # Add title
-        draw.text((center_x, 750), f"{user_name}'s Family Tree", fill='white', font=font, anchor='mm')
-        
-        # Save to bytes
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format='PNG')
-        img_bytes.seek(0)
+        fetched = await asyncio.gather(*(fetch_name(user_id) for user_id in missing))
+        names.update((user_id, name) for user_id, name in zip(missing, fetched) if name)
+        return names
+    
+    @app_commands.command(name="tree", description="View your family tree")
+    @app_commands.describe(generations="How many generations to show above and below you")
+    async def tree(self, interaction: discord.Interaction, generations: app_commands.Range[int, 1, 4] = 2):
+        """Generate and display family tree image"""
+        await interaction.response.defer()
+        
+        # Family links come from the in-memory graph, names from the client cache or the API
+        view = get_family_view(interaction.user.id, generations)
+        member_ids = [member for layer in view["layers"] for member in layer]
+        names = await self.fetch_names([member for member in member_ids if member != str(interaction.user.id)])
+        names[str(interaction.user.id)] = interaction.user.display_name
+        
+        # Reuse the image until the family (version) or someone's name changes
+        cache_key = (interaction.user.id, generations, view["version"], tuple(sorted(names.items())))
+        image = self.tree_cache.get(cache_key)
+        if image is None:
+            metrics.increment('tree.cache.miss')
+            tree_data = {
+                "user": str(interaction.user.id),
+                "spouse": view["spouse"],
+                "title": f"{interaction.user.display_name}'s Family Tree",
+                "layers": view["layers"],
+                "user_layer": view["user_layer"],
+                "edges": view["edges"],
+                "names": names,
+            }
+            image = await get_render_service().render(render_family_tree, tree_data)
+            self.tree_cache.put(cache_key, image)
+        else:
+            metrics.increment('tree.cache.hit')
         
         # Send image
-        file = discord.File(img_bytes, filename='family_tree.png')
+        file = discord.File(io.BytesIO(image), filename='family_tree.png')
         embed = discord.Embed(
             title=f"🌳 {interaction.user.display_name}'s Family Tree",
             color=discord.Color.green()
@@ -5,6 +5,7 @@ import json
 from pathlib import Path
 from datetime import datetime
 import logging
+from collections import deque
 
 logger = logging.getLogger('DiscordBot.Marriage')
 
@@ -54,6 +55,147 @@ def save_family_tree(data):
     except Exception as e:
         logger.error(f"Failed to save family tree: {e}")
 
+
+class FamilyGraph:
+    """
+    In-memory family index: parent/child/spouse links in both directions for O(1) lookups.
+    Every user has a version that changes whenever anything in their connected family changes,
+    so rendered trees can be cached per (user, version).
+    """
+
+    def __init__(self):
+        self._parents = {}   # user id -> set of parent ids
+        self._children = {}  # user id -> set of child ids
+        self._spouse = {}    # user id -> spouse id
+        self._versions = {}  # user id -> family version
+        self._clock = 0
+
+    @classmethod
+    def build(cls, tree: dict, marriages: dict):
+        """Build the graph from family_tree.json and marriages.json data"""
+        graph = cls()
+        for user_id, data in tree.items():
+            for parent_id in data.get("parent_ids", []):
+                graph._link(parent_id, user_id)
+            for child_id in data.get("children_ids", []):
+                graph._link(user_id, child_id)
+        for user_id, data in marriages.items():
+            if data.get("partner_id"):
+                graph._spouse[str(user_id)] = str(data["partner_id"])
+        return graph
+
+    def parents(self, user_id):
+        return self._parents.get(str(user_id), set())
+
+    def children(self, user_id):
+        return self._children.get(str(user_id), set())
+
+    def spouse(self, user_id):
+        return self._spouse.get(str(user_id))
+
+    def version(self, user_id) -> int:
+        return self._versions.get(str(user_id), 0)
+
+    def _link(self, parent_id, child_id):
+        self._children.setdefault(str(parent_id), set()).add(str(child_id))
+        self._parents.setdefault(str(child_id), set()).add(str(parent_id))
+
+    def _touch(self, *user_ids):
+        """Bump the version of everyone connected to these users"""
+        self._clock += 1
+        for user_id in self.connected(*user_ids):
+            self._versions[user_id] = self._clock
+
+    def connected(self, *user_ids):
+        """Everyone reachable from these users through parent, child or spouse links"""
+        seen = set()
+        queue = deque(str(user_id) for user_id in user_ids)
+        while queue:
+            user_id = queue.popleft()
+            if user_id in seen:
+                continue
+            seen.add(user_id)
+            queue.extend(self.parents(user_id))
+            queue.extend(self.children(user_id))
+            spouse = self.spouse(user_id)
+            if spouse:
+                queue.append(spouse)
+        return seen
+
+    def add_parent(self, parent_id, child_id):
+        self._link(parent_id, child_id)
+        self._touch(parent_id, child_id)
+
+    def remove_parent(self, parent_id, child_id):
+        # Touch first: removing the link may split the family in two
+        self._touch(parent_id, child_id)
+        self._children.get(str(parent_id), set()).discard(str(child_id))
+        self._parents.get(str(child_id), set()).discard(str(parent_id))
+
+    def set_spouse(self, user1_id, user2_id):
+        self._spouse[str(user1_id)] = str(user2_id)
+        self._spouse[str(user2_id)] = str(user1_id)
+        self._touch(user1_id)
+
+    def remove_spouse(self, user_id):
+        self._touch(user_id)
+        partner_id = self._spouse.pop(str(user_id), None)
+        if partner_id:
+            self._spouse.pop(partner_id, None)
+
+    def isolate(self, user_id):
+        """Remove all parent and child links of a user"""
+        user_id = str(user_id)
+        self._touch(user_id)
+        for parent_id in self._parents.pop(user_id, set()):
+            self._children.get(parent_id, set()).discard(user_id)
+        for child_id in self._children.pop(user_id, set()):
+            self._parents.get(child_id, set()).discard(user_id)
+
+    def generations(self, user_id, depth: int, up: bool):
+        """BFS over ancestors (up) or descendants, one list of ids per generation"""
+        step = self.parents if up else self.children
+        seen = {str(user_id)}
+        layers = []
+        layer = [str(user_id)]
+        for _ in range(depth):
+            next_layer = []
+            for member in layer:
+                for relative in sorted(step(member)):
+                    if relative not in seen:
+                        seen.add(relative)
+                        next_layer.append(relative)
+            if not next_layer:
+                break
+            layers.append(next_layer)
+            layer = next_layer
+        return layers
+
+    def is_ancestor(self, ancestor_id, user_id) -> bool:
+        """Whether ancestor_id is a parent, grandparent... of user_id"""
+        target = str(ancestor_id)
+        seen = set()
+        queue = deque(self.parents(user_id))
+        while queue:
+            member = queue.popleft()
+            if member == target:
+                return True
+            if member not in seen:
+                seen.add(member)
+                queue.extend(self.parents(member))
+        return False
+
+
+_graph = None
+
+
+def get_family_graph() -> FamilyGraph:
+    """Get the family graph, loading it from disk the first time"""
+    global _graph
+    if _graph is None:
+        _graph = FamilyGraph.build(load_family_tree(), load_marriages())
+    return _graph
+
 def is_married(user_id):
     """Check if user is married"""
     marriages = load_marriages()
@@ -85,6 +227,7 @@ def marry_users(user1_id, user2_id):
     }
     
     save_marriages(marriages)
+    get_family_graph().set_spouse(user1_id, user2_id)
 
 def divorce_users(user_id):
     """Divorce user and their partner"""
@@ -100,6 +243,7 @@ def divorce_users(user_id):
             del marriages[partner_id]
         
         save_marriages(marriages)
+        get_family_graph().remove_spouse(user_id)
         return partner_id
     
     return None
@@ -207,46 +351,85 @@ def add_child(parent_id, child_id):
             tree[child_id_str]["parent_ids"].append(partner_id_str)
     
     save_family_tree(tree)
+    
+    graph = get_family_graph()
+    graph.add_parent(parent_id, child_id)
+    if partner_id:
+        graph.add_parent(partner_id, child_id)
 
-def can_adopt(parent_id, child_id):
-    """Check if parent can adopt child"""
-    tree = load_family_tree()
+def adoption_blocker(parent_id, child_id):
+    """Reason parent can't adopt child, or None if they can"""
+    graph = get_family_graph()
     child_id_str = str(child_id)
     
+    if str(parent_id) == child_id_str:
+        return "self"
+    
     # Check if child already has 2 parents
-    if child_id_str in tree:
-        if len(tree[child_id_str].get("parent_ids", [])) >= 2:
-            return False
+    if len(graph.parents(child_id)) >= 2:
+        return "two_parents"
     
-    return True
+    if child_id_str in graph.children(parent_id):
+        return "already_child"
+    
+    # Adopting your own ancestor (or your partner's, who becomes a parent too) would make a cycle
+    partner_id = graph.spouse(parent_id)
+    if graph.is_ancestor(child_id, parent_id) or (partner_id and graph.is_ancestor(child_id, partner_id)):
+        return "ancestor"
+    if partner_id == child_id_str:
+        return "partner"
+    
+    return None
+
+def can_adopt(parent_id, child_id):
+    """Check if parent can adopt child"""
+    return adoption_blocker(parent_id, child_id) is None
 
 def get_full_family(user_id):
     """Get complete family tree for user"""
-    tree = load_family_tree()
+    graph = get_family_graph()
+    parents = sorted(graph.parents(user_id))
+    
+    return {
+        "user_id": str(user_id),
+        "parents": parents,
+        "children": sorted(graph.children(user_id)),
+        "grandparents": [gp for parent_id in parents for gp in sorted(graph.parents(parent_id))],
+        "spouse": graph.spouse(user_id)
+    }
+
+def get_family_view(user_id, generations=2, max_per_generation=12):
+    """
+    Ancestors and descendants of a user for drawing a tree, up to `generations` in each direction
+    and max_per_generation users per generation.
+    Returns a dict with layers (lists of user ids, oldest generation first; the user's layer also
+    holds their spouse), user_layer (index of the user's layer), spouse, edges ((parent id, child id)
+    pairs between shown users) and version (changes whenever the family changes)
+    """
+    graph = get_family_graph()
     user_id_str = str(user_id)
     
-    family = {
-        "user_id": user_id_str,
-        "parents": [],
-        "children": [],
-        "grandparents": [],
-        "spouse": None
+    ancestors = graph.generations(user_id, generations, up=True)
+    descendants = graph.generations(user_id, generations, up=False)
+    middle = [user_id_str]
+    spouse = graph.spouse(user_id)
+    if spouse:
+        middle.append(spouse)
+    
+    layers = [layer[:max_per_generation] for layer in list(reversed(ancestors)) + [middle] + descendants]
+    shown = {member for layer in layers for member in layer}
+    edges = [
+        (parent_id, member)
+        for layer in layers for member in layer
+        for parent_id in sorted(graph.parents(member)) if parent_id in shown
+    ]
+    return {
+        "layers": layers,
+        "user_layer": len(ancestors),
+        "spouse": spouse,
+        "edges": edges,
+        "version": graph.version(user_id)
     }
-    
-    # Get user data
-    user_data = tree.get(user_id_str, {"parent_ids": [], "children_ids": []})
-    family["parents"] = user_data.get("parent_ids", [])
-    family["children"] = user_data.get("children_ids", [])
-    
-    # Get spouse
-    family["spouse"] = get_partner(user_id)
-    
-    # Get grandparents
-    for parent_id in family["parents"]:
-        parent_data = tree.get(parent_id, {"parent_ids": []})
-        family["grandparents"].extend(parent_data.get("parent_ids", []))
-    
-    return family
 
 def remove_child(parent_id, child_id):
     """Remove a child from parent's family (disown)"""
@@ -277,6 +460,11 @@ def remove_child(parent_id, child_id):
                 tree[child_id_str]["parent_ids"].remove(partner_id_str)
     
     save_family_tree(tree)
+    
+    graph = get_family_graph()
+    graph.remove_parent(parent_id, child_id)
+    if partner_id:
+        graph.remove_parent(partner_id, child_id)
     return True
 
 def remove_from_family(user_id):
@@ -308,4 +496,5 @@ def remove_from_family(user_id):
     }
     
     save_family_tree(tree)
+    get_family_graph().isolate(user_id)
     return True
@@ -4,6 +4,7 @@ from discord.ext import commands
 from discord import app_commands
 import json
 import os
+from ..utils import metrics
 
 SUPERUSERS_FILE = "data/superusers.json"
 
@@ -90,5 +91,34 @@ class Admin(commands.Cog):
             embed = discord.Embed(title="👑 Superusers", description=txt, color=discord.Color.gold())
             await interaction.response.send_message(embed=embed, ephemeral=True)
 
+    @group.command(name="metrics", description="Show internal performance counters")
+    async def show_metrics(self, interaction: discord.Interaction):
+        # Only Owner can view metrics
+        if not self.is_owner(interaction):
+            await interaction.response.send_message("❌ Only the Bot Owner can use this command.", ephemeral=True)
+            return
+
+        data = metrics.snapshot()
+        lines = []
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"{name}: {value}")
+            if name.endswith(".hit"):
+                rate = metrics.hit_rate(name[:-len(".hit")])
+                lines.append(f"{name[:-len('.hit')]}.hit_rate: {rate:.1%}")
+        for name, value in sorted(data["gauges"].items()):
+            lines.append(f"{name}: {value}")
+        for name, stats in sorted(data["timings"].items()):
+            lines.append(f"{name}: n={stats['count']} p50={stats['p50']:.1f} p95={stats['p95']:.1f} p99={stats['p99']:.1f}")
+
+        if not lines:
+            await interaction.response.send_message("No metrics recorded yet.", ephemeral=True)
+            return
+
+        txt = "\n".join(lines)
+        if len(txt) > 4000:
+            txt = txt[:4000] + "\n..."
+        embed = discord.Embed(title="📊 Metrics", description=f"```\n{txt}\n```", color=discord.Color.blurple())
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
 async def setup(bot):
     await bot.add_cog(Admin(bot))
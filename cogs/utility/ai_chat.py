@@ -3,8 +3,9 @@ AI Chat Cog - Conversational AI using Ollama
 """
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 import logging
+from datetime import datetime
 from typing import Optional
 from .ai_chat_utils import (
     get_ollama_response,
@@ -15,8 +16,12 @@ from .ai_chat_utils import (
     set_ai_channel,
     remove_ai_channel,
     get_ai_channels,
-    is_ai_enabled_channel
+    is_ai_enabled_channel,
+    set_memory_enabled,
+    is_memory_enabled
 )
+from .ai_memory_utils import NUMPY_AVAILABLE, recall, remember_exchange, forget_user, flush_memories
+from ..utils.messages import remember_bot_message, is_reply_to
 
 logger = logging.getLogger('DiscordBot.AIChat')
 
@@ -30,8 +35,19 @@ class AIChat(commands.Cog):
     
     async def cog_load(self):
         """Called when the cog is loaded"""
+        self.flush_memory_task.start()
         logger.info("AI Chat cog loaded")
     
+    async def cog_unload(self):
+        """Save long-term memories before unloading"""
+        self.flush_memory_task.cancel()
+        await flush_memories()
+    
+    @tasks.loop(minutes=5)
+    async def flush_memory_task(self):
+        """Periodically write changed memory indexes to disk"""
+        await flush_memories()
+    
     @commands.Cog.listener()
     async def on_ready(self):
         """Store bot user ID when ready"""
@@ -40,7 +56,12 @@ class AIChat(commands.Cog):
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Listen for mentions and replies to bot messages"""
-        # Ignore bot's own messages
+        # Track our own messages so replies to them resolve without a fetch
+        if message.author.id == self.bot.user.id:
+            remember_bot_message(message.id)
+            return
+        
+        # Ignore other bots
         if message.author.bot:
             return
         
@@ -62,8 +83,7 @@ class AIChat(commands.Cog):
         is_reply_to_bot = False
         if message.reference and message.reference.message_id:
             try:
-                referenced_msg = await message.channel.fetch_message(message.reference.message_id)
-                is_reply_to_bot = referenced_msg.author.id == self.bot.user.id
+                is_reply_to_bot = await is_reply_to(self.bot, message)
             except:
                 pass
         
@@ -99,7 +119,17 @@ class AIChat(commands.Cog):
                 # Get AI response
                 # Pass guild_id if in guild, None if in DM
                 guild_id = message.guild.id if message.guild else None
-                result = await get_ollama_response(content, conversation_history, guild_id)
+                
+                # Recall relevant exchanges from before this conversation (opt-in per guild)
+                use_memory = bool(guild_id) and NUMPY_AVAILABLE and await is_memory_enabled(guild_id)
+                memories = None
+                if use_memory:
+                    started_at = None
+                    if conversation_history:
+                        started_at = datetime.fromisoformat(conversation_history[0]['timestamp']).timestamp()
+                    memories = await recall(guild_id, message.author.id, content, before=started_at)
+                
+                result = await get_ollama_response(content, conversation_history, guild_id, message.author.id, memories)
                 
                 if result['success']:
                     response_text = result['response']
@@ -115,6 +145,9 @@ class AIChat(commands.Cog):
                             await message.reply(chunk, mention_author=True)
                     else:
                         await message.reply(response_text, mention_author=True)
+                    
+                    if use_memory:
+                        await remember_exchange(guild_id, message.author.id, content, response_text)
                 else:
                     # Check if it's a connection error (server offline)
                     error_str = str(result['error']).lower()
@@ -249,7 +282,7 @@ class AIChat(commands.Cog):
             from .ai_chat_utils import OLLAMA_API, OLLAMA_MODEL, get_ollama_response
             
             # Test simple request
-            result = await get_ollama_response("Say 'Hello, I'm working!' in one sentence.")
+            result = await get_ollama_response("Say 'Hello, I'm working!' in one sentence.", use_cache=False)
             
             if result['success']:
                 await interaction.followup.send(
@@ -275,6 +308,57 @@ class AIChat(commands.Cog):
                 ephemeral=True
             )
     
+    @app_commands.command(name="aimemory", description="Enable or disable long-term AI memory in this server")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(enabled="Remember past conversations between chats")
+    async def ai_memory_command(self, interaction: discord.Interaction, enabled: bool):
+        """Toggle long-term memory for the guild"""
+        if enabled and not NUMPY_AVAILABLE:
+            await interaction.response.send_message(
+                "❌ Long-term memory requires NumPy to be installed.",
+                ephemeral=True
+            )
+            return
+        
+        try:
+            await set_memory_enabled(interaction.guild.id, enabled)
+            if enabled:
+                await interaction.response.send_message(
+                    "🧠 Long-term memory enabled! I'll remember past chats with each user.\n"
+                    "💡 Users can run `/forgetme` to erase what I remember about them.",
+                    ephemeral=True
+                )
+            else:
+                await interaction.response.send_message("🧠 Long-term memory disabled.", ephemeral=True)
+            logger.info(f"Long-term memory {'enabled' if enabled else 'disabled'} (Guild: {interaction.guild.id})")
+        
+        except Exception as e:
+            logger.error(f"Error setting AI memory: {e}", exc_info=True)
+            await interaction.response.send_message(
+                "❌ An error occurred while updating AI memory.",
+                ephemeral=True
+            )
+    
+    @app_commands.command(name="forgetme", description="Erase everything the AI remembers about you in this server")
+    async def forget_me_command(self, interaction: discord.Interaction):
+        """Delete the user's long-term memories"""
+        try:
+            guild_id = interaction.guild.id if interaction.guild else None
+            removed = await forget_user(guild_id, interaction.user.id)
+            await flush_memories()
+            await interaction.response.send_message(
+                f"🧹 Forgot {removed} past exchange(s) with you.",
+                ephemeral=True
+            )
+            logger.info(f"Forgot {removed} memories for user {interaction.user.id}")
+        
+        except Exception as e:
+            logger.error(f"Error forgetting memories: {e}", exc_info=True)
+            await interaction.response.send_message(
+                "❌ An error occurred while erasing your memories.",
+                ephemeral=True
+            )
+    
     @app_commands.command(name="clearmychat", description="Clear your conversation history with the AI")
     async def clear_my_chat_command(self, interaction: discord.Interaction):
         """Clear user's conversation history"""
@@ -4,12 +4,17 @@ AI Chat utility functions for managing conversations with Ollama
 import json
 import aiohttp
 import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime, timedelta
 import random
 import os
 from dotenv import load_dotenv
 
+from ..utils import metrics
+
 load_dotenv()
 
 # File paths
@@ -19,16 +24,42 @@ AI_SETTINGS_FILE = Path('data/ai_settings.json')
 # Ollama configuration
 OLLAMA_TUNNEL_URL = os.getenv('OLLAMA_TUNNEL_URL', 'localhost:11434')
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'themhv/neuralhermes')
-OLLAMA_API = f"https://{OLLAMA_TUNNEL_URL}/api/generate"
+# Tunnels are HTTPS; a full URL (e.g. http://127.0.0.1:11434 for a local server) is used as-is
+if OLLAMA_TUNNEL_URL.startswith(('http://', 'https://')):
+    OLLAMA_API = f"{OLLAMA_TUNNEL_URL.rstrip('/')}/api/generate"
+else:
+    OLLAMA_API = f"https://{OLLAMA_TUNNEL_URL}/api/generate"
 
 # Conversation settings
 MAX_HISTORY_MESSAGES = 20  # Keep last 20 messages per conversation
+HISTORY_HARD_LIMIT = MAX_HISTORY_MESSAGES * 2  # Older turns are dropped past this even if summarizing keeps failing
 CONVERSATION_TIMEOUT = timedelta(hours=2)  # Clear conversation after 2 hours of inactivity
 
+# Prompt budget settings (tokens are estimated, ~4 characters per token)
+PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', '1500'))  # System prompt + summary + history + message
+SUMMARY_TOKEN_BUDGET = int(os.getenv('AI_SUMMARY_TOKEN_BUDGET', '200'))  # Max size of the rolling summary
+MEMORY_TOKEN_BUDGET = int(os.getenv('AI_MEMORY_TOKEN_BUDGET', '150'))  # Max size of recalled long-term memories
+CHARS_PER_TOKEN = 4
+
+# Response cache for repeated prompts (size 0 disables it)
+RESPONSE_CACHE_SIZE = int(os.getenv('AI_RESPONSE_CACHE_SIZE', '256'))  # Max cached prompts
+RESPONSE_CACHE_TTL = int(os.getenv('AI_RESPONSE_CACHE_TTL', '3600'))  # Seconds a cached reply stays valid
+RESPONSE_CACHE_VARIANTS = int(os.getenv('AI_RESPONSE_CACHE_VARIANTS', '3'))  # Replies kept per prompt
+RESPONSE_CACHE_EXPLORE = float(os.getenv('AI_RESPONSE_CACHE_EXPLORE', '0.3'))  # Chance to generate another variant
+RESPONSE_CACHE_HISTORY = 2  # Previous messages included in the cache key
+
 # Thread locks for file operations
 _history_lock = asyncio.Lock()
 _settings_lock = asyncio.Lock()
 
+# Rolling summaries of older turns, per user conversation
+# user_id_str -> {'summary': str, 'covered_until': timestamp of the last folded message}
+_summaries = {}
+_summary_tasks = {}  # user_id_str -> running summarization task
+
+# Cache key -> list of (raw reply, cached_at), least recently used first
+_response_cache = OrderedDict()
+
 # Personality traits and emotions
 PERSONALITY_TRAITS = [
     "playful", "friendly", "helpful", "witty", "energetic", 
@@ -144,7 +175,265 @@ def save_ai_settings(data):
         json.dump(data, f, indent=2, ensure_ascii=False)
 
 
-async def get_ollama_response(prompt: str, conversation_history: list = None, guild_id: int = None) -> dict:
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a piece of text"""
+    if not text:
+        return 0
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def format_history_line(msg: dict) -> str:
+    """Format a stored history message as a prompt line"""
+    role = msg.get('role', 'user')
+    content = msg.get('content', '')
+    return f"{role.capitalize()}: {content}\n"
+
+
+def prior_history(prompt: str, conversation_history: list = None) -> list:
+    """History before the current message (which is already stored as the last entry)"""
+    history = list(conversation_history or [])
+    if history and history[-1].get('role') == 'user' and history[-1].get('content') == prompt:
+        history = history[:-1]
+    return history
+
+
+def build_prompt(system_prompt: str, prompt: str, conversation_history: list = None,
+                 summary: str = None, memories: list = None, token_budget: int = PROMPT_TOKEN_BUDGET):
+    """
+    Build the full prompt, fitting as much recent history as the token budget allows
+    
+    Returns:
+        (full_prompt, overflow) where overflow is the list of older messages
+        that did not fit and should be folded into the rolling summary
+    """
+    history = prior_history(prompt, conversation_history)
+    
+    head = system_prompt + "\n\n"
+    if memories:
+        # Recalled memories get a fixed slice of the budget, most relevant first
+        memory_lines = ""
+        for memory in memories:
+            line = f"- {memory}\n"
+            if estimate_tokens(memory_lines + line) > MEMORY_TOKEN_BUDGET:
+                break
+            memory_lines += line
+        if memory_lines:
+            head += f"Things you remember from earlier chats with this user:\n{memory_lines}\n"
+    if summary:
+        head += f"Summary of the earlier conversation:\n{summary}\n\n"
+    tail = f"\nUser: {prompt}\nAssistant:"
+    
+    remaining = token_budget - estimate_tokens(head) - estimate_tokens(tail)
+    
+    # Walk backwards from the newest message until the budget runs out
+    kept = []
+    cutoff = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        line = format_history_line(history[i])
+        cost = estimate_tokens(line)
+        if cost > remaining:
+            break
+        kept.append(line)
+        remaining -= cost
+        cutoff = i
+    kept.reverse()
+    
+    full_prompt = head
+    if kept:
+        full_prompt += "Conversation history:\n" + "".join(kept)
+    full_prompt += tail
+    
+    return full_prompt, history[:cutoff]
+
+
+def get_cached_summary(user_id: int) -> str:
+    """Get the rolling summary for a user's conversation, or None if nothing has been folded yet"""
+    cached = _summaries.get(str(user_id))
+    return cached['summary'] if cached else None
+
+
+def drop_summary(user_id: int) -> None:
+    """Forget the rolling summary for a user's conversation"""
+    user_id_str = str(user_id)
+    _summaries.pop(user_id_str, None)
+    task = _summary_tasks.pop(user_id_str, None)
+    if task and not task.done():
+        task.cancel()
+
+
+def schedule_summary_update(user_id: int, overflow: list) -> None:
+    """Fold overflowed messages into the rolling summary in the background"""
+    user_id_str = str(user_id)
+    cached = _summaries.get(user_id_str)
+    covered_until = cached['covered_until'] if cached else None
+    
+    # Only summarize messages that are newer than what the summary already covers
+    pending = [m for m in overflow if not covered_until or m.get('timestamp', '') > covered_until]
+    if not pending:
+        return
+    
+    # One summarization per conversation at a time; the next reply will pick up the rest
+    running = _summary_tasks.get(user_id_str)
+    if running and not running.done():
+        return
+    
+    previous = cached['summary'] if cached else None
+    _summary_tasks[user_id_str] = asyncio.create_task(_update_summary(user_id_str, previous, pending))
+
+
+def trim_history(user_id: int, messages: list) -> list:
+    """
+    Apply MAX_HISTORY_MESSAGES without losing context: turns past the cap are folded into the
+    rolling summary first and only dropped once it covers them (or past HISTORY_HARD_LIMIT)
+    """
+    excess = messages[:-MAX_HISTORY_MESSAGES]
+    if not excess:
+        return messages
+    schedule_summary_update(user_id, excess)
+    
+    cached = _summaries.get(str(user_id))
+    covered_until = cached['covered_until'] if cached else None
+    covered = 0
+    for msg in excess:
+        if not covered_until or msg.get('timestamp', '') > covered_until:
+            break
+        covered += 1
+    return messages[max(covered, len(messages) - HISTORY_HARD_LIMIT):]
+
+
+async def _update_summary(user_id_str: str, previous: str, pending: list) -> None:
+    """Generate a new rolling summary from the previous one plus newly overflowed messages"""
+    summary_prompt = (
+        "Summarize this chat between a User and an Assistant in at most 3 short sentences. "
+        "Keep names, facts and anything the user asked to remember.\n\n"
+    )
+    if previous:
+        summary_prompt += f"Existing summary:\n{previous}\n\n"
+    summary_prompt += "New messages:\n" + "".join(format_history_line(m) for m in pending)
+    summary_prompt += "\nSummary:"
+    
+    try:
+        status, data = await _ollama_generate(summary_prompt, timeout=60)
+        if status != 200:
+            return
+        summary = data.get('response', '').strip()
+        if not summary:
+            return
+        
+        # Keep the summary itself within budget
+        max_chars = SUMMARY_TOKEN_BUDGET * CHARS_PER_TOKEN
+        if len(summary) > max_chars:
+            summary = summary[:max_chars].rsplit(' ', 1)[0]
+        
+        _summaries[user_id_str] = {
+            'summary': summary,
+            'covered_until': pending[-1].get('timestamp', '')
+        }
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # Summaries are best effort - the reply path never waits on them
+        pass
+    finally:
+        if _summary_tasks.get(user_id_str) is asyncio.current_task():
+            del _summary_tasks[user_id_str]
+
+
+def normalize_prompt(text: str) -> str:
+    """Normalize a prompt for cache lookups (case, whitespace, trailing punctuation)"""
+    return ' '.join(text.lower().split()).strip('!?.~ ')
+
+
+def response_cache_key(system_prompt: str, prompt: str, conversation_history: list = None,
+                       summary: str = None, memories: list = None) -> str:
+    """Cache key from the system prompt, normalized prompt and a short history fingerprint"""
+    recent = prior_history(prompt, conversation_history)[-RESPONSE_CACHE_HISTORY:]
+    fingerprint = [f"{m.get('role')}:{normalize_prompt(m.get('content', ''))}" for m in recent]
+    if summary:
+        fingerprint.append(f"summary:{summary}")
+    if memories:
+        fingerprint.extend(f"memory:{m}" for m in memories)
+    
+    digest = hashlib.sha1()
+    for part in (system_prompt, normalize_prompt(prompt), *fingerprint):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_cached_response(key: str) -> str:
+    """Get a random cached reply for a key, or None on a miss"""
+    if RESPONSE_CACHE_SIZE <= 0:
+        return None
+    
+    variants = _response_cache.get(key)
+    if variants:
+        now = time.monotonic()
+        variants[:] = [v for v in variants if now - v[1] < RESPONSE_CACHE_TTL]
+        if not variants:
+            del _response_cache[key]
+    
+    # Sometimes let a request through to collect another variant
+    if not variants or (len(variants) < RESPONSE_CACHE_VARIANTS and random.random() < RESPONSE_CACHE_EXPLORE):
+        metrics.increment('ai.response_cache.miss')
+        return None
+    
+    _response_cache.move_to_end(key)
+    metrics.increment('ai.response_cache.hit')
+    return random.choice(variants)[0]
+
+
+def cache_response(key: str, response: str) -> None:
+    """Store a generated reply as one of the variants for a key"""
+    if RESPONSE_CACHE_SIZE <= 0 or not response:
+        return
+    
+    variants = _response_cache.setdefault(key, [])
+    variants.append((response, time.monotonic()))
+    del variants[:-RESPONSE_CACHE_VARIANTS]
+    _response_cache.move_to_end(key)
+    
+    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+    metrics.set_gauge('ai.response_cache.entries', len(_response_cache))
+
+
+async def _ollama_generate(full_prompt: str, timeout: int = 120):
+    """
+    Send a generate request to Ollama
+    
+    Returns:
+        (status, data) where data is the decoded JSON on success or the error text otherwise
+    """
+    async with aiohttp.ClientSession() as session:
+        # Add headers - different for ngrok vs Cloudflare
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        }
+        
+        # Add ngrok-specific header if using ngrok
+        if 'ngrok' in OLLAMA_API.lower():
+            headers['ngrok-skip-browser-warning'] = '69420'
+        
+        async with session.post(
+            OLLAMA_API,
+            json={
+                "model": OLLAMA_MODEL,
+                "prompt": full_prompt,
+                "stream": False
+            },
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            if response.status == 200:
+                return response.status, await response.json()
+            return response.status, await response.text()
+
+
+async def get_ollama_response(prompt: str, conversation_history: list = None, guild_id: int = None,
+                              user_id: int = None, memories: list = None, use_cache: bool = True) -> dict:
     """
     Get response from Ollama API
     
@@ -152,66 +441,47 @@ async def get_ollama_response(prompt: str, conversation_history: list = None, gu
         dict with 'success', 'response', 'emotion', and 'error' keys
     """
     try:
-        # Build the full prompt with conversation history
-        full_prompt = get_system_prompt(guild_id) + "\n\n"
-        
-        if conversation_history:
-            full_prompt += "Conversation history:\n"
-            for msg in conversation_history[-10:]:  # Last 10 messages for context
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-                full_prompt += f"{role.capitalize()}: {content}\n"
-        
-        full_prompt += f"\nUser: {prompt}\nAssistant:"
-        
-        # Make async request to Ollama
-        async with aiohttp.ClientSession() as session:
-            # Add headers - different for ngrok vs Cloudflare
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
+        # Build the prompt within the token budget, older turns come from the rolling summary
+        summary = get_cached_summary(user_id) if user_id else None
+        system_prompt = get_system_prompt(guild_id)
+        full_prompt, overflow = build_prompt(system_prompt, prompt, conversation_history, summary, memories)
+        
+        if user_id and overflow:
+            schedule_summary_update(user_id, overflow)
+        
+        # Repeated prompts in the same context can reuse an earlier reply
+        cache_key = response_cache_key(system_prompt, prompt, conversation_history, summary, memories)
+        ai_response = get_cached_response(cache_key) if use_cache else None
+        if ai_response is not None:
+            status = 200
+        else:
+            # Make async request to Ollama
+            status, data = await _ollama_generate(full_prompt)
+            if status == 200:
+                ai_response = data.get('response', '').strip()
+                cache_response(cache_key, ai_response)
+        
+        if status == 200:
+            # Detect emotion from response
+            emotion = detect_emotion(ai_response)
             
-            # Add ngrok-specific header if using ngrok
-            if 'ngrok' in OLLAMA_API.lower():
-                headers['ngrok-skip-browser-warning'] = '69420'
+            # Add emoji if not already present
+            ai_response = add_contextual_emoji(ai_response, emotion)
             
-            async with session.post(
-                OLLAMA_API,
-                json={
-                    "model": OLLAMA_MODEL,
-                    "prompt": full_prompt,
-                    "stream": False
-                },
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=120)
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    ai_response = data.get('response', '').strip()
-                    
-                    # Detect emotion from response
-                    emotion = detect_emotion(ai_response)
-                    
-                    # Add emoji if not already present
-                    ai_response = add_contextual_emoji(ai_response, emotion)
-                    
-                    return {
-                        'success': True,
-                        'response': ai_response,
-                        'emotion': emotion,
-                        'error': None
-                    }
-                else:
-                    # Get error details
-                    error_text = await response.text()
-                    return {
-                        'success': False,
-                        'response': None,
-                        'emotion': 'neutral',
-                        'error': f"API returned status code {response.status}. URL: {OLLAMA_API}, Model: {OLLAMA_MODEL}, Details: {error_text[:200]}"
-                    }
+            return {
+                'success': True,
+                'response': ai_response,
+                'emotion': emotion,
+                'error': None
+            }
+        else:
+            # Get error details
+            return {
+                'success': False,
+                'response': None,
+                'emotion': 'neutral',
+                'error': f"API returned status code {status}. URL: {OLLAMA_API}, Model: {OLLAMA_MODEL}, Details: {data[:200]}"
+            }
     
     except asyncio.TimeoutError:
         return {
@@ -334,9 +604,8 @@ async def add_message(user_id: int, role: str, content: str, emotion: str = 'neu
         data[user_id_str]['messages'].append(message_data)
         data[user_id_str]['last_message_at'] = datetime.now().isoformat()
         
-        # Trim history if too long
-        if len(data[user_id_str]['messages']) > MAX_HISTORY_MESSAGES:
-            data[user_id_str]['messages'] = data[user_id_str]['messages'][-MAX_HISTORY_MESSAGES:]
+        # Trim history if too long, once the rolling summary has the older turns
+        data[user_id_str]['messages'] = trim_history(user_id, data[user_id_str]['messages'])
         
         save_chat_history(data)
 
@@ -497,6 +766,7 @@ async def start_conversation(user_id: int, message: str) -> None:
         # Clear old conversation if exists
         if user_id_str in data:
             del data[user_id_str]
+        drop_summary(user_id)
         
         # Create new conversation
         now = datetime.now().isoformat()
@@ -545,9 +815,8 @@ async def add_message(user_id: int, role: str, content: str, emotion: str = 'neu
         data[user_id_str]['messages'].append(message_data)
         data[user_id_str]['last_message_at'] = datetime.now().isoformat()
         
-        # Trim history if too long
-        if len(data[user_id_str]['messages']) > MAX_HISTORY_MESSAGES:
-            data[user_id_str]['messages'] = data[user_id_str]['messages'][-MAX_HISTORY_MESSAGES:]
+        # Trim history if too long, once the rolling summary has the older turns
+        data[user_id_str]['messages'] = trim_history(user_id, data[user_id_str]['messages'])
         
         save_chat_history(data)
 
@@ -567,6 +836,7 @@ async def get_conversation_history(user_id: int) -> list:
             # Clear expired conversation
             del data[user_id_str]
             save_chat_history(data)
+            drop_summary(user_id)
             return []
         
         return data[user_id_str]['messages']
@@ -581,6 +851,7 @@ async def clear_conversation(user_id: int) -> None:
         if user_id_str in data:
             del data[user_id_str]
             save_chat_history(data)
+        drop_summary(user_id)
 
 
 async def set_ai_channel(guild_id: int, channel_id: int) -> None:
@@ -683,3 +954,30 @@ async def remove_character_story(guild_id: int) -> bool:
             return True
         
         return False
+
+
+
+async def set_memory_enabled(guild_id: int, enabled: bool) -> None:
+    """Enable or disable long-term memory for a guild"""
+    async with _settings_lock:
+        data = load_ai_settings()
+        guild_id_str = str(guild_id)
+        
+        if guild_id_str not in data:
+            data[guild_id_str] = {
+                'enabled_channels': [],
+                'personality': {
+                    'traits': PERSONALITY_TRAITS,
+                    'base_emotion': 'neutral'
+                }
+            }
+        
+        data[guild_id_str]['long_term_memory'] = enabled
+        save_ai_settings(data)
+
+
+async def is_memory_enabled(guild_id: int) -> bool:
+    """Check if long-term memory is enabled for a guild (off by default)"""
+    async with _settings_lock:
+        data = load_ai_settings()
+        return bool(data.get(str(guild_id), {}).get('long_term_memory', False))
@@ -0,0 +1,346 @@
+"""
+Long-term AI chat memory - past exchanges embedded into a per-guild NumPy vector index
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from pathlib import Path
+
+import aiohttp
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger('DiscordBot.AIMemory')
+
+MEMORY_DIR = Path('data/ai_memory')
+
+# Memory settings
+MEMORY_EMBEDDER = os.getenv('AI_MEMORY_EMBEDDER', 'hashing')  # 'hashing' (offline) or 'ollama'
+OLLAMA_EMBED_MODEL = os.getenv('OLLAMA_EMBED_MODEL', 'nomic-embed-text')
+HASHING_DIMENSIONS = 256
+MEMORY_TOP_K = 3  # Snippets recalled per prompt
+MEMORY_MIN_SCORE = 0.2  # Ignore weakly related snippets
+MAX_MEMORIES_PER_USER = 500  # Oldest exchanges are forgotten first
+MAX_SNIPPET_CHARS = 300
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'be', 'do', 'i', 'im', 'is', 'it', 'me', 'of', 'on', 'or', 's',
+    'so', 'that', 'the', 'to', 'u', 'was', 'what', 'whats', 'you', 'your',
+}
+
+
+class HashingEmbedder:
+    """Offline embedder using the hashing trick over words and word pairs"""
+
+    name = 'hashing'
+
+    def __init__(self, dimensions: int = HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _features(self, text: str):
+        words = [w for w in _TOKEN_RE.findall(text.lower()) if w not in _STOP_WORDS]
+        yield from words
+        yield from (f"{a} {b}" for a, b in zip(words, words[1:]))
+
+    async def embed(self, texts: list):
+        """Embed a list of texts into an (n, dimensions) float32 matrix"""
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                # Low bits pick the bucket, the top bit picks the sign
+                sign = 1.0 if value >> 63 else -1.0
+                matrix[row, value % self.dimensions] += sign
+        return _normalize(matrix)
+
+
+class OllamaEmbedder:
+    """Embedder backed by an Ollama embedding model"""
+
+    name = 'ollama'
+
+    def __init__(self, model: str = OLLAMA_EMBED_MODEL):
+        from .ai_chat_utils import OLLAMA_API
+        self.model = model
+        self.url = OLLAMA_API.rsplit('/api/', 1)[0] + '/api/embed'
+        self.dimensions = None
+
+    async def embed(self, texts: list):
+        """Embed a list of texts into an (n, dimensions) float32 matrix"""
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                self.url,
+                json={"model": self.model, "input": texts},
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+        matrix = np.asarray(data['embeddings'], dtype=np.float32)
+        self.dimensions = matrix.shape[1]
+        return _normalize(matrix)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class MemoryIndex:
+    """Vectors for one guild, stored as one contiguous matrix with parallel metadata arrays"""
+
+    def __init__(self, embedder_name: str, dimensions: int):
+        self.embedder_name = embedder_name
+        self.dimensions = dimensions
+        self.size = 0
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.timestamps = np.zeros(0, dtype=np.float64)
+        self.texts = []
+        self.dirty = False
+
+    def _reserve(self, extra: int) -> None:
+        """Grow the backing arrays geometrically so appends are amortized O(1)"""
+        needed = self.size + extra
+        capacity = len(self.user_ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        user_ids = np.zeros(capacity, dtype=np.int64)
+        user_ids[:self.size] = self.user_ids[:self.size]
+        timestamps = np.zeros(capacity, dtype=np.float64)
+        timestamps[:self.size] = self.timestamps[:self.size]
+        self.vectors, self.user_ids, self.timestamps = vectors, user_ids, timestamps
+
+    def add(self, user_id: int, vector, text: str, timestamp: float) -> None:
+        """Append one memory"""
+        self._reserve(1)
+        self.vectors[self.size] = vector
+        self.user_ids[self.size] = user_id
+        self.timestamps[self.size] = timestamp
+        self.texts.append(text)
+        self.size += 1
+        self.dirty = True
+
+        # Forget the user's oldest memories past the cap
+        rows = np.flatnonzero(self.user_ids[:self.size] == user_id)
+        if len(rows) > MAX_MEMORIES_PER_USER:
+            self.remove(rows[:len(rows) - MAX_MEMORIES_PER_USER])
+
+    def remove(self, rows) -> None:
+        """Remove rows by index"""
+        keep = np.ones(self.size, dtype=bool)
+        keep[rows] = False
+        self.vectors = self.vectors[:self.size][keep]
+        self.user_ids = self.user_ids[:self.size][keep]
+        self.timestamps = self.timestamps[:self.size][keep]
+        self.texts = [t for t, k in zip(self.texts, keep) if k]
+        self.size = len(self.texts)
+        self.dirty = True
+
+    def remove_user(self, user_id: int) -> int:
+        """Remove all memories of a user, returns how many were removed"""
+        rows = np.flatnonzero(self.user_ids[:self.size] == user_id)
+        if len(rows):
+            self.remove(rows)
+        return len(rows)
+
+    def search(self, user_id: int, vector, k: int = MEMORY_TOP_K, before: float = None,
+               min_score: float = MEMORY_MIN_SCORE) -> list:
+        """Top-k memories of a user by cosine similarity (vectors are unit length)"""
+        mask = self.user_ids[:self.size] == user_id
+        if before is not None:
+            mask &= self.timestamps[:self.size] < before
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return []
+
+        scores = self.vectors[rows] @ vector
+        if len(rows) > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(scores[top])[::-1]]
+
+        return [(self.texts[rows[i]], float(scores[i])) for i in top if scores[i] >= min_score]
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the index"""
+        text_bytes = sum(len(t.encode('utf-8')) for t in self.texts)
+        return self.vectors.nbytes + self.user_ids.nbytes + self.timestamps.nbytes + text_bytes
+
+    def to_arrays(self) -> dict:
+        """Trimmed copies of the index arrays for saving"""
+        return {
+            'embedder': np.array(self.embedder_name),
+            'vectors': self.vectors[:self.size].copy(),
+            'user_ids': self.user_ids[:self.size].copy(),
+            'timestamps': self.timestamps[:self.size].copy(),
+            'texts': np.array(self.texts, dtype=str),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays) -> 'MemoryIndex':
+        """Rebuild an index from saved arrays"""
+        vectors = arrays['vectors']
+        index = cls(str(arrays['embedder']), vectors.shape[1])
+        index.vectors = vectors.astype(np.float32)
+        index.user_ids = arrays['user_ids'].astype(np.int64)
+        index.timestamps = arrays['timestamps'].astype(np.float64)
+        index.texts = [str(t) for t in arrays['texts']]
+        index.size = len(index.texts)
+        return index
+
+
+_embedder = None
+_indexes = {}  # guild key -> MemoryIndex
+_lock = asyncio.Lock()
+
+
+def get_embedder():
+    """Get the configured embedder"""
+    global _embedder
+    if _embedder is None:
+        _embedder = OllamaEmbedder() if MEMORY_EMBEDDER == 'ollama' else HashingEmbedder()
+    return _embedder
+
+
+def set_embedder(embedder) -> None:
+    """Replace the embedder (indexes built with another embedder are re-embedded on load)"""
+    global _embedder
+    _embedder = embedder
+    _indexes.clear()
+
+
+def _guild_key(guild_id: int) -> str:
+    return str(guild_id) if guild_id else 'dm'
+
+
+def _index_path(key: str) -> Path:
+    return MEMORY_DIR / f"{key}.npz"
+
+
+async def _get_index(guild_id: int, dimensions: int = None):
+    """
+    Load or create the index for a guild.
+    With no dimensions given, returns the stored index as-is (or None if there is none).
+    """
+    key = _guild_key(guild_id)
+    index = _indexes.get(key)
+    if index is None:
+        path = _index_path(key)
+        if path.exists():
+            try:
+                with np.load(path, allow_pickle=False) as arrays:
+                    index = MemoryIndex.from_arrays(arrays)
+                _indexes[key] = index
+            except Exception as e:
+                logger.error(f"Failed to load memory index {path}: {e}")
+
+    if dimensions is None:
+        return index
+
+    embedder = get_embedder()
+    if index is not None and (index.embedder_name != embedder.name or index.dimensions != dimensions):
+        # Embedder changed - re-embed the stored texts
+        old = index
+        index = MemoryIndex(embedder.name, dimensions)
+        if old.size:
+            vectors = await embedder.embed(old.texts)
+            for i in range(old.size):
+                index.add(int(old.user_ids[i]), vectors[i], old.texts[i], float(old.timestamps[i]))
+        _indexes[key] = index
+
+    if index is None:
+        index = MemoryIndex(embedder.name, dimensions)
+        _indexes[key] = index
+
+    return index
+
+
+def format_exchange(prompt: str, response: str) -> str:
+    """Format a user/assistant exchange as a memory snippet"""
+    text = f"User said: {prompt} | You replied: {response}"
+    if len(text) > MAX_SNIPPET_CHARS:
+        text = text[:MAX_SNIPPET_CHARS].rsplit(' ', 1)[0] + "..."
+    return text
+
+
+async def remember_exchange(guild_id: int, user_id: int, prompt: str, response: str) -> None:
+    """Store an exchange in long-term memory"""
+    if not NUMPY_AVAILABLE:
+        return
+
+    text = format_exchange(prompt, response)
+    try:
+        # Embed only what was said, not the snippet labels shared by every memory
+        vector = (await get_embedder().embed([f"{prompt}\n{response}"]))[0]
+        async with _lock:
+            index = await _get_index(guild_id, len(vector))
+            index.add(user_id, vector, text, time.time())
+    except Exception as e:
+        logger.warning(f"Failed to store memory: {e}")
+
+
+async def recall(guild_id: int, user_id: int, prompt: str, before: float = None, k: int = MEMORY_TOP_K) -> list:
+    """Get the snippets most relevant to a prompt, older than `before` (epoch seconds)"""
+    if not NUMPY_AVAILABLE or not prompt:
+        return []
+
+    try:
+        vector = (await get_embedder().embed([prompt]))[0]
+        async with _lock:
+            index = await _get_index(guild_id, len(vector))
+            return [text for text, _ in index.search(user_id, vector, k=k, before=before)]
+    except Exception as e:
+        logger.warning(f"Failed to recall memories: {e}")
+        return []
+
+
+async def forget_user(guild_id: int, user_id: int) -> int:
+    """Delete a user's memories in a guild, returns how many were removed"""
+    if not NUMPY_AVAILABLE:
+        return 0
+
+    async with _lock:
+        index = await _get_index(guild_id)
+        return index.remove_user(user_id) if index else 0
+
+
+def _save_arrays(path: Path, arrays: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp.npz')
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+async def flush_memories() -> None:
+    """Write changed indexes to disk"""
+    if not NUMPY_AVAILABLE:
+        return
+
+    loop = asyncio.get_running_loop()
+    async with _lock:
+        pending = []
+        for key, index in _indexes.items():
+            if index.dirty:
+                pending.append((key, index.to_arrays()))
+                index.dirty = False
+
+    for key, arrays in pending:
+        try:
+            await loop.run_in_executor(None, _save_arrays, _index_path(key), arrays)
+        except Exception as e:
+            logger.error(f"Failed to save memory index {key}: {e}")
+            _indexes[key].dirty = True
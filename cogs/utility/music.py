@@ -5,48 +5,49 @@ Supports YouTube URLs, search queries, and Spotify playlists
 import discord
 from discord.ext import commands
 from discord import app_commands
-import yt_dlp
+from discord.ext import tasks
 import logging
 import asyncio
 import os
+import shutil
+import time
 from dotenv import load_dotenv
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 from .music_panel_view import MusicControlPanel
+from .music_utils import extract_track, get_resolve_cache, is_fresh, query_key, resolve, shutdown_extract_pool, video_key, warm, ytdl
+from .music_cache_utils import get_audio_cache
+from .music_recommend_utils import get_coplay_store
+from .music_queue_utils import MusicQueue, Track, load_queues, save_queues
+from ..utils import metrics
+from ..utils.timers import TimerManager
 
 load_dotenv()
 
 logger = logging.getLogger('DiscordBot.Music')
 
-# YT-DLP options - Optimized for 192kbps quality
-YTDL_OPTIONS = {
-    'format': 'bestaudio[ext=m4a]/bestaudio/best',
-    'extractaudio': True,
-    'audioformat': 'opus',  # Better quality than mp3
-    'audioquality': 0,  # 0 = best quality
-    'postprocessors': [{
-        'key': 'FFmpegExtractAudio',
-        'preferredcodec': 'opus',
-        'preferredquality': '192',  # Optimal for Discord (128kbps limit)
-    }],
-    'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
-    'restrictfilenames': True,
-    'noplaylist': False,
-    'nocheckcertificate': True,
-    'ignoreerrors': False,
-    'logtostderr': False,
-    'quiet': True,
-    'no_warnings': True,
-    'default_search': 'ytsearch',
-    'source_address': '0.0.0.0',
-}
-
 FFMPEG_OPTIONS = {
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-    'options': '-vn -b:a 192k -ar 48000'  # 192kbps bitrate, 48kHz sample rate
+    'options': '-vn -ar 48000'  # 48kHz sample rate (PCM output, so no bitrate to set)
 }
 
-ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
+# 'opus': FFmpeg hands discord.py ready Opus packets, copying Opus streams untouched at 100% volume.
+# 'pcm': FFmpeg decodes to PCM and discord.py scales the volume and encodes every frame in Python
+MUSIC_AUDIO_PATH = os.getenv('MUSIC_AUDIO_PATH', 'opus').lower()
+OPUS_BITRATE = int(os.getenv('MUSIC_OPUS_BITRATE', '128'))  # kbps when FFmpeg has to encode
+FRAME_SECONDS = 0.02  # Discord audio frames are 20ms
+
+PREFETCH_TRACKS = int(os.getenv('MUSIC_PREFETCH_TRACKS', '2'))  # Upcoming tracks resolved in the background
+SPOTIFY_PAGE_SIZE = 100  # Playlist items per Spotify API call (the API maximum)
+IMPORT_RESOLVERS = int(os.getenv('MUSIC_IMPORT_RESOLVERS', '1'))  # Concurrent lookups for imported playlist tracks
+RECOMMEND_CACHE_TTL = int(os.getenv('MUSIC_RECOMMEND_CACHE_TTL', '21600'))  # Seconds to reuse Spotify lookups
+AUTOPLAY_LOCAL_TRACKS = 5  # Tracks queued per autoplay round from play history
+QUEUE_SNAPSHOT_INTERVAL = 30  # Seconds between checks for changed queues to save
+IDLE_TIMEOUT = int(os.getenv('MUSIC_IDLE_TIMEOUT', '300'))  # Seconds to stay in voice with nothing to play
+EMPTY_CHANNEL_TIMEOUT = int(os.getenv('MUSIC_EMPTY_CHANNEL_TIMEOUT', '60'))  # Seconds to stay once everyone left
+MAX_PLAY_FAILURES = 3  # Tracks in a row that may fail to start before playback stops
+PANEL_UPDATE_INTERVAL = float(os.getenv('MUSIC_PANEL_UPDATE_INTERVAL', '2'))  # Minimum seconds between panel edits
+PANEL_EDIT_RETRIES = 3  # Failed panel edits retried (with backoff) before waiting for the next change
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
@@ -62,60 +63,105 @@ class YTDLSource(discord.PCMVolumeTransformer):
     @classmethod
     async def from_url(cls, url, *, loop=None, stream=True):
         """Create audio source from URL"""
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
-
-        if 'entries' in data:
-            # Playlist
-            data = data['entries'][0]
-
-        filename = data['url'] if stream else ytdl.prepare_filename(data)
-        
-        # Check for FFmpeg in common locations if not in PATH
-        ffmpeg_executable = "ffmpeg"
-        possible_paths = [
-            r"C:\Users\Samuel\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.0-full_build\bin\ffmpeg.exe",
-            r"C:\ffmpeg\bin\ffmpeg.exe",
-            r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"
-        ]
-        
-        # If ffmpeg is not in PATH (shutil.which returns None), try to find it
-        import shutil
-        if not shutil.which("ffmpeg"):
-            for path in possible_paths:
-                if os.path.exists(path):
-                    ffmpeg_executable = path
-                    break
-        
-        return cls(discord.FFmpegPCMAudio(filename, executable=ffmpeg_executable, **FFMPEG_OPTIONS), data=data)
-
+        data = await extract_track(url, loop=loop, download=not stream)
+        if not stream:
+            data['url'] = ytdl.prepare_filename(data)
+        return cls.from_data(data)
 
-class MusicQueue:
-    """Queue system for music tracks"""
-    def __init__(self):
-        self.queue = []
-        self.current = None
-
-    def add(self, track):
-        """Add track to queue"""
-        self.queue.append(track)
-
-    def next(self):
-        """Get next track"""
-        if self.queue:
-            self.current = self.queue.pop(0)
-            return self.current
-        self.current = None
-        return None
-
-    def clear(self):
-        """Clear queue"""
-        self.queue.clear()
-        self.current = None
+    @classmethod
+    def from_data(cls, data, volume=1.0):
+        """Create audio source from already extracted track info (no network calls)"""
+        audio = discord.FFmpegPCMAudio(
+            data['url'],
+            executable=find_ffmpeg(),
+            before_options=input_options(data['url']),
+            options=FFMPEG_OPTIONS['options'],
+        )
+        return cls(audio, data=data, volume=volume)
+
+
+class YTDLOpusSource(discord.FFmpegOpusAudio):
+    """
+    Opus audio source for YouTube. At 100% volume an Opus stream is copied without decoding,
+    otherwise FFmpeg applies the volume filter and encodes, so nothing is transcoded in Python.
+    Changing the volume means restarting FFmpeg at the current position (see Music.set_volume).
+    """
+    def __init__(self, data, *, codec=None, volume=1.0, start=0.0):
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.duration = data.get('duration')
+        self.thumbnail = data.get('thumbnail')
+        self.codec = codec
+        self.volume = volume
+        self.start = start
+        self.frames = 0
+
+        before_options = input_options(data['url'])
+        if start:
+            before_options += f" -ss {start:.2f}"
+        options = '-vn'
+        if volume != 1.0:
+            options += f" -af volume={volume:.2f}"
+            codec = None  # The filter needs decoded audio, so FFmpeg re-encodes (discord.py copies 'opus'/'libopus')
+
+        super().__init__(
+            data['url'],
+            bitrate=OPUS_BITRATE,
+            codec=codec,
+            executable=find_ffmpeg(),
+            before_options=before_options,
+            options=options,
+        )
+
+    def read(self):
+        packet = super().read()
+        if packet:
+            self.frames += 1
+        return packet
+
+    @property
+    def position(self):
+        """Seconds into the track"""
+        return self.start + self.frames * FRAME_SECONDS
 
-    def is_empty(self):
-        """Check if queue is empty"""
-        return len(self.queue) == 0
+    @classmethod
+    async def from_data(cls, data, volume=1.0, start=0.0):
+        """Create audio source from extracted track info, probing the codec only if yt-dlp didn't report it"""
+        codec = data.get('acodec')
+        if not codec or codec == 'none':
+            codec, _ = await cls.probe(data['url'], method='fallback', executable=find_ffmpeg())
+        return cls(data, codec=codec, volume=volume, start=start)
+
+
+def input_options(url):
+    """FFmpeg input options - reconnect flags only apply to network streams, not local files"""
+    return FFMPEG_OPTIONS['before_options'] if url.startswith(('http://', 'https://')) else ''
+
+
+async def create_source(data, volume=1.0):
+    """Audio source for extracted track info on the configured playback path"""
+    if MUSIC_AUDIO_PATH == 'pcm':
+        return YTDLSource.from_data(data, volume=volume)
+    return await YTDLOpusSource.from_data(data, volume=volume)
+
+
+def find_ffmpeg():
+    """FFmpeg executable, checking common Windows install locations if it's not in PATH"""
+    ffmpeg_executable = "ffmpeg"
+    possible_paths = [
+        r"C:\Users\Samuel\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.0-full_build\bin\ffmpeg.exe",
+        r"C:\ffmpeg\bin\ffmpeg.exe",
+        r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"
+    ]
+    
+    # If ffmpeg is not in PATH (shutil.which returns None), try to find it
+    if not shutil.which("ffmpeg"):
+        for path in possible_paths:
+            if os.path.exists(path):
+                ffmpeg_executable = path
+                break
+    return ffmpeg_executable
 
 
 class Music(commands.Cog):
@@ -123,9 +169,20 @@ class Music(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.queues = {}  # Guild ID -> MusicQueue
+        self.queues = load_queues()  # Guild ID -> MusicQueue, restored from the last snapshot
+        self.snapshot_versions = {guild_id: queue.version for guild_id, queue in self.queues.items()}
         self.panel_messages = {}  # Guild ID -> (message, view) for updating
+        self.panel_rendered = {}  # Guild ID -> embed dict the panel currently shows
+        self.panel_last_edit = {}  # Guild ID -> monotonic() of the last panel edit
+        self.panel_failures = {}  # Guild ID -> failed edits in a row, for retry backoff
+        self.panel_timers = TimerManager('music.panel')  # Guild ID -> pending coalesced panel edit
         self.autoplay_enabled = {}  # Guild ID -> True/False for AutoPlay state
+        self.track_ended_at = {}  # Guild ID -> perf_counter() when the last track finished, for transition gaps
+        self.volumes = {}  # Guild ID -> volume (0.0 - 1.0), kept across tracks
+        self.imports = {}  # Guild ID -> progress of the running Spotify import
+        self.artist_lookups = {}  # Normalized track title -> ((artist id, name) or None, expires at)
+        self.artist_recommendations = {}  # Spotify artist id -> (track names, expires at)
+        self.disconnect_timers = TimerManager('music.disconnect')  # Guild ID -> idle/empty channel deadline
         
         # Initialize Spotify client if credentials available
         spotify_id = os.getenv('SPOTIFY_CLIENT_ID')
@@ -143,176 +200,568 @@ class Music(commands.Cog):
         else:
             self.spotify = None
 
+        self.save_music_data.start()
+        self.snapshot_queues.start()
+
+    def cog_unload(self):
+        """Stop background tasks and keep queues and what was resolved and played this session"""
+        self.save_music_data.cancel()
+        self.snapshot_queues.cancel()
+        self.disconnect_timers.stop()
+        self.panel_timers.stop()
+        try:
+            save_queues(self.queue_snapshots())
+        except Exception as e:
+            logger.error(f"Failed to save queue snapshot: {e}")
+        get_resolve_cache().save()
+        get_coplay_store().save()
+        get_audio_cache().cancel()
+        shutdown_extract_pool()
+
+    @tasks.loop(minutes=5)
+    async def save_music_data(self):
+        """Persist newly resolved queries and play history"""
+        # Snapshots are taken here on the loop, since lookups and plays keep changing the stores while the executor writes
+        for store in (get_resolve_cache(), get_coplay_store()):
+            snapshot = store.snapshot()
+            if snapshot is None:
+                continue
+            try:
+                await self.bot.loop.run_in_executor(None, store.write, snapshot)
+            except Exception as e:
+                logger.error(f"Failed to save {store.path}: {e}")
+                store.dirty = True  # Try again next round
+
+    def queue_snapshots(self):
+        """Snapshots of every queue that has something in it"""
+        return {
+            guild_id: queue.snapshot()
+            for guild_id, queue in self.queues.items()
+            if queue.current or not queue.is_empty()
+        }
+
+    @tasks.loop(seconds=QUEUE_SNAPSHOT_INTERVAL)
+    async def snapshot_queues(self):
+        """Save queues to disk when they've changed, so they survive restarts and redeploys"""
+        versions = {guild_id: queue.version for guild_id, queue in self.queues.items()}
+        if versions == self.snapshot_versions:
+            return
+        try:
+            await self.bot.loop.run_in_executor(None, save_queues, self.queue_snapshots())
+            self.snapshot_versions = versions
+        except Exception as e:
+            logger.error(f"Failed to save queue snapshot: {e}")
+
     def get_queue(self, guild_id):
         """Get or create queue for guild"""
         if guild_id not in self.queues:
             self.queues[guild_id] = MusicQueue()
         return self.queues[guild_id]
 
-    async def play_next(self, ctx):
-        """Play next song in queue"""
-        queue = self.get_queue(ctx.guild.id)
-        
-        if queue.is_empty():
+    async def prefetch_track(self, guild_id, track):
+        """Background extraction for a queued track. Returns None on failure (it's retried at play time)"""
+        if await self.cached_audio(track) is not None:
+            return None  # Plays from the local audio cache, nothing to extract
+        try:
+            return await resolve(track.url, loop=self.bot.loop, guild_id=guild_id)
+        except Exception as e:
+            logger.warning(f"Prefetch failed for {track.title}: {e}")
+            return None
+
+    def prefetch_upcoming(self, guild_id):
+        """Resolve the next few queued tracks in the background so they start without waiting for yt-dlp"""
+        queue = self.get_queue(guild_id)
+        for track in queue.upcoming(PREFETCH_TRACKS):
+            task = track.prefetch
+            if task and (not task.done() or is_fresh(task.result())):
+                continue
+            track.prefetch = self.bot.loop.create_task(self.prefetch_track(guild_id, track))
+
+    async def resolve_for_playback(self, guild_id, track_info):
+        """Stream info for a track, using its prefetched result when that's still fresh"""
+        task, track_info.prefetch = track_info.prefetch, None
+        if task:
+            # Waits for an in-progress prefetch instead of starting a second extraction
+            data = await task
+            if is_fresh(data):
+                metrics.increment('music.prefetch.hit')
+                return data
+        metrics.increment('music.prefetch.miss')
+        return await resolve(track_info.url, loop=self.bot.loop, guild_id=guild_id)
+
+    async def cached_audio(self, track_info):
+        """Track info pointing at the track's local Opus file, if the audio cache has it"""
+        cache = get_audio_cache()
+        if not cache.enabled:
+            return None
+        video = get_resolve_cache().videos.get(query_key(track_info.url))
+        if video is None:
+            return None  # Never resolved, so it can't have been saved
+        path = await cache.path(video['key'])
+        if path is None:
+            return None
+        return {**video, 'url': path, 'acodec': 'opus'}
+
+    def cache_audio(self, guild_id, data):
+        """Save the playing track to the local audio cache in the background once it's popular enough"""
+        url = data['url']
+        if not url.startswith(('http://', 'https://')):
+            return  # Already playing from the cache
+        key = video_key(data)
+        track = get_coplay_store().graph(guild_id).tracks.get(key)
+        get_audio_cache().store(
+            key, url,
+            plays=track['plays'] if track else 0,
+            duration=data.get('duration'),
+            executable=find_ffmpeg(),
+            input_options=input_options(url),
+            copy=data.get('acodec') == 'opus',
+            bitrate=OPUS_BITRATE,
+        )
+
+    async def set_volume(self, guild, volume):
+        """Set the guild's volume and apply it to the current track"""
+        volume = round(min(1.0, max(0.0, volume)), 2)
+        self.volumes[guild.id] = volume
+        voice_client = guild.voice_client
+        source = voice_client.source if voice_client else None
+
+        if isinstance(source, YTDLSource):
+            source.volume = volume
+        elif isinstance(source, YTDLOpusSource) and source.volume != volume:
+            # Restart FFmpeg where playback is, with the new volume filter (or back to passthrough at 100%)
+            replacement = await YTDLOpusSource.from_data(source.data, volume=volume, start=source.position)
+            if voice_client.source is source:
+                paused = voice_client.is_paused()
+                voice_client.source = replacement
+                if paused:
+                    voice_client.pause()  # Swapping the source resumes the player
+                source.cleanup()
+            else:
+                replacement.cleanup()  # The track changed while FFmpeg was starting
+        return volume
+
+    def schedule_disconnect(self, guild_id, delay):
+        """Leave voice after delay seconds unless playback resumes for someone first"""
+        self.disconnect_timers.schedule(guild_id, delay, lambda: self.disconnect_if_idle(guild_id))
+
+    async def disconnect_if_idle(self, guild_id):
+        """Timer callback - disconnect if nothing is playing (or paused) or nobody is left to listen"""
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        if not voice_client:
+            return
+        listeners = [member for member in voice_client.channel.members if not member.bot]
+        if (voice_client.is_playing() or voice_client.is_paused()) and listeners:
+            return  # Paused with people listening is a break, not idle
+        logger.info(f"Leaving voice in guild {guild_id} ({'idle' if listeners else 'channel empty'})")
+        await voice_client.disconnect()
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        """Start or cancel the disconnect timer as people leave or join the bot's channel"""
+        if member.id == self.bot.user.id:
+            if after.channel is None:
+                # Disconnected (by a timer, Stop, or kicked from the channel)
+                self.disconnect_timers.cancel(member.guild.id)
+            return
+
+        voice_client = member.guild.voice_client
+        if not voice_client or voice_client.channel not in (before.channel, after.channel):
+            return
+
+        listeners = [m for m in voice_client.channel.members if not m.bot]
+        if not listeners:
+            self.schedule_disconnect(member.guild.id, EMPTY_CHANNEL_TIMEOUT)
+        elif voice_client.is_playing() or voice_client.is_paused():
+            self.disconnect_timers.cancel(member.guild.id)
+        elif member.guild.id in self.disconnect_timers:
+            # Someone came back to an idle bot: give them the full idle timeout again
+            self.schedule_disconnect(member.guild.id, IDLE_TIMEOUT)
+
+    def on_track_end(self, ctx, error):
+        """Player callback (runs on the voice thread) - start the next track"""
+        if error:
+            logger.error(f"Player error: {error}")
+        self.track_ended_at[ctx.guild.id] = time.perf_counter()
+        asyncio.run_coroutine_threadsafe(self.play_next(ctx), self.bot.loop)
+
+    async def next_track(self, ctx, queue):
+        """Advance the queue, topping it up with AutoPlay if it ran out. Returns the track, or None when idle"""
+        if not queue.has_next():
             # Check if AutoPlay is enabled
             if self.autoplay_enabled.get(ctx.guild.id, False):
                 # Try to get recommendations based on the last played track
-                if queue.current and queue.current.get('title'):
+                if queue.current and queue.current.title:
                     logger.info(f"AutoPlay: Queue empty, getting recommendations...")
-                    recommendations = await self.get_spotify_recommendations(queue.current['title'])
+                    recommendations = await self.get_recommendations(ctx.guild.id, queue.current)
                     
                     if recommendations:
                         # Add recommendations to queue
-                        for track_name in recommendations:
-                            queue.add({
-                                'url': f"ytsearch:{track_name}",
-                                'title': track_name,
-                                'requester': queue.current.get('requester')  # Use same requester
-                            })
+                        for url, title in recommendations:
+                            # Use same requester
+                            queue.add(Track(url, title, queue.current.requester, queue.current.requester_id))
                         logger.info(f"AutoPlay: Added {len(recommendations)} recommendations to queue")
                         # Continue to play the next track
                     else:
-                        logger.warning("AutoPlay: Failed to get recommendations, disconnecting...")
+                        logger.warning("AutoPlay: Failed to get recommendations")
                         # Queue is empty, disconnect after 5 minutes of inactivity
-                        await asyncio.sleep(300)
-                        if ctx.voice_client and not ctx.voice_client.is_playing():
-                            await ctx.voice_client.disconnect()
-                        return
+                        self.schedule_disconnect(ctx.guild.id, IDLE_TIMEOUT)
+                        return None
                 else:
                     # No previous track to base recommendations on
-                    await asyncio.sleep(300)
-                    if ctx.voice_client and not ctx.voice_client.is_playing():
-                        await ctx.voice_client.disconnect()
-                    return
+                    self.schedule_disconnect(ctx.guild.id, IDLE_TIMEOUT)
+                    return None
             else:
                 # AutoPlay disabled, disconnect after 5 minutes of inactivity
-                await asyncio.sleep(300)
-                if ctx.voice_client and not ctx.voice_client.is_playing():
-                    await ctx.voice_client.disconnect()
+                self.schedule_disconnect(ctx.guild.id, IDLE_TIMEOUT)
+                return None
+
+        return queue.next()
+
+    async def play_next(self, ctx):
+        """Play next song in queue, moving past tracks that fail to start"""
+        queue = self.get_queue(ctx.guild.id)
+
+        for _ in range(MAX_PLAY_FAILURES):
+            track_info = await self.next_track(ctx, queue)
+            if track_info is None:
                 return
 
-        track_info = queue.next()
-        
-        try:
-            player = await YTDLSource.from_url(track_info['url'], loop=self.bot.loop, stream=True)
+            try:
+                data = await self.cached_audio(track_info)
+                if data is not None:
+                    track_info.prefetch = None
+                else:
+                    data = await self.resolve_for_playback(ctx.guild.id, track_info)
+                player = await create_source(data, self.volumes.get(ctx.guild.id, 1.0))
             
-            ctx.voice_client.play(
-                player,
-                after=lambda e: asyncio.run_coroutine_threadsafe(self.play_next(ctx), self.bot.loop)
-            )
+                ctx.voice_client.play(
+                    player,
+                    after=lambda e: self.on_track_end(ctx, e)
+                )
+                self.disconnect_timers.cancel(ctx.guild.id)
+
+                # Time from the previous track ending to this one starting
+                ended_at = self.track_ended_at.pop(ctx.guild.id, None)
+                if ended_at is not None:
+                    metrics.observe('music.transition_ms', (time.perf_counter() - ended_at) * 1000)
+
+                self.prefetch_upcoming(ctx.guild.id)
+                get_coplay_store().record(
+                    ctx.guild.id, video_key(data), data.get('title') or track_info.title,
+                    data.get('webpage_url') or track_info.url
+                )
+                self.cache_audio(ctx.guild.id, data)
+
+                # Update the panel if it exists
+                self.refresh_panel(ctx.guild.id)
+                return
 
-            # Update the panel if it exists
-            if ctx.guild.id in self.panel_messages:
-                panel_msg, panel_view = self.panel_messages[ctx.guild.id]
-                try:
-                    updated_embed = panel_view.create_embed()
-                    await panel_msg.edit(embed=updated_embed, view=panel_view)
-                except discord.errors.NotFound:
-                    # Panel message was deleted, remove from tracking
-                    del self.panel_messages[ctx.guild.id]
-                    logger.info("Panel message deleted, removed from tracking")
-                except discord.errors.HTTPException as e:
-                    if e.code == 50027 or e.status == 401:
-                        # Webhook token expired (after 15 minutes), remove from tracking
-                        del self.panel_messages[ctx.guild.id]
-                        logger.info("Panel webhook expired, removed from tracking")
-                    else:
-                        logger.error(f"Failed to update panel: {e}")
-                except Exception as e:
-                    logger.error(f"Failed to update panel: {e}")
-            
-        except Exception as e:
-            await ctx.send(f"❌ Error playing track: {str(e)}")
-            await self.play_next(ctx)
+            except Exception as e:
+                queue.drop_current()  # Neither repeated by loop-one nor re-queued by loop-all
+                await ctx.send(f"❌ Error playing track: {str(e)}")
 
-    async def get_spotify_tracks(self, url):
-        """Extract tracks from Spotify playlist"""
-        if not self.spotify:
-            return None
+        await ctx.send(f"❌ {MAX_PLAY_FAILURES} tracks in a row failed to play, stopping playback.")
+        self.schedule_disconnect(ctx.guild.id, IDLE_TIMEOUT)
 
+    def refresh_panel(self, guild_id):
+        """Ask for a panel re-render. Requests are merged into at most one edit per PANEL_UPDATE_INTERVAL"""
+        if guild_id not in self.panel_messages:
+            return
+        if guild_id in self.panel_timers:
+            metrics.increment('music.panel.coalesced')
+            return
+        delay = self.panel_last_edit.get(guild_id, 0.0) + PANEL_UPDATE_INTERVAL - time.monotonic()
+        self.panel_timers.schedule(guild_id, max(0.0, delay), lambda: self.flush_panel(guild_id))
+
+    def mark_panel_rendered(self, guild_id, embed):
+        """Record an embed that reached the panel some other way (e.g. a button's interaction response)"""
+        self.panel_rendered[guild_id] = embed.to_dict()
+        self.panel_last_edit[guild_id] = time.monotonic()
+
+    def forget_panel(self, guild_id):
+        self.panel_messages.pop(guild_id, None)
+        self.panel_rendered.pop(guild_id, None)
+        self.panel_last_edit.pop(guild_id, None)
+        self.panel_failures.pop(guild_id, None)
+        self.panel_timers.cancel(guild_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        """Stop tracking a panel that was deleted, so the next /music posts a new one"""
+        panel = self.panel_messages.get(payload.guild_id)
+        if panel and panel[0].id == payload.message_id:
+            self.forget_panel(payload.guild_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        panel = self.panel_messages.get(payload.guild_id)
+        if panel and panel[0].id in payload.message_ids:
+            self.forget_panel(payload.guild_id)
+
+    async def flush_panel(self, guild_id):
+        """Edit the panel message, unless it already shows what it would be edited to"""
+        if guild_id not in self.panel_messages:
+            return
+        panel_msg, panel_view = self.panel_messages[guild_id]
+        embed = panel_view.create_embed()
+        if embed.to_dict() == self.panel_rendered.get(guild_id):
+            metrics.increment('music.panel.unchanged')
+            return
         try:
-            if 'playlist' in url:
-                results = self.spotify.playlist_tracks(url)
-                tracks = []
+            await panel_msg.edit(embed=embed, view=panel_view)
+            self.mark_panel_rendered(guild_id, embed)
+            metrics.increment('music.panel.edits')
+            self.panel_failures.pop(guild_id, None)
+        except discord.errors.NotFound:
+            # Panel message was deleted, remove from tracking so /music posts a new one
+            self.forget_panel(guild_id)
+            logger.info("Panel message deleted, removed from tracking")
+        except discord.Forbidden:
+            self.forget_panel(guild_id)
+            logger.warning(f"Lost access to the panel message in guild {guild_id}, removed from tracking")
+        except Exception as e:
+            # Keep the update: retry with backoff unless a newer request is already waiting
+            failures = self.panel_failures.get(guild_id, 0) + 1
+            self.panel_last_edit[guild_id] = time.monotonic()
+            if failures > PANEL_EDIT_RETRIES:
+                self.panel_failures.pop(guild_id, None)
+                logger.error(f"Failed to update panel, giving up until the next change: {e}")
+                return
+            self.panel_failures[guild_id] = failures
+            logger.warning(f"Failed to update panel (attempt {failures}), retrying: {e}")
+            if guild_id not in self.panel_timers:
+                self.panel_timers.schedule(guild_id, PANEL_UPDATE_INTERVAL * 2 ** failures, lambda: self.flush_panel(guild_id))
+
+    async def post_panel(self, ctx, channel):
+        """Post a new control panel as a normal channel message, which (unlike a followup) never expires"""
+        view = MusicControlPanel(self.bot, ctx, timeout=None)
+        embed = view.create_embed()
+        panel_msg = await channel.send(embed=embed, view=view)
+        view.panel_message = panel_msg
+        self.forget_panel(ctx.guild.id)
+        self.panel_messages[ctx.guild.id] = (panel_msg, view)
+        self.mark_panel_rendered(ctx.guild.id, embed)
+
+    async def spotify_pages(self, url):
+        """Yield (track names, total tracks) per page of a Spotify playlist or track link, fetched off the event loop"""
+        loop = self.bot.loop
+        if 'playlist' in url:
+            results = await loop.run_in_executor(
+                None, lambda: self.spotify.playlist_items(url, limit=SPOTIFY_PAGE_SIZE, additional_types=('track',))
+            )
+            while results:
+                names = []
                 for item in results['items']:
-                    track = item['track']
-                    track_name = f"{track['artists'][0]['name']} - {track['name']}"
-                    tracks.append(track_name)
-                return tracks
-            elif 'track' in url:
-                track = self.spotify.track(url)
-                track_name = f"{track['artists'][0]['name']} - {track['name']}"
-                return [track_name]
+                    track = item.get('track')
+                    # Removed tracks come back as None, local files and episodes have no usable artist
+                    if not track or track.get('type') != 'track' or not track.get('artists'):
+                        continue
+                    names.append(f"{track['artists'][0]['name']} - {track['name']}")
+                yield names, results['total']
+                if not results.get('next'):
+                    break
+                results = await loop.run_in_executor(None, self.spotify.next, results)
+        elif 'track' in url:
+            track = await loop.run_in_executor(None, self.spotify.track, url)
+            yield [f"{track['artists'][0]['name']} - {track['name']}"], 1
+
+    def enqueue_names(self, guild_id, names, requester):
+        """Add "Artist - Title" search entries to the guild's queue"""
+        queue = self.get_queue(guild_id)
+        tracks = []
+        for track_name in names:
+            track = Track(f"ytsearch:{track_name}", track_name, requester)
+            queue.add(track)
+            tracks.append(track)
+        return tracks
+
+    async def start_spotify_import(self, guild_id, url, requester):
+        """
+        Queue the first page of a Spotify link right away and the rest in the background.
+        Returns (tracks queued now, total tracks), or None if Spotify returned nothing.
+        """
+        pages = self.spotify_pages(url)
+        try:
+            names, total = await pages.__anext__()
+        except StopAsyncIteration:
+            return None
         except Exception as e:
-            print(f"Spotify error: {e}")
+            logger.error(f"Spotify error: {e}")
+            await pages.aclose()
             return None
 
+        tracks = self.enqueue_names(guild_id, names, requester)
+        progress = {'queued': len(tracks), 'total': total, 'ready': 0}
+        self.imports[guild_id] = progress
+        progress['task'] = self.bot.loop.create_task(self.continue_import(guild_id, pages, tracks, requester, progress))
+        return len(tracks), total
+
+    async def continue_import(self, guild_id, pages, tracks, requester, progress):
+        """Queue the remaining pages and resolve imported tracks ahead of playback, a few at a time"""
+        pending = asyncio.Queue()
+        for track in tracks:
+            pending.put_nowait(track)
+
+        async def resolver():
+            while True:
+                track = await pending.get()
+                try:
+                    await warm(track.url, loop=self.bot.loop, guild_id=guild_id)
+                except Exception as e:
+                    logger.warning(f"Could not resolve imported track {track.title}: {e}")
+                progress['ready'] += 1
+                pending.task_done()
+
+        # Fewer resolvers than the per-guild extraction limit, so playback never waits behind the import
+        resolvers = [self.bot.loop.create_task(resolver()) for _ in range(IMPORT_RESOLVERS)]
+        try:
+            async for names, total in pages:
+                for track in self.enqueue_names(guild_id, names, requester):
+                    pending.put_nowait(track)
+                progress['queued'] += len(names)
+                progress['total'] = total
+                self.prefetch_upcoming(guild_id)
+                self.refresh_panel(guild_id)
+            await pending.join()
+        except Exception as e:
+            logger.error(f"Spotify import failed after {progress['queued']} tracks: {e}")
+        finally:
+            for task in resolvers:
+                task.cancel()
+            await pages.aclose()
+            if self.imports.get(guild_id) is progress:
+                del self.imports[guild_id]
+        self.refresh_panel(guild_id)
+
+    def cancel_import(self, guild_id):
+        """Stop a running Spotify import (e.g. when the queue is cleared)"""
+        progress = self.imports.pop(guild_id, None)
+        if progress:
+            progress['task'].cancel()
+
+    def _find_spotify_artist(self, track_title):
+        """(artist id, artist name) for a track title, or None (blocking Spotify calls)"""
+        # Search for the track on Spotify to get artist info
+        search_results = self.spotify.search(q=track_title, type='track', limit=1)
+        
+        if not search_results['tracks']['items']:
+            # Try simplified search if full title doesn't work
+            simplified_query = track_title.split('-')[0].strip() if '-' in track_title else track_title
+            search_results = self.spotify.search(q=simplified_query, type='track', limit=1)
+            
+            if not search_results['tracks']['items']:
+                logger.info(f"Could not find track on Spotify: {track_title}")
+                return None
+        
+        track = search_results['tracks']['items'][0]
+        logger.info(f"Found track on Spotify: {track['name']} by {track['artists'][0]['name']}")
+        return track['artists'][0]['id'], track['artists'][0]['name']
+
+    def _artist_recommendations(self, artist_id, artist_name):
+        """Top tracks of an artist, topped up from related artists (blocking Spotify calls)"""
+        # Get artist's top tracks (more reliable than recommendations API)
+        top_tracks = self.spotify.artist_top_tracks(artist_id, country='US')
+        
+        if not top_tracks or 'tracks' not in top_tracks:
+            logger.info("No top tracks found")
+            return []
+        
+        # Extract track names
+        recommended_tracks = []
+        for rec_track in top_tracks['tracks'][:10]:
+            track_name = f"{rec_track['artists'][0]['name']} - {rec_track['name']}"
+            recommended_tracks.append(track_name)
+        
+        logger.info(f"Found {len(recommended_tracks)} top tracks from {artist_name}")
+        
+        # If we got less than 5 tracks, try to get related artists' tracks too
+        if len(recommended_tracks) < 5:
+            try:
+                related_artists = self.spotify.artist_related_artists(artist_id)
+                if related_artists and 'artists' in related_artists:
+                    for related_artist in related_artists['artists'][:3]:
+                        related_top = self.spotify.artist_top_tracks(related_artist['id'], country='US')
+                        for track in related_top['tracks'][:3]:
+                            track_name = f"{track['artists'][0]['name']} - {track['name']}"
+                            if track_name not in recommended_tracks:
+                                recommended_tracks.append(track_name)
+                            if len(recommended_tracks) >= 10:
+                                break
+                        if len(recommended_tracks) >= 10:
+                            break
+                    logger.info(f"Added related artists' tracks, total: {len(recommended_tracks)}")
+            except Exception as e:
+                logger.warning(f"Could not get related artists: {e}")
+        
+        return recommended_tracks
+
+    def _cached(self, cache, key):
+        """Value from a (value, expires at) cache, or None if missing or expired"""
+        entry = cache.get(key)
+        if entry and entry[1] > time.monotonic():
+            return entry
+        return None
+
+    def _store(self, cache, key, value):
+        now = time.monotonic()
+        cache[key] = (value, now + RECOMMEND_CACHE_TTL)
+        # Drop expired entries so the cache doesn't grow forever
+        if len(cache) > 1000:
+            for stale in [k for k, entry in cache.items() if entry[1] <= now]:
+                del cache[stale]
+
     async def get_spotify_recommendations(self, track_title):
-        """Get Spotify recommendations based on current track"""
+        """Get Spotify recommendations based on current track (cached per title and per artist)"""
         if not self.spotify:
             return None
         
+        loop = self.bot.loop
         try:
-            # Search for the track on Spotify to get artist info
-            search_results = self.spotify.search(q=track_title, type='track', limit=1)
-            
-            if not search_results['tracks']['items']:
-                # Try simplified search if full title doesn't work
-                simplified_query = track_title.split('-')[0].strip() if '-' in track_title else track_title
-                search_results = self.spotify.search(q=simplified_query, type='track', limit=1)
-                
-                if not search_results['tracks']['items']:
-                    print(f"Could not find track on Spotify: {track_title}")
-                    return None
-            
-            # Get the artist info
-            track = search_results['tracks']['items'][0]
-            artist_id = track['artists'][0]['id']
-            artist_name = track['artists'][0]['name']
-            
-            print(f"Found track on Spotify: {track['name']} by {artist_name}")
-            
-            # Get artist's top tracks (more reliable than recommendations API)
-            top_tracks = self.spotify.artist_top_tracks(artist_id, country='US')
-            
-            if not top_tracks or 'tracks' not in top_tracks:
-                print("No top tracks found")
+            title_key = ' '.join(track_title.lower().split())
+            cached = self._cached(self.artist_lookups, title_key)
+            if cached:
+                artist = cached[0]
+            else:
+                artist = await loop.run_in_executor(None, self._find_spotify_artist, track_title)
+                self._store(self.artist_lookups, title_key, artist)
+            if not artist:
                 return None
             
-            # Extract track names
-            recommended_tracks = []
-            for rec_track in top_tracks['tracks'][:10]:
-                track_name = f"{rec_track['artists'][0]['name']} - {rec_track['name']}"
-                recommended_tracks.append(track_name)
-            
-            print(f"Found {len(recommended_tracks)} top tracks from {artist_name}")
-            
-            # If we got less than 5 tracks, try to get related artists' tracks too
-            if len(recommended_tracks) < 5:
-                try:
-                    related_artists = self.spotify.artist_related_artists(artist_id)
-                    if related_artists and 'artists' in related_artists:
-                        for related_artist in related_artists['artists'][:3]:
-                            related_top = self.spotify.artist_top_tracks(related_artist['id'], country='US')
-                            for track in related_top['tracks'][:3]:
-                                track_name = f"{track['artists'][0]['name']} - {track['name']}"
-                                if track_name not in recommended_tracks:
-                                    recommended_tracks.append(track_name)
-                                if len(recommended_tracks) >= 10:
-                                    break
-                            if len(recommended_tracks) >= 10:
-                                break
-                        print(f"Added related artists' tracks, total: {len(recommended_tracks)}")
-                except Exception as e:
-                    print(f"Could not get related artists: {e}")
+            artist_id, artist_name = artist
+            cached = self._cached(self.artist_recommendations, artist_id)
+            if cached:
+                metrics.increment('music.recommend.spotify_cache.hit')
+                recommended_tracks = cached[0]
+            else:
+                metrics.increment('music.recommend.spotify_cache.miss')
+                recommended_tracks = await loop.run_in_executor(None, self._artist_recommendations, artist_id, artist_name)
+                self._store(self.artist_recommendations, artist_id, recommended_tracks)
             
-            return recommended_tracks if recommended_tracks else None
+            return list(recommended_tracks) if recommended_tracks else None
             
         except Exception as e:
-            print(f"Error getting recommendations: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Error getting recommendations: {e}", exc_info=True)
             return None
+
+    async def get_recommendations(self, guild_id, last_track):
+        """
+        Tracks to autoplay next as (url, title) pairs: Spotify suggestions
+        for the last track, or the guild's own co-play history when Spotify has nothing.
+        """
+        names = await self.get_spotify_recommendations(last_track.title)
+        if names:
+            return [(f"ytsearch:{name}", name) for name in names]
+        
+        try:
+            local = get_coplay_store().recommend(guild_id, limit=AUTOPLAY_LOCAL_TRACKS)
+        except Exception as e:
+            logger.error(f"Error getting local recommendations: {e}", exc_info=True)
+            return []
+        if local:
+            logger.info(f"AutoPlay: {len(local)} suggestions from play history")
+        return [(track['url'], track['title']) for track in local]
     
     def set_autoplay(self, guild_id, enabled):
         """Enable or disable AutoPlay for a guild"""
@@ -323,7 +772,8 @@ class Music(commands.Cog):
     @app_commands.describe(query="YouTube URL, search query, or Spotify link")
     async def music(self, interaction: discord.Interaction, query: str):
         """Play music and show control panel"""
-        await interaction.response.defer()
+        # Replies are ephemeral, the panel itself is posted to the channel
+        await interaction.response.defer(ephemeral=True)
 
         # Check if user is in voice channel
         if not interaction.user.voice:
@@ -346,19 +796,21 @@ class Music(commands.Cog):
                 await interaction.followup.send("❌ Spotify integration not configured! Add SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET to .env", ephemeral=True)
                 return
 
-            tracks = await self.get_spotify_tracks(query)
+            if interaction.guild.id in self.imports:
+                await interaction.followup.send("⏳ Still importing a playlist, try again when it's done!", ephemeral=True)
+                return
+
+            # First page is queued now so playback can start, the rest follows in the background
+            imported = await self.start_spotify_import(interaction.guild.id, query, interaction.user)
             
-            if not tracks:
+            if not imported:
                 await interaction.followup.send("❌ Failed to extract Spotify tracks!", ephemeral=True)
                 return
 
-            # Add all tracks to queue
-            for track_name in tracks:
-                queue.add({
-                    'url': f"ytsearch:{track_name}",
-                    'title': track_name,
-                    'requester': interaction.user
-                })
+            queued, total = imported
+            added = f"✅ Added **{queued}** tracks to queue!"
+            if queued < total:
+                added = f"✅ Added **{queued}** tracks to queue, importing the other {total - queued} in the background..."
 
         else:
             # YouTube URL or search query
@@ -366,55 +818,45 @@ class Music(commands.Cog):
                 query = f"ytsearch:{query}"
 
             try:
-                # Extract info
-                info = await self.bot.loop.run_in_executor(None, lambda: ytdl.extract_info(query, download=False))
-                
-                if 'entries' in info:
-                    info = info['entries'][0]
-
-                queue.add({
-                    'url': info['webpage_url'],
-                    'title': info['title'],
-                    'requester': interaction.user
-                })
+                # Extract info (cached, so the stream URL is reused when the track starts)
+                info = await resolve(query, loop=self.bot.loop, guild_id=interaction.guild.id)
+
+                queue.add(Track(info['webpage_url'], info['title'], interaction.user))
+                added = f"✅ Added to queue: **{info['title']}**"
 
             except Exception as e:
                 await interaction.followup.send(f"❌ Error: {str(e)}", ephemeral=True)
                 return
 
+        # Resolve upcoming tracks now if something is already playing
+        self.prefetch_upcoming(interaction.guild.id)
+
+        # Create a context-like object for play_next
+        class FakeContext:
+            def __init__(self, interaction):
+                self.guild = interaction.guild
+                self.voice_client = interaction.guild.voice_client
+                self.send = interaction.channel.send
+
+        ctx = FakeContext(interaction)
+
         # Start playing if not already playing
         if not interaction.guild.voice_client.is_playing():
-            # Create a context-like object for play_next
-            class FakeContext:
-                def __init__(self, interaction):
-                    self.guild = interaction.guild
-                    self.voice_client = interaction.guild.voice_client
-                    self.send = interaction.channel.send
-
-            await self.play_next(FakeContext(interaction))
+            await self.play_next(ctx)
         
-        # Show or update the music control panel
+        # Show or update the music control panel, posting a new one if the old one's channel is gone
+        panel = self.panel_messages.get(interaction.guild.id)
+        if panel and not interaction.guild.get_channel_or_thread(panel[0].channel.id):
+            self.forget_panel(interaction.guild.id)
         if interaction.guild.id in self.panel_messages:
-            # Update existing panel
-            panel_msg, panel_view = self.panel_messages[interaction.guild.id]
-            try:
-                updated_embed = panel_view.create_embed()
-                await panel_msg.edit(embed=updated_embed, view=panel_view)
-                await interaction.followup.send("✅ Song added to queue!", ephemeral=True)
-            except:
-                # Panel message was deleted, create new one
-                view = MusicControlPanel(self.bot, FakeContext(interaction), timeout=None)
-                embed = view.create_embed()
-                panel_msg = await interaction.followup.send(embed=embed, view=view)
-                view.panel_message = panel_msg
-                self.panel_messages[interaction.guild.id] = (panel_msg, view)
+            self.refresh_panel(interaction.guild.id)
         else:
-            # Create new panel
-            view = MusicControlPanel(self.bot, FakeContext(interaction), timeout=None)
-            embed = view.create_embed()
-            panel_msg = await interaction.followup.send(embed=embed, view=view)
-            view.panel_message = panel_msg
-            self.panel_messages[interaction.guild.id] = (panel_msg, view)
+            try:
+                await self.post_panel(ctx, interaction.channel)
+            except discord.Forbidden:
+                await interaction.followup.send("❌ I can't post the music panel in this channel!", ephemeral=True)
+        
+        await interaction.followup.send(added, ephemeral=True)
 
 
 
@@ -0,0 +1,123 @@
+"""
+Local Opus cache for frequently played tracks.
+Once a guild has played a track AUDIO_CACHE_MIN_PLAYS times, FFmpeg saves its audio to an Ogg/Opus
+file in the background (copying Opus streams, encoding anything else), and later plays read that file
+instead of streaming and transcoding it from YouTube again. Files share a byte quota and the least
+recently played ones are evicted first. Off unless MUSIC_AUDIO_CACHE_MB is set.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from ..utils import metrics
+from ..utils.lru import DiskLRU
+
+logger = logging.getLogger('DiscordBot.MusicCache')
+
+AUDIO_CACHE_DIR = "data/cache/music"
+AUDIO_CACHE_BYTES = int(os.getenv('MUSIC_AUDIO_CACHE_MB', '0')) * 1024 * 1024  # 0 disables the cache
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv('MUSIC_AUDIO_CACHE_MIN_PLAYS', '3'))  # Plays in a guild before a track is saved
+AUDIO_CACHE_WORKERS = int(os.getenv('MUSIC_AUDIO_CACHE_WORKERS', '1'))  # Concurrent FFmpeg downloads
+AUDIO_CACHE_MAX_DURATION = int(os.getenv('MUSIC_AUDIO_CACHE_MAX_DURATION', '900'))  # Longer tracks (mixes) aren't saved
+AUDIO_CACHE_TIMEOUT = 600  # Seconds one download may take
+RETRY_AFTER = 3600  # Seconds before a track that failed to download is tried again
+
+
+class AudioCache:
+    """Disk LRU of Opus files keyed by video key, filled by background FFmpeg downloads"""
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_BYTES,
+                 workers: int = AUDIO_CACHE_WORKERS):
+        self.enabled = max_bytes > 0
+        self.disk = DiskLRU(directory, max_bytes)
+        self._slots = asyncio.Semaphore(workers)
+        self._inflight = {}  # Video key -> task saving it
+        self._failed = {}  # Video key -> monotonic() after which it may be retried
+
+    async def path(self, key):
+        """Local file for a video key, or None"""
+        if not self.enabled:
+            return None
+        path = await asyncio.get_running_loop().run_in_executor(None, self.disk.path, key)
+        metrics.increment('music.audio_cache.hit' if path else 'music.audio_cache.miss')
+        return path
+
+    def store(self, key, url, *, plays, duration, executable='ffmpeg', input_options='', copy=False, bitrate=128):
+        """
+        Save a track in the background if it's popular enough and not saved or saving already.
+        copy keeps an Opus stream as is, otherwise FFmpeg encodes at bitrate kbps. Never blocks playback.
+        """
+        if not self.enabled or plays < AUDIO_CACHE_MIN_PLAYS or key in self._inflight:
+            return
+        if not duration or duration > AUDIO_CACHE_MAX_DURATION:
+            return  # Live streams have no duration
+        if self._failed.get(key, 0) > time.monotonic():
+            return
+
+        args = [executable, '-nostdin', '-loglevel', 'error', *input_options.split(), '-i', url, '-vn', '-map', '0:a:0']
+        args += ['-c:a', 'copy'] if copy else ['-c:a', 'libopus', '-b:a', f'{bitrate}k']
+        task = asyncio.ensure_future(self._store(key, args))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._store_done(key))
+        metrics.set_gauge('music.audio_cache.pending', len(self._inflight))
+
+    def _store_done(self, key):
+        self._inflight.pop(key, None)
+        metrics.set_gauge('music.audio_cache.pending', len(self._inflight))
+
+    async def _store(self, key, args):
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            if await loop.run_in_executor(None, self.disk.path, key):
+                return  # Saved by an earlier play (the disk tier is only checked off the event loop)
+
+            fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self.disk.directory)  # Same filesystem as the cache
+            os.close(fd)
+            started = time.perf_counter()
+            process = None
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args, '-f', 'ogg', '-y', tmp_path,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await asyncio.wait_for(process.communicate(), AUDIO_CACHE_TIMEOUT)
+                if process.returncode:
+                    raise RuntimeError(stderr.decode(errors='replace').strip()[-300:] or f"exit code {process.returncode}")
+                await loop.run_in_executor(None, self.disk.put_file, key, tmp_path)
+            except Exception as e:
+                now = time.monotonic()
+                self._failed[key] = now + RETRY_AFTER
+                if len(self._failed) > 1000:
+                    self._failed = {k: until for k, until in self._failed.items() if until > now}
+                metrics.increment('music.audio_cache.failed')
+                logger.warning(f"Failed to save {key} to the audio cache: {e}")
+            else:
+                metrics.increment('music.audio_cache.stored')
+                metrics.observe('music.audio_cache.store_ms', (time.perf_counter() - started) * 1000)
+                metrics.set_gauge('music.audio_cache.bytes', self.disk.nbytes)
+            finally:
+                if process and process.returncode is None:
+                    process.kill()  # Timed out or cancelled on unload
+                    await process.wait()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def cancel(self):
+        """Stop every download in progress"""
+        for task in list(self._inflight.values()):
+            task.cancel()
+
+
+_cache = None
+
+
+def get_audio_cache() -> AudioCache:
+    """The process-wide audio cache"""
+    global _cache
+    if _cache is None:
+        _cache = AudioCache()
+    return _cache
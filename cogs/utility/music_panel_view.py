@@ -4,8 +4,8 @@ Music Panel View - Interactive music control panel with buttons
 import discord
 from discord import ui
 from discord.ext import commands
-import asyncio
-import yt_dlp
+from .music_utils import resolve
+from .music_queue_utils import LOOP_ALL, LOOP_OFF, LOOP_ONE, Track
 
 
 
@@ -45,21 +45,21 @@ class AddSongModal(ui.Modal, title="Add Song to Queue"):
                 await interaction.followup.send("❌ Spotify integration not configured!", ephemeral=True)
                 return
             
-            tracks = await self.music_cog.get_spotify_tracks(query)
+            if self.guild.id in self.music_cog.imports:
+                await interaction.followup.send("⏳ Still importing a playlist, try again when it's done!", ephemeral=True)
+                return
+            
+            imported = await self.music_cog.start_spotify_import(self.guild.id, query, interaction.user)
             
-            if not tracks:
+            if not imported:
                 await interaction.followup.send("❌ Failed to extract Spotify tracks!", ephemeral=True)
                 return
             
-            # Add all tracks to queue
-            for track_name in tracks:
-                queue.add({
-                    'url': f"ytsearch:{track_name}",
-                    'title': track_name,
-                    'requester': interaction.user
-                })
-            
-            await interaction.followup.send(f"✅ Added **{len(tracks)}** tracks to queue!", ephemeral=True)
+            queued, total = imported
+            if queued < total:
+                await interaction.followup.send(f"✅ Added **{queued}** tracks to queue, importing the other {total - queued} in the background...", ephemeral=True)
+            else:
+                await interaction.followup.send(f"✅ Added **{queued}** tracks to queue!", ephemeral=True)
         
         else:
             # YouTube URL or search query
@@ -67,21 +67,10 @@ class AddSongModal(ui.Modal, title="Add Song to Queue"):
                 query = f"ytsearch:{query}"
             
             try:
-                # Extract info
-                ytdl = yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True})
-                info = await interaction.client.loop.run_in_executor(
-                    None, 
-                    lambda: ytdl.extract_info(query, download=False)
-                )
-                
-                if 'entries' in info:
-                    info = info['entries'][0]
+                # Extract info (shares the music cog's resolve cache)
+                info = await resolve(query, loop=interaction.client.loop, guild_id=self.guild.id)
                 
-                queue.add({
-                    'url': info['webpage_url'],
-                    'title': info['title'],
-                    'requester': interaction.user
-                })
+                queue.add(Track(info['webpage_url'], info['title'], interaction.user))
                 
                 await interaction.followup.send(f"✅ Added to queue: **{info['title']}**", ephemeral=True)
             
@@ -89,6 +78,8 @@ class AddSongModal(ui.Modal, title="Add Song to Queue"):
                 await interaction.followup.send(f"❌ Error: {str(e)}", ephemeral=True)
                 return
         
+        self.music_cog.prefetch_upcoming(self.guild.id)
+        
         # Start playing if not already playing
         if not self.guild.voice_client or not self.guild.voice_client.is_playing():
             # Create a context-like object
@@ -110,7 +101,6 @@ class MusicControlPanel(ui.View):
         self.bot = bot
         self.ctx = ctx
         self.music_cog = bot.get_cog('Music')
-        self.loop_mode = False  # False = off, True = on
         self.panel_message = panel_message  # Store reference to the panel message
         
     async def on_error(self, interaction: discord.Interaction, error: Exception, item: ui.Item):
@@ -147,8 +137,8 @@ class MusicControlPanel(ui.View):
         
         if current:
             # Song info
-            title = current.get('title', 'Unknown')
-            requester = current.get('requester')
+            title = current.title or 'Unknown'
+            requester = current.requester_mention
             
             # Display actual song title
             embed.add_field(
@@ -159,7 +149,7 @@ class MusicControlPanel(ui.View):
             
             embed.add_field(
                 name="👤 Requested By",
-                value=f"{requester.mention}" if requester else "Unknown",
+                value=requester or "Unknown",
                 inline=True
             )
             
@@ -189,10 +179,22 @@ class MusicControlPanel(ui.View):
         else:
             embed.description = "No music currently playing"
         
+        # Spotify import progress
+        progress = self.music_cog.imports.get(self.ctx.guild.id) if self.music_cog else None
+        if progress:
+            embed.add_field(
+                name="📥 Importing Playlist",
+                value=f"{progress['queued']}/{progress['total']} queued · {progress['ready']} ready",
+                inline=False
+            )
+        
         # Add status indicators
         status_text = []
-        if self.loop_mode:
-            status_text.append("🔁 Loop: ON")
+        loop_mode = self.music_cog.get_queue(self.ctx.guild.id).loop_mode if self.music_cog else LOOP_OFF
+        if loop_mode == LOOP_ALL:
+            status_text.append("🔁 Loop: Queue")
+        elif loop_mode == LOOP_ONE:
+            status_text.append("🔂 Loop: Track")
         # Check AutoPlay from Music cog
         if self.music_cog and self.music_cog.autoplay_enabled.get(self.ctx.guild.id, False):
             status_text.append("🎲 AutoPlay: ON")
@@ -202,6 +204,14 @@ class MusicControlPanel(ui.View):
         
         return embed
     
+    async def show(self, interaction: discord.Interaction):
+        """Re-render the panel as the interaction response, noting it so coalesced refreshes don't repeat the edit"""
+        embed = self.create_embed()
+        await interaction.response.edit_message(embed=embed, view=self)
+        panel = self.music_cog.panel_messages.get(interaction.guild.id) if self.music_cog else None
+        if panel and panel[0].id == interaction.message.id:
+            self.music_cog.mark_panel_rendered(interaction.guild.id, embed)
+    
     # First row - Playback controls
     @ui.button(label="Down", style=discord.ButtonStyle.secondary, emoji="🔉", row=0)
     async def volume_down(self, interaction: discord.Interaction, button: ui.Button):
@@ -210,9 +220,8 @@ class MusicControlPanel(ui.View):
             await interaction.response.send_message("❌ Nothing is playing!", ephemeral=True)
             return
         
-        current_volume = interaction.guild.voice_client.source.volume
-        new_volume = max(0.0, current_volume - 0.1)
-        interaction.guild.voice_client.source.volume = new_volume
+        current_volume = self.music_cog.volumes.get(interaction.guild.id, 1.0)
+        new_volume = await self.music_cog.set_volume(interaction.guild, current_volume - 0.1)
         
         await interaction.response.send_message(
             f"🔉 Volume decreased to {int(new_volume * 100)}%",
@@ -221,11 +230,25 @@ class MusicControlPanel(ui.View):
     
     @ui.button(label="Back", style=discord.ButtonStyle.secondary, emoji="⏮️", row=0)
     async def previous(self, interaction: discord.Interaction, button: ui.Button):
-        """Go to previous song (not implemented in basic queue)"""
-        await interaction.response.send_message(
-            "⏮️ Previous track feature coming soon!",
-            ephemeral=True
-        )
+        """Go back to the previous song"""
+        if not self.music_cog or not interaction.guild.voice_client:
+            await interaction.response.send_message("❌ Not connected to voice!", ephemeral=True)
+            return
+        
+        queue = self.music_cog.get_queue(interaction.guild.id)
+        track = queue.previous()
+        if not track:
+            await interaction.response.send_message("❌ No previous track!", ephemeral=True)
+            return
+        
+        # Answer first, starting the track can take longer than the interaction stays valid
+        await interaction.response.send_message(f"⏮️ Back to **{track.title}**", ephemeral=True)
+        
+        vc = interaction.guild.voice_client
+        if vc.is_playing() or vc.is_paused():
+            vc.stop()  # The player's after callback plays the track lined up by previous()
+        else:
+            await self.music_cog.play_next(self.ctx)
     
     @ui.button(label="Pause", style=discord.ButtonStyle.primary, emoji="⏸️", row=0)
     async def pause_resume(self, interaction: discord.Interaction, button: ui.Button):
@@ -258,15 +281,14 @@ class MusicControlPanel(ui.View):
             await interaction.response.send_message("❌ Nothing is playing!", ephemeral=True)
             return
         
+        if self.music_cog:
+            self.music_cog.get_queue(interaction.guild.id).skip_requested = True  # Move on even in loop-one mode
         interaction.guild.voice_client.stop()
         await interaction.response.send_message("⏭️ Skipped!", ephemeral=True)
         
-        # Update embed
-        await asyncio.sleep(0.5)
-        try:
-            await interaction.message.edit(embed=self.create_embed())
-        except:
-            pass
+        # Update embed (merged with the refresh the next track triggers)
+        if self.music_cog:
+            self.music_cog.refresh_panel(interaction.guild.id)
     
     @ui.button(label="Up", style=discord.ButtonStyle.secondary, emoji="🔊", row=0)
     async def volume_up(self, interaction: discord.Interaction, button: ui.Button):
@@ -275,9 +297,8 @@ class MusicControlPanel(ui.View):
             await interaction.response.send_message("❌ Nothing is playing!", ephemeral=True)
             return
         
-        current_volume = interaction.guild.voice_client.source.volume
-        new_volume = min(1.0, current_volume + 0.1)
-        interaction.guild.voice_client.source.volume = new_volume
+        current_volume = self.music_cog.volumes.get(interaction.guild.id, 1.0)
+        new_volume = await self.music_cog.set_volume(interaction.guild, current_volume + 0.1)
         
         await interaction.response.send_message(
             f"🔊 Volume increased to {int(new_volume * 100)}%",
@@ -298,23 +319,33 @@ class MusicControlPanel(ui.View):
             await interaction.response.send_message("❌ Queue is empty!", ephemeral=True)
             return
         
-        import random
-        random.shuffle(queue.queue)
+        queue.shuffle()
         
         await interaction.response.send_message("🔀 Queue shuffled!", ephemeral=True)
     
     @ui.button(label="Loop", style=discord.ButtonStyle.secondary, emoji="🔁", row=1)
     async def loop(self, interaction: discord.Interaction, button: ui.Button):
-        """Toggle loop mode"""
-        self.loop_mode = not self.loop_mode
+        """Cycle loop mode: off -> queue -> track"""
+        if not self.music_cog:
+            await interaction.response.send_message("❌ Music system not available!", ephemeral=True)
+            return
+        
+        loop_mode = self.music_cog.get_queue(interaction.guild.id).cycle_loop_mode()
         
-        if self.loop_mode:
+        if loop_mode == LOOP_ALL:
             button.style = discord.ButtonStyle.success
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
-            await interaction.followup.send("🔁 Loop enabled!", ephemeral=True)
+            button.emoji = "🔁"
+            await self.show(interaction)
+            await interaction.followup.send("🔁 Looping the queue!", ephemeral=True)
+        elif loop_mode == LOOP_ONE:
+            button.style = discord.ButtonStyle.success
+            button.emoji = "🔂"
+            await self.show(interaction)
+            await interaction.followup.send("🔂 Looping this track!", ephemeral=True)
         else:
             button.style = discord.ButtonStyle.secondary
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+            button.emoji = "🔁"
+            await self.show(interaction)
             await interaction.followup.send("🔁 Loop disabled!", ephemeral=True)
     
     @ui.button(label="Stop", style=discord.ButtonStyle.danger, emoji="⏹️", row=1)
@@ -325,6 +356,7 @@ class MusicControlPanel(ui.View):
             return
         
         queue = self.music_cog.get_queue(interaction.guild.id)
+        self.music_cog.cancel_import(interaction.guild.id)
         queue.clear()
         
         if interaction.guild.voice_client:
@@ -345,14 +377,6 @@ class MusicControlPanel(ui.View):
             await interaction.response.send_message("❌ Music system not available!", ephemeral=True)
             return
         
-        # Check if Spotify is configured
-        if not self.music_cog.spotify:
-            await interaction.response.send_message(
-                "❌ AutoPlay requires Spotify integration! Add SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET to .env",
-                ephemeral=True
-            )
-            return
-        
         # Toggle AutoPlay state in Music cog
         current_state = self.music_cog.autoplay_enabled.get(interaction.guild.id, False)
         new_state = not current_state
@@ -360,11 +384,11 @@ class MusicControlPanel(ui.View):
         
         if new_state:
             button.style = discord.ButtonStyle.success
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+            await self.show(interaction)
             await interaction.followup.send("🎲 AutoPlay enabled! Similar songs will be added automatically.", ephemeral=True)
         else:
             button.style = discord.ButtonStyle.secondary
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+            await self.show(interaction)
             await interaction.followup.send("🎲 AutoPlay disabled!", ephemeral=True)
     
     @ui.button(label="Playlist", style=discord.ButtonStyle.secondary, emoji="📜", row=1)
@@ -388,16 +412,16 @@ class MusicControlPanel(ui.View):
         if queue.current:
             embed.add_field(
                 name="🎵 Now Playing",
-                value=f"**{queue.current['title']}**",
+                value=f"**{queue.current.title}**",
                 inline=False
             )
         
         if not queue.is_empty():
-            upcoming = "\n".join([f"{i+1}. {track['title']}" for i, track in enumerate(queue.queue[:10])])
-            if len(queue.queue) > 10:
-                upcoming += f"\n... and {len(queue.queue) - 10} more"
+            upcoming = "\n".join([f"{i+1}. {track.title}" for i, track in enumerate(queue.upcoming(10))])
+            if len(queue) > 10:
+                upcoming += f"\n... and {len(queue) - 10} more"
             embed.add_field(
-                name=f"⏭️ Up Next ({len(queue.queue)} songs)",
+                name=f"⏭️ Up Next ({len(queue)} songs)",
                 value=upcoming,
                 inline=False
             )
@@ -0,0 +1,203 @@
+"""
+Music queue engine.
+Upcoming tracks live in a deque (O(1) enqueue/dequeue at both ends), finished tracks in a
+bounded history ring so Previous works, and the loop mode belongs to the queue so playback
+honours it. Queues snapshot to a JSON file so they survive restarts and redeploys.
+"""
+import json
+import logging
+import os
+import random
+from collections import deque
+from itertools import islice
+from pathlib import Path
+
+logger = logging.getLogger('DiscordBot.MusicQueue')
+
+QUEUE_SNAPSHOT_PATH = Path('data/music_queues.json')
+HISTORY_SIZE = int(os.getenv('MUSIC_HISTORY_SIZE', '50'))  # Finished tracks kept per guild for Previous
+
+LOOP_OFF = 'off'
+LOOP_ONE = 'one'  # Repeat the current track
+LOOP_ALL = 'all'  # Finished tracks go to the back of the queue
+LOOP_MODES = (LOOP_OFF, LOOP_ALL, LOOP_ONE)  # Order the panel's Loop button cycles through
+
+
+class Track:
+    """One queue entry. url is a video link or a ytsearch: query"""
+    __slots__ = ('url', 'title', 'requester', 'requester_id', 'prefetch')
+
+    def __init__(self, url, title, requester=None, requester_id=None):
+        self.url = url
+        self.title = title
+        self.requester = requester  # Member, or None for tracks restored from a snapshot
+        self.requester_id = requester_id or (requester.id if requester else None)
+        self.prefetch = None  # Task resolving the stream ahead of playback
+
+    @property
+    def requester_mention(self):
+        if self.requester:
+            return self.requester.mention
+        return f"<@{self.requester_id}>" if self.requester_id else None
+
+    def to_dict(self):
+        return {'url': self.url, 'title': self.title, 'requester_id': self.requester_id}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['url'], data['title'], requester_id=data.get('requester_id'))
+
+
+class MusicQueue:
+    """Queue system for music tracks"""
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.queue = deque()
+        self.history = deque(maxlen=history_size)
+        self.current = None
+        self.loop_mode = LOOP_OFF
+        self.skip_requested = False  # Set by Skip so loop-one moves on instead of repeating
+        self.version = 0  # Bumped on every change, so snapshots only rewrite changed queues
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _changed(self):
+        self.version += 1
+
+    def add(self, track):
+        """Add track to queue"""
+        self.queue.append(track)
+        self._changed()
+
+    def add_next(self, track):
+        """Add track to the front of the queue"""
+        self.queue.appendleft(track)
+        self._changed()
+
+    def next(self):
+        """Advance to the next track, honouring the loop mode. Returns it, or None when the queue is done"""
+        finished = self.current
+        skipped, self.skip_requested = self.skip_requested, False
+        self._changed()
+
+        if finished is not None:
+            if self.loop_mode == LOOP_ONE and not skipped:
+                return finished
+            self.history.append(finished)
+            if self.loop_mode == LOOP_ALL:
+                self.queue.append(finished)
+
+        self.current = self.queue.popleft() if self.queue else None
+        return self.current
+
+    def drop_current(self):
+        """Forget the current track (it failed to play) so advancing neither repeats nor re-queues it"""
+        self.current = None
+        self.skip_requested = False
+        self._changed()
+
+    def has_next(self):
+        """Whether next() would return a track"""
+        if self.queue:
+            return True
+        if self.current is None:
+            return False
+        return self.loop_mode == LOOP_ALL or (self.loop_mode == LOOP_ONE and not self.skip_requested)
+
+    def previous(self):
+        """
+        Line up the last finished track to play next, with the current one after it.
+        The caller stops the player so playback moves on to it. Returns the track, or None if there's no history.
+        """
+        if not self.history:
+            return None
+        track = self.history.pop()
+        if self.current is not None:
+            self.queue.appendleft(self.current)
+            self.current = None  # Don't push it into history again when playback advances
+        self.queue.appendleft(track)
+        self._changed()
+        return track
+
+    def upcoming(self, limit=None):
+        """The next tracks without removing them"""
+        return list(islice(self.queue, limit))
+
+    def remove(self, index):
+        """Remove and return the upcoming track at index (0 = next)"""
+        track = self.queue[index]
+        del self.queue[index]
+        self._changed()
+        return track
+
+    def move(self, index, new_index):
+        """Move an upcoming track to another position"""
+        track = self.queue[index]
+        del self.queue[index]
+        self.queue.insert(new_index, track)
+        self._changed()
+
+    def shuffle(self):
+        """Shuffle the upcoming tracks"""
+        tracks = list(self.queue)  # Shuffling the deque in place would index into its middle O(n) times
+        random.shuffle(tracks)
+        self.queue = deque(tracks)
+        self._changed()
+
+    def cycle_loop_mode(self):
+        """off -> all -> one -> off. Returns the new mode"""
+        self.loop_mode = LOOP_MODES[(LOOP_MODES.index(self.loop_mode) + 1) % len(LOOP_MODES)]
+        self._changed()
+        return self.loop_mode
+
+    def clear(self):
+        """Clear queue"""
+        self.queue.clear()
+        self.history.clear()
+        self.current = None
+        self._changed()
+
+    def is_empty(self):
+        """Check if queue is empty"""
+        return len(self.queue) == 0
+
+    def snapshot(self):
+        """JSON-able state. The current track is saved first in the queue so it starts over after a restore"""
+        upcoming = ([self.current] if self.current else []) + list(self.queue)
+        return {
+            'queue': [track.to_dict() for track in upcoming],
+            'history': [track.to_dict() for track in self.history],
+            'loop_mode': self.loop_mode,
+        }
+
+    @classmethod
+    def from_snapshot(cls, data):
+        queue = cls()
+        queue.queue.extend(Track.from_dict(track) for track in data.get('queue', []))
+        queue.history.extend(Track.from_dict(track) for track in data.get('history', []))
+        if data.get('loop_mode') in LOOP_MODES:
+            queue.loop_mode = data['loop_mode']
+        return queue
+
+
+def load_queues(path=QUEUE_SNAPSHOT_PATH):
+    """Guild ID -> MusicQueue from the last snapshot"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {int(guild_id): MusicQueue.from_snapshot(snapshot) for guild_id, snapshot in data.items()}
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, TypeError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable queue snapshot {path}: {e}")
+        return {}
+
+
+def save_queues(snapshots, path=QUEUE_SNAPSHOT_PATH):
+    """Write {guild id: snapshot} (blocking, call from an executor)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({str(guild_id): snapshot for guild_id, snapshot in snapshots.items()}, f, ensure_ascii=False)
+    os.replace(tmp, path)
@@ -0,0 +1,167 @@
+"""
+Local music recommendations from the bot's own play history.
+Each guild has a weighted co-play graph: tracks played close together get an edge, weighted by
+how close and how often. Suggestions are the strongest neighbours of the last few tracks,
+so autoplay works without Spotify and answers in microseconds.
+"""
+import heapq
+import json
+import logging
+import os
+from collections import defaultdict, deque
+from pathlib import Path
+
+from ..utils import metrics
+
+logger = logging.getLogger('DiscordBot.MusicRecommend')
+
+COPLAY_PATH = Path('data/music_coplay.json')
+COPLAY_WINDOW = 3  # Earlier tracks a new play is linked to
+WINDOW_WEIGHTS = (1.0, 0.5, 0.25)  # Edge weight by distance (previous track, the one before, ...)
+MAX_NEIGHBOURS = 50  # Weakest edges are dropped beyond this many per track
+MAX_TRACKS = int(os.getenv('MUSIC_COPLAY_MAX_TRACKS', '2000'))  # Per guild, least played tracks are dropped
+
+
+class CoPlayGraph:
+    """One guild's co-play graph"""
+
+    def __init__(self):
+        self.tracks = {}  # key -> {'title', 'url', 'plays'}
+        self.edges = defaultdict(dict)  # key -> {other key: weight}
+        self.recent = deque(maxlen=COPLAY_WINDOW)  # Most recent last
+
+    def record(self, key, title, url):
+        """Count a play and link it to the tracks played just before it"""
+        track = self.tracks.setdefault(key, {'title': title, 'url': url, 'plays': 0})
+        track['plays'] += 1
+        track['title'], track['url'] = title, url
+
+        for distance, previous in enumerate(reversed(self.recent)):
+            if previous == key or previous not in self.tracks:
+                continue
+            weight = WINDOW_WEIGHTS[distance]
+            self._link(key, previous, weight)
+            self._link(previous, key, weight)
+        if not self.recent or self.recent[-1] != key:
+            self.recent.append(key)
+
+        if len(self.tracks) > MAX_TRACKS:
+            self._evict()
+
+    def _link(self, a, b, weight):
+        neighbours = self.edges[a]
+        neighbours[b] = neighbours.get(b, 0.0) + weight
+        if len(neighbours) > MAX_NEIGHBOURS:
+            weakest = min(neighbours, key=neighbours.get)
+            del neighbours[weakest]
+
+    def _evict(self):
+        """Drop the least played tenth of the tracks"""
+        drop = set(heapq.nsmallest(max(1, len(self.tracks) // 10), self.tracks,
+                                   key=lambda k: self.tracks[k]['plays']))
+        drop.difference_update(self.recent)
+        for key in drop:
+            del self.tracks[key]
+            self.edges.pop(key, None)
+        # _link trims each side on its own, so edges to a dropped track can be on lists it doesn't point back to
+        for neighbours in self.edges.values():
+            for key in drop.intersection(neighbours):
+                del neighbours[key]
+
+    def recommend(self, limit=5, exclude=()):
+        """
+        Tracks most often played around the recent ones, strongest first.
+        Returns a list of {'key', 'title', 'url'}.
+        """
+        skip = set(exclude) | set(self.recent)
+        scores = defaultdict(float)
+        # The latest track counts most, like the edges themselves
+        for distance, seed in enumerate(reversed(self.recent)):
+            for other, weight in self.edges.get(seed, {}).items():
+                if other not in skip and other in self.tracks:
+                    scores[other] += weight * WINDOW_WEIGHTS[distance]
+        best = heapq.nlargest(limit, scores, key=scores.get)
+        return [{'key': key, 'title': self.tracks[key]['title'], 'url': self.tracks[key]['url']} for key in best]
+
+    def to_dict(self):
+        """Copy of the graph, safe to serialize while record() keeps changing it"""
+        return {
+            'tracks': {key: dict(track) for key, track in self.tracks.items()},
+            'edges': {key: dict(neighbours) for key, neighbours in self.edges.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        graph = cls()
+        graph.tracks = data.get('tracks', {})
+        graph.edges = defaultdict(dict, data.get('edges', {}))
+        return graph
+
+
+class CoPlayStore:
+    """Co-play graphs for every guild, saved to COPLAY_PATH"""
+
+    def __init__(self, path=COPLAY_PATH):
+        self.path = path
+        self.graphs = self._load()
+        self.dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return {int(guild_id): CoPlayGraph.from_dict(graph) for guild_id, graph in data.items()}
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, TypeError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable co-play graph {self.path}: {e}")
+            return {}
+
+    def snapshot(self):
+        """Copy of the graphs to save, or None if nothing changed (call on the event loop, where plays are recorded)"""
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return {str(guild_id): graph.to_dict() for guild_id, graph in self.graphs.items()}
+
+    def write(self, data):
+        """Write a snapshot (blocking, call from an executor)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def save(self):
+        """Snapshot and write the graphs if they changed (blocking, for shutdown)"""
+        data = self.snapshot()
+        if data is not None:
+            self.write(data)
+
+    def graph(self, guild_id):
+        if guild_id not in self.graphs:
+            self.graphs[guild_id] = CoPlayGraph()
+        return self.graphs[guild_id]
+
+    def record(self, guild_id, key, title, url):
+        """Add a play to the guild's graph"""
+        self.graph(guild_id).record(key, title, url)
+        self.dirty = True
+
+    def recommend(self, guild_id, limit=5, exclude=()):
+        """Suggestions for what the guild should hear next"""
+        graph = self.graphs.get(guild_id)
+        results = graph.recommend(limit, exclude) if graph else []
+        metrics.increment('music.recommend.local.hit' if results else 'music.recommend.local.miss')
+        return results
+
+
+_store = None
+
+
+def get_coplay_store():
+    """The process-wide co-play store (loaded on first use)"""
+    global _store
+    if _store is None:
+        _store = CoPlayStore()
+    return _store
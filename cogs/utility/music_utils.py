@@ -0,0 +1,385 @@
+"""
+Music track resolution - yt-dlp extraction behind a two-tier cache.
+Queries (search text, Spotify "Artist - Title" names, URLs) map to a video in a persistent LRU file,
+and signed stream URLs for those videos are kept in memory until they expire, so repeat plays
+skip the YouTube search and often extraction entirely.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import yt_dlp
+
+from ..utils import metrics
+
+logger = logging.getLogger('DiscordBot.MusicResolve')
+
+# YT-DLP options - Optimized for 192kbps quality
+YTDL_OPTIONS = {
+    'format': 'bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio/best',  # Opus can be passed straight to Discord
+    'extractaudio': True,
+    'audioformat': 'opus',  # Better quality than mp3
+    'audioquality': 0,  # 0 = best quality
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': 'opus',
+        'preferredquality': '192',  # Optimal for Discord (128kbps limit)
+    }],
+    'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
+    'restrictfilenames': True,
+    'noplaylist': False,
+    'nocheckcertificate': True,
+    'ignoreerrors': False,
+    'logtostderr': False,
+    'quiet': True,
+    'no_warnings': True,
+    'default_search': 'ytsearch',
+    'source_address': '0.0.0.0',
+}
+
+ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)  # Only for offline helpers like prepare_filename; extraction uses the pool
+
+EXTRACT_WORKERS = int(os.getenv('MUSIC_EXTRACT_WORKERS', '3'))  # Threads running yt-dlp
+GUILD_EXTRACT_LIMIT = int(os.getenv('MUSIC_GUILD_EXTRACT_LIMIT', '2'))  # Concurrent extractions per guild
+EXTRACT_TIMEOUT = float(os.getenv('MUSIC_EXTRACT_TIMEOUT', '30'))  # Seconds before a caller gives up
+
+STREAM_EXPIRY_MARGIN = 300  # Re-resolve stream URLs that expire within this many seconds
+DEFAULT_STREAM_TTL = 1800  # Assumed lifetime of stream URLs without an expire= parameter
+
+RESOLVE_CACHE_PATH = Path('data/music_resolve_cache.json')
+RESOLVE_CACHE_SIZE = int(os.getenv('MUSIC_RESOLVE_CACHE_SIZE', '5000'))  # Remembered query -> video entries
+STREAM_CACHE_SIZE = int(os.getenv('MUSIC_STREAM_CACHE_SIZE', '256'))  # Videos whose stream URL is kept
+
+# yt-dlp info kept for playback (the full dict holds every format and is far larger)
+PLAYBACK_FIELDS = (
+    'id', 'extractor', 'extractor_key', 'webpage_url', 'title', 'duration', 'thumbnail',
+    'uploader', 'channel', 'artist', 'url', 'acodec', 'ext',
+)
+# Metadata kept per video in the persistent tier
+VIDEO_FIELDS = ('id', 'webpage_url', 'title', 'duration', 'thumbnail', 'uploader')
+YOUTUBE_ID = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def stream_expires_at(stream_url):
+    """When a signed stream URL stops working (YouTube URLs carry an expire= timestamp)"""
+    try:
+        expire = parse_qs(urlparse(stream_url).query).get('expire')
+        if expire:
+            return float(expire[0])
+    except (ValueError, TypeError):
+        pass
+    return time.time() + DEFAULT_STREAM_TTL
+
+
+def is_fresh(data, margin=STREAM_EXPIRY_MARGIN):
+    """Whether extracted track info still has a usable stream URL"""
+    return bool(data and data.get('url')) and data.get('expires_at', 0) - margin > time.time()
+
+
+_pool = None
+_worker = threading.local()
+_guild_limits = {}  # Guild ID -> [asyncio.Semaphore, extractions holding or waiting for it], dropped when idle
+_counts_lock = threading.Lock()
+_pending = 0  # Submitted to the pool but not started yet
+_active = 0
+
+
+def _init_worker():
+    """Give every pool thread its own YoutubeDL (instances aren't safe to share between threads)"""
+    _worker.ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
+
+
+def get_extract_pool():
+    """The dedicated yt-dlp thread pool, so extraction never competes for the default executor"""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix='ytdl', initializer=_init_worker)
+    return _pool
+
+
+def shutdown_extract_pool():
+    """Drop queued extractions and let running ones finish in the background"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _acquire_guild_slot(guild_id):
+    """Wait for one of the guild's GUILD_EXTRACT_LIMIT slots. Returns the entry to release it with"""
+    entry = _guild_limits.get(guild_id)
+    if entry is None:
+        entry = _guild_limits[guild_id] = [asyncio.Semaphore(GUILD_EXTRACT_LIMIT), 0]
+    entry[1] += 1
+    try:
+        await entry[0].acquire()
+    except BaseException:
+        _leave_guild_slot(guild_id, entry, acquired=False)  # Cancelled while waiting
+        raise
+    return entry
+
+
+def _leave_guild_slot(guild_id, entry, acquired=True):
+    """Give a slot back (on the event loop), forgetting the guild once nothing holds or waits for one"""
+    if acquired:
+        entry[0].release()
+    entry[1] -= 1
+    if entry[1] == 0 and _guild_limits.get(guild_id) is entry:
+        del _guild_limits[guild_id]
+
+
+def _release_when_done(loop, guild_id, entry):
+    """Pool future callback (runs on the worker thread) - hand the slot back to the event loop"""
+    try:
+        loop.call_soon_threadsafe(_leave_guild_slot, guild_id, entry)
+    except RuntimeError:
+        pass  # Event loop already closed on shutdown
+
+
+def _count(pending=0, active=0):
+    """Adjust the pool queue counters (called from the event loop and pool threads)"""
+    global _pending, _active
+    with _counts_lock:
+        _pending += pending
+        _active += active
+        metrics.set_gauge('music.extract.pending', _pending)
+        metrics.set_gauge('music.extract.active', _active)
+
+
+def _run_extraction(url, download, submitted_at):
+    """Pool thread body"""
+    started = time.perf_counter()
+    _count(pending=-1, active=1)
+    metrics.observe('music.extract.wait_ms', (started - submitted_at) * 1000)
+    try:
+        return _worker.ytdl.extract_info(url, download=download)
+    finally:
+        _count(active=-1)
+        metrics.observe('music.extract.run_ms', (time.perf_counter() - started) * 1000)
+
+
+async def extract_track(url, *, loop=None, download=False, guild_id=None):
+    """
+    Run yt-dlp for one track on the extraction pool and return its info, with the stream URL's expiry.
+    At most GUILD_EXTRACT_LIMIT extractions per guild run at once, so one big import can't fill the pool.
+    A slot stays taken until the worker thread is done, even when the caller stops waiting on a timeout.
+    """
+    loop = loop or asyncio.get_event_loop()
+    entry = await _acquire_guild_slot(guild_id)
+    _count(pending=1)
+    try:
+        future = get_extract_pool().submit(_run_extraction, url, download, time.perf_counter())
+    except BaseException:
+        _count(pending=-1)
+        _leave_guild_slot(guild_id, entry)
+        raise
+    future.add_done_callback(lambda f: _release_when_done(loop, guild_id, entry))
+
+    try:
+        data = await asyncio.wait_for(asyncio.wrap_future(future, loop=loop), EXTRACT_TIMEOUT)
+    except asyncio.TimeoutError:
+        if future.cancel():
+            # Never started, so it won't decrement the pending count itself
+            _count(pending=-1)
+        metrics.increment('music.extract.timeout')
+        raise TimeoutError(f"Timed out after {EXTRACT_TIMEOUT:.0f}s looking up {url}")
+
+    if 'entries' in data:
+        # Playlist
+        data = data['entries'][0]
+
+    data = {field: data.get(field) for field in PLAYBACK_FIELDS}
+    data['expires_at'] = stream_expires_at(data.get('url'))
+    return data
+
+
+def youtube_id(url):
+    """Video ID from a youtube.com / youtu.be / music.youtube.com link, or None"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if host.endswith('youtu.be'):
+        candidate = parsed.path.lstrip('/').split('/')[0]
+    elif host.endswith('youtube.com'):
+        if parsed.path.startswith(('/shorts/', '/live/', '/embed/')):
+            candidate = parsed.path.split('/')[2]
+        else:
+            candidate = parse_qs(parsed.query).get('v', [''])[0]
+    else:
+        return None
+    return candidate if YOUTUBE_ID.match(candidate) else None
+
+
+def video_key(data):
+    """Cache key for an extracted video, e.g. youtube:dQw4w9WgXcQ (resolve cache entries carry theirs)"""
+    if 'key' in data:
+        return data['key']
+    return f"{data.get('extractor_key', 'generic').lower()}:{data['id']}"
+
+
+def query_key(query):
+    """
+    Normalized cache key for what a user or playlist asked for.
+    Search text is case and whitespace insensitive, YouTube links map to their video key.
+    """
+    query = query.strip()
+    if query.startswith('ytsearch:'):
+        query = query[len('ytsearch:'):]
+    if query.startswith(('http://', 'https://')):
+        video_id = youtube_id(query)
+        return f"youtube:{video_id}" if video_id else query
+    return 'search:' + ' '.join(query.lower().split())
+
+
+class ResolveCache:
+    """
+    Two tiers:
+    videos - query key -> video metadata, LRU, saved to RESOLVE_CACHE_PATH
+    streams - video key -> full extracted info, in memory, dropped once the stream URL expires
+    """
+
+    def __init__(self, path=RESOLVE_CACHE_PATH, max_entries=RESOLVE_CACHE_SIZE, max_streams=STREAM_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_streams = max_streams
+        self.videos = self._load()
+        self.streams = OrderedDict()
+        self.dirty = False
+
+    def _load(self):
+        """Load the persistent tier (oldest first, as saved)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return OrderedDict(json.load(f))
+        except FileNotFoundError:
+            return OrderedDict()
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable resolve cache {self.path}: {e}")
+            return OrderedDict()
+
+    def snapshot(self):
+        """Entries of the persistent tier to save, or None if unchanged (call on the event loop, where it changes)"""
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return list(self.videos.items())
+
+    def write(self, entries):
+        """Write a snapshot, oldest first (blocking, call from an executor)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def save(self):
+        """Snapshot and write the persistent tier if it changed (blocking, for shutdown)"""
+        entries = self.snapshot()
+        if entries is not None:
+            self.write(entries)
+
+    def lookup(self, query):
+        """Video metadata remembered for a query, or None"""
+        key = query_key(query)
+        video = self.videos.get(key)
+        if video is None:
+            metrics.increment('music.resolve_cache.miss')
+            return None
+        self.videos.move_to_end(key)
+        metrics.increment('music.resolve_cache.hit')
+        return video
+
+    def stream(self, video):
+        """Fresh extracted info for a video, or None"""
+        key = video['key']
+        data = self.streams.get(key)
+        if data is not None and is_fresh(data):
+            self.streams.move_to_end(key)
+            metrics.increment('music.stream_cache.hit')
+            return data
+        self.streams.pop(key, None)
+        metrics.increment('music.stream_cache.miss')
+        return None
+
+    def remember(self, query, data):
+        """Store an extraction result under the query that produced it and under its own video key"""
+        video = {field: data.get(field) for field in VIDEO_FIELDS}
+        video['key'] = video_key(data)
+        for key in {query_key(query), video['key']}:
+            self.videos[key] = video
+            self.videos.move_to_end(key)
+        while len(self.videos) > self.max_entries:
+            self.videos.popitem(last=False)
+        self.dirty = True
+
+        self.streams[video['key']] = data
+        self.streams.move_to_end(video['key'])
+        while len(self.streams) > self.max_streams:
+            self.streams.popitem(last=False)
+        metrics.set_gauge('music.resolve_cache.entries', len(self.videos))
+        metrics.set_gauge('music.stream_cache.entries', len(self.streams))
+
+
+_resolve_cache = None
+_inflight = {}  # Query key -> task resolving it
+
+
+def get_resolve_cache():
+    """The process-wide resolve cache (loaded on first use)"""
+    global _resolve_cache
+    if _resolve_cache is None:
+        _resolve_cache = ResolveCache()
+    return _resolve_cache
+
+
+async def _resolve(query, loop, guild_id):
+    cache = get_resolve_cache()
+    video = cache.lookup(query)
+    if video is not None:
+        data = cache.stream(video)
+        if data is not None:
+            return data
+        # Known video, stale stream URL: extract the video page directly, no search
+        data = await extract_track(video['webpage_url'], loop=loop, guild_id=guild_id)
+    else:
+        data = await extract_track(query, loop=loop, guild_id=guild_id)
+    cache.remember(query, data)
+    return data
+
+
+def _resolve_done(key, task):
+    _inflight.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # Retrieved here in case every caller gave up waiting
+
+
+async def resolve(query, *, loop=None, guild_id=None):
+    """
+    Extracted info (with a fresh stream URL) for a search query or URL.
+    Known queries go straight to their video instead of searching, and recently
+    extracted videos are returned from memory without calling yt-dlp at all.
+    Concurrent calls for the same query share one extraction.
+    """
+    key = query_key(query)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_resolve(query, loop, guild_id))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _resolve_done(key, t))
+    else:
+        metrics.increment('music.resolve.coalesced')
+    # Shielded so one caller giving up doesn't cancel the extraction for the others
+    return await asyncio.shield(task)
+
+
+async def warm(query, *, loop=None, guild_id=None):
+    """Make sure a query is in the persistent tier, extracting only if it has never been resolved"""
+    if query_key(query) not in get_resolve_cache().videos:
+        await resolve(query, loop=loop, guild_id=guild_id)
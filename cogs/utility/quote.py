@@ -9,13 +9,22 @@ from discord import app_commands
 import json
 import os
 import io
-import aiohttp
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+import asyncio
 import logging
+import time
+from ..utils import metrics
+from ..utils.asset_cache import read_asset
+from ..utils.lru import ByteLRU
+from ..utils.messages import resolve_reference
+from ..utils.render import get_render_service, RenderQueueFull
+from ..utils.render_budget import BUDGETS, choose_budget
+from .quote_utils import render_quote
 
 logger = logging.getLogger('DiscordBot.Quote')
 
 QUOTE_SETTINGS_FILE = "data/quote_settings.json"
+USER_CACHE_TTL = 600  # Seconds to reuse a fetched user (banner) between quotes
+RESULT_CACHE_BYTES = int(os.getenv('QUOTE_RESULT_CACHE_MB', '32')) * 1024 * 1024  # Finished quote images
 
 class DeleteQuoteButton(discord.ui.View):
     """View with a delete button for quotes"""
@@ -43,6 +52,8 @@ class Quote(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.settings = self.load_settings()
+        self.user_cache = {}  # user id -> (user, expires at)
+        self.result_cache = ByteLRU(RESULT_CACHE_BYTES, sizeof=lambda result: len(result[0]))
         
         # Add context menu
         self.ctx_menu = app_commands.ContextMenu(
@@ -188,7 +199,10 @@ class Quote(commands.Cog):
         
         # 1. Generate Image
         try:
-            img_buffer, is_gif = await self.generate_quote_image(message)
+            img_buffer, extension = await self.generate_quote_image(message)
+        except RenderQueueFull:
+            await interaction.followup.send("⏳ Too many quotes are being made right now, try again in a moment.", ephemeral=True)
+            return
         except Exception as e:
             logger.error(f"Failed to generate quote image: {e}")
             await interaction.followup.send("❌ Failed to generate quote image.", ephemeral=True)
@@ -219,7 +233,7 @@ class Quote(commands.Cog):
                     target_channel = self.bot.get_channel(settings["channel_id"])
         
         # 3. Create Embed and File
-        filename = "quote.gif" if is_gif else "quote.png"
+        filename = f"quote.{extension}"
         file = discord.File(fp=img_buffer, filename=filename)
         
         embed = discord.Embed(
@@ -275,14 +289,13 @@ class Quote(commands.Cog):
                     return
 
             # 3. Get Quoted Message
-            try:
-                original_message = await message.channel.fetch_message(message.reference.message_id) # Resolves usage of reply 
-            except:
-                return 
+            original_message = await resolve_reference(self.bot, message)
+            if not original_message:
+                return
 
             # 4. Generate Image
             try:
-                img_buffer, is_gif = await self.generate_quote_image(original_message)
+                img_buffer, extension = await self.generate_quote_image(original_message)
             except Exception as e:
                 logger.error(f"Failed to generate quote image: {e}")
                 return
@@ -292,7 +305,7 @@ class Quote(commands.Cog):
             output_channel = self.bot.get_channel(output_channel_id)
             
             if output_channel:
-                filename = "quote.gif" if is_gif else "quote.png"
+                filename = f"quote.{extension}"
                 file = discord.File(fp=img_buffer, filename=filename)
                 
                 embed = discord.Embed(
@@ -310,274 +323,102 @@ class Quote(commands.Cog):
             else:
                 logger.error("Output channel not found")
 
+    async def fetch_user_cached(self, author):
+        """Fetch the full user (for the banner), reusing it for USER_CACHE_TTL seconds"""
+        now = time.monotonic()
+        cached = self.user_cache.get(author.id)
+        if cached and cached[1] > now:
+            return cached[0]
+        try:
+            user = await self.bot.fetch_user(author.id)
+        except:
+            return author
+        self.user_cache[author.id] = (user, now + USER_CACHE_TTL)
+        # Drop expired entries so the cache doesn't grow forever
+        if len(self.user_cache) > 1000:
+            self.user_cache = {uid: entry for uid, entry in self.user_cache.items() if entry[1] > now}
+        return user
+
     async def generate_quote_image(self, message: discord.Message):
         """
         Generate a quote image with banner background and avatar decorations.
-        Creates animated GIF if avatar or decoration is animated.
-        Returns: (buffer, is_gif) tuple
+        Creates an animated GIF (or WebP) if the avatar is animated.
+        Downloads go through the asset cache; the Pillow work runs in the render pool.
+        Returns: (buffer, file extension) tuple
         """
-        # Configuration
-        WIDTH = 1200
-        HEIGHT = 500
-        TEXT_COLOR = (255, 255, 255)
-        NAME_COLOR = (220, 220, 220)
-        DATE_COLOR = (180, 180, 180)
+        # 1. Fetch full user object to get banner (cached, fetch_user is a REST call)
+        user = await self.fetch_user_cached(message.author)
         
-        # 1. Fetch full user object to get banner
-        try:
-            user = await self.bot.fetch_user(message.author.id)
-        except:
-            user = message.author
-        
-        
-        # 2. Prepare Assets (optimized for memory)
-        # Download avatar (check if animated) - use smaller size to save memory
-        avatar_asset = message.author.display_avatar.with_size(256)  # Reduced from 512
-        avatar_buffer = io.BytesIO()
-        await avatar_asset.save(avatar_buffer)
-        avatar_buffer.seek(0)
-        
-        # Open avatar and check if it's animated
-        avatar_img = Image.open(avatar_buffer)
-        is_animated_avatar = getattr(avatar_img, 'is_animated', False)
-        
-        
-        # Extract frames if animated (limit to 10 frames to prevent OOM)
-        avatar_frames = []
-        max_frames = 10  # Further reduced to prevent memory issues
-        
-        if is_animated_avatar:
-            try:
-                num_avatar_frames = min(avatar_img.n_frames, max_frames)
-                for frame_idx in range(num_avatar_frames):
-                    avatar_img.seek(frame_idx)
-                    avatar_frames.append(avatar_img.convert("RGBA").copy())
-                logger.info(f"Loaded {len(avatar_frames)} avatar frames")
-            except:
-                avatar_frames = [avatar_img.convert("RGBA")]
-        else:
-            avatar_frames = [avatar_img.convert("RGBA")]
+        # 2. Pick quality from current memory use and render load
+        budget = choose_budget()
+
+        # 3. Reuse the finished image if this exact quote was rendered before, at this quality or better
+        avatar = message.author.display_avatar
+        banner = user.banner if hasattr(user, 'banner') else None
+        decoration = getattr(message.author, 'avatar_decoration', None)
+        cache_key = (
+            message.id,
+            message.edited_at,
+            avatar.key,
+            banner.key if banner else None,
+            decoration.key if decoration else None,
+            message.author.display_name,
+        )
+        levels = list(BUDGETS)  # Best first
+        for level in levels[:levels.index(budget.level) + 1]:
+            cached = self.result_cache.get(cache_key + (level,))
+            if cached is not None:
+                metrics.increment('quote.result_cache.hit')
+                image_bytes, extension = cached
+                return io.BytesIO(image_bytes), extension
+        metrics.increment('quote.result_cache.miss')
+
+        # Read assets through the asset cache
+        avatar_key, avatar_bytes = await read_asset(avatar, budget.avatar_size)
         
-        # Download banner if available (smaller size)
-        banner_img = None
-        if hasattr(user, 'banner') and user.banner:
+        # Banner if available
+        banner_key, banner_bytes = None, None
+        if banner:
             try:
-                banner_asset = user.banner.with_size(512)  # Reduced from 1024
-                banner_buffer = io.BytesIO()
-                await banner_asset.save(banner_buffer)
-                banner_buffer.seek(0)
-                banner_img = Image.open(banner_buffer).convert("RGBA")
-                logger.info(f"Loaded banner for {user.name}")
+                banner_key, banner_bytes = await read_asset(banner, budget.banner_size)
             except Exception as e:
                 logger.warning(f"Failed to load banner: {e}")
         
-        # Try to get avatar decoration (Nitro feature) - USE STATIC ONLY to prevent OOM
-        decoration_frames = []
+        # Try to get avatar decoration (Nitro feature)
+        decoration_key, decoration_bytes = None, None
         try:
-            if hasattr(message.author, 'avatar_decoration') and message.author.avatar_decoration:
-                decoration_asset = message.author.avatar_decoration
-                decoration_buffer = io.BytesIO()
-                await decoration_asset.save(decoration_buffer)
-                decoration_buffer.seek(0)
-                decoration_img = Image.open(decoration_buffer)
-                
-                # ALWAYS use only first frame to prevent OOM crashes
-                # Animated decorations are too memory-intensive
-                decoration_img.seek(0)
-                decoration_frames = [decoration_img.convert("RGBA")]
-                logger.info(f"Loaded avatar decoration (static only to prevent OOM)")
+            if decoration:
+                decoration_key, decoration_bytes = await read_asset(decoration)
         except Exception as e:
             logger.debug(f"No avatar decoration or failed to load: {e}")
         
-        # Determine if we need GIF
-        is_gif = is_animated_avatar or len(decoration_frames) > 1
-        
-        # Calculate number of frames (use max of avatar and decoration frames)
-        num_frames = max(len(avatar_frames), len(decoration_frames), 1)
-        
-        # 3. Load fonts once (outside frame loop for efficiency)
-        def load_font(name, size):
-            cog_dir = os.path.dirname(os.path.abspath(__file__))
-            bot_root = os.path.dirname(os.path.dirname(cog_dir))
-            bundled_fonts_dir = os.path.join(bot_root, "fonts")
-            
-            font_paths = [
-                os.path.join(bundled_fonts_dir, name),
-                f"C:/Windows/Fonts/{name}",
-                f"C:\\Windows\\Fonts\\{name}",
-                f"/usr/share/fonts/truetype/dejavu/{name}",
-                f"/usr/share/fonts/truetype/liberation/{name}",
-                f"/usr/share/fonts/truetype/{name}",
-                f"/usr/share/fonts/{name}",
-                f"/usr/local/share/fonts/{name}",
-                name,
-            ]
-            
-            for path in font_paths:
-                try:
-                    return ImageFont.truetype(path, size)
-                except:
-                    continue
-            
-            logger.warning(f"Failed to load font '{name}' at size {size}, using default font.")
-            return ImageFont.load_default()
-
-        font_large = load_font("Richocet Bold.ttf", 60)
-        font_med = load_font("Richocet Bold.ttf", 45)
-        font_name = load_font("Richocet Bold.ttf", 40)
-        font_date = load_font("Richocet Bold.ttf", 28)
-        font_quote = load_font("Richocet Bold.ttf", 120)
-        
         # Prepare text content
         content = message.content
         if not content and message.attachments:
             content = "[Image Attachment]"
         
-        # 4. Generate frames
-        output_frames = []
-        frame_duration = 100  # milliseconds per frame
-        
-        for frame_idx in range(num_frames):
-            # Get current frame for avatar and decoration (loop if needed)
-            avatar_frame = avatar_frames[frame_idx % len(avatar_frames)]
-            decoration_frame = decoration_frames[frame_idx % len(decoration_frames)] if decoration_frames else None
-            
-            # Create Background
-            if banner_img:
-                bg_img = ImageOps.fit(banner_img.copy(), (WIDTH, HEIGHT), centering=(0.5, 0.5))
-            else:
-                bg_img = ImageOps.fit(avatar_frame.copy(), (WIDTH, HEIGHT), centering=(0.5, 0.5))
-                from PIL import ImageFilter
-                bg_img = bg_img.filter(ImageFilter.GaussianBlur(radius=20))
-            
-            # Gradient overlay
-            overlay = Image.new('RGBA', (WIDTH, HEIGHT), (0, 0, 0, 0))
-            draw_overlay = ImageDraw.Draw(overlay)
-            for y in range(HEIGHT):
-                alpha = int(150 + (80 * (y / HEIGHT)))
-                draw_overlay.line([(0, y), (WIDTH, y)], fill=(0, 0, 0, alpha))
-            
-            bg_img = Image.alpha_composite(bg_img, overlay)
-            draw = ImageDraw.Draw(bg_img)
-            
-            # Circular Avatar
-            avatar_size = 220
-            avatar_circle = avatar_frame.copy().resize((avatar_size, avatar_size))
-            
-            mask = Image.new("L", (avatar_size, avatar_size), 0)
-            draw_mask = ImageDraw.Draw(mask)
-            draw_mask.ellipse((0, 0, avatar_size, avatar_size), fill=255)
-            
-            output_avatar = ImageOps.fit(avatar_circle, (avatar_size, avatar_size), centering=(0.5, 0.5))
-            output_avatar.putalpha(mask)
-            
-            # Border ring
-            ring_size = avatar_size + 8
-            ring = Image.new("RGBA", (ring_size, ring_size), (0, 0, 0, 0))
-            draw_ring = ImageDraw.Draw(ring)
-            draw_ring.ellipse((0, 0, ring_size, ring_size), outline=(255, 255, 255, 50), width=4)
-            
-            avatar_x = 100
-            avatar_y = (HEIGHT - avatar_size) // 2
-            ring_x = avatar_x - (ring_size - avatar_size) // 2
-            ring_y = avatar_y - (ring_size - avatar_size) // 2
-            
-            bg_img.paste(ring, (ring_x, ring_y), ring)
-            bg_img.paste(output_avatar, (avatar_x, avatar_y), output_avatar)
-            
-            # Overlay decoration
-            if decoration_frame:
-                try:
-                    decoration_resized = decoration_frame.resize((avatar_size, avatar_size))
-                    bg_img.paste(decoration_resized, (avatar_x, avatar_y), decoration_resized)
-                except Exception as e:
-                    logger.warning(f"Failed to apply decoration frame {frame_idx}: {e}")
-            
-            # Draw Text
-            text_x = 380
-            max_width = 750
-            
-            lines = []
-            words = content.split()
-            current_line = []
-            
-            if len(content) > 150:
-                active_font = font_med
-                line_height = 50
-            else:
-                active_font = font_large
-                line_height = 70
-            
-            for word in words:
-                test_line = ' '.join(current_line + [word])
-                bbox = draw.textbbox((0, 0), test_line, font=active_font)
-                if bbox[2] - bbox[0] <= max_width:
-                    current_line.append(word)
-                else:
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-            lines.append(' '.join(current_line))
-            
-            text_block_height = len(lines) * line_height
-            total_height = text_block_height + 80
-            start_y = (HEIGHT - total_height) // 2
-            
-            # Quote mark
-            draw.text((text_x - 50, start_y - 60), '"', font=font_quote, fill=(255, 255, 255, 40))
-            
-            # Content
-            current_y = start_y
-            for line in lines[:7]:
-                draw.text((text_x + 3, current_y + 3), line, font=active_font, fill=(0, 0, 0, 180))
-                draw.text((text_x, current_y), line, font=active_font, fill=TEXT_COLOR)
-                current_y += line_height
-            
-            # Separator
-            current_y += 15
-            draw.line([(text_x, current_y), (text_x + 300, current_y)], fill=(255, 255, 255, 100), width=2)
-            current_y += 20
-            
-            # Name
-            name_text = f"{message.author.display_name}"
-            draw.text((text_x + 2, current_y + 2), name_text, font=font_name, fill=(0, 0, 0, 180))
-            draw.text((text_x, current_y), name_text, font=font_name, fill=NAME_COLOR)
-            
-            # Handle and date
-            handle = f"@{message.author.name}"
-            date_str = message.created_at.strftime("%b %d, %Y")
-            meta_text = f"{handle} • {date_str}"
-            draw.text((text_x, current_y + 40), meta_text, font=font_date, fill=DATE_COLOR)
-            
-            output_frames.append(bg_img)
-        
-        
-        # 5. Save as GIF or PNG (optimized)
-        output_buffer = io.BytesIO()
-        if is_gif and len(output_frames) > 1:
-            # Convert frames to P mode (palette) to reduce memory
-            optimized_frames = []
-            for frame in output_frames:
-                # Convert to palette mode with adaptive palette
-                frame_p = frame.convert('P', palette=Image.ADAPTIVE, colors=256)
-                optimized_frames.append(frame_p)
-            
-            # Save optimized GIF
-            optimized_frames[0].save(
-                output_buffer,
-                format='GIF',
-                save_all=True,
-                append_images=optimized_frames[1:],
-                duration=100,  # 100ms per frame
-                loop=0,
-                optimize=True,  # Enable optimization
-                disposal=2  # Clear frame before next
-            )
-            logger.info(f"Created optimized animated GIF with {len(optimized_frames)} frames")
-        else:
-            output_frames[0].save(output_buffer, format='PNG', optimize=True)
-        
-        output_buffer.seek(0)
-        return output_buffer, is_gif 
+        # 4. Render in the process pool
+        request = {
+            'avatar': avatar_bytes,
+            'avatar_key': avatar_key,
+            'banner': banner_bytes,
+            'banner_key': banner_key,
+            'decoration': decoration_bytes,
+            'decoration_key': decoration_key,
+            'content': content,
+            'display_name': message.author.display_name,
+            'handle': f"@{message.author.name}",
+            'date_str': message.created_at.strftime("%b %d, %Y"),
+            'max_frames': budget.max_frames,
+            'animated_decoration': budget.animated_decorations,
+        }
+        image_bytes, extension = await get_render_service().render(render_quote, request)
+        # Don't pin an image that's missing assets which failed to download
+        if (banner_bytes or not banner) and (decoration_bytes or not decoration):
+            self.result_cache.put(cache_key + (budget.level,), (image_bytes, extension))
+            metrics.set_gauge('quote.result_cache.bytes', self.result_cache.nbytes)
+        
+        return io.BytesIO(image_bytes), extension
 
 async def setup(bot):
     await bot.add_cog(Quote(bot))
@@ -0,0 +1,235 @@
+"""
+Quote image rendering.
+Runs inside the render pool, so everything here works on plain data (bytes and strings) only.
+"""
+import io
+import logging
+import os
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFilter, ImageOps
+
+from ..utils.animation import compose, encode_animation
+from ..utils.fonts import get_font
+from ..utils.lru import ByteLRU
+from ..utils.text_layout import fit_text
+
+logger = logging.getLogger('DiscordBot.Quote')
+
+# Configuration
+WIDTH = 1200
+HEIGHT = 500
+TEXT_COLOR = (255, 255, 255)
+NAME_COLOR = (220, 220, 220)
+DATE_COLOR = (180, 180, 180)
+MAX_FRAMES = int(os.getenv('QUOTE_MAX_FRAMES', '30'))  # Upper bound on frames, the render budget may pick fewer
+QUOTE_FONT = "Richocet Bold.ttf"
+AVATAR_SIZE = 220
+TEXT_BOX_WIDTH = 750
+TEXT_BOX_HEIGHT = 300  # Leaves room for the quote mark, name and date
+MIN_TEXT_SIZE = 24
+MAX_TEXT_SIZE = 60
+FRAME_CACHE_BYTES = int(os.getenv('QUOTE_FRAME_CACHE_MB', '64')) * 1024 * 1024  # Decoded assets per render worker
+
+
+def _frames_nbytes(frames):
+    return sum(frame.width * frame.height * len(frame.getbands()) for frame in frames)
+
+
+# Decoded asset frames kept by this render worker, keyed by asset cache key
+_frame_cache = ByteLRU(FRAME_CACHE_BYTES, sizeof=_frames_nbytes)
+
+
+def _decoded(key, data: bytes, decode):
+    """Decode asset bytes, reusing frames this worker already decoded for the same key"""
+    if key is None:
+        return decode(data)
+    frames = _frame_cache.get(key)
+    if frames is None:
+        frames = decode(data)
+        _frame_cache.put(key, frames)
+    return frames
+
+
+def _decode_animated(data: bytes):
+    """Frames of an avatar or decoration as RGBA images (limit frames to bound memory)"""
+    img = Image.open(io.BytesIO(data))
+    if not getattr(img, 'is_animated', False):
+        return [img.convert("RGBA")]
+
+    frames = []
+    try:
+        for frame_idx in range(min(img.n_frames, MAX_FRAMES)):
+            img.seek(frame_idx)
+            frames.append(img.convert("RGBA").copy())
+    except Exception:
+        frames = [img.convert("RGBA")]
+    return frames
+
+
+def _decode_first_frame(data: bytes):
+    img = Image.open(io.BytesIO(data))
+    img.seek(0)
+    return [img.convert("RGBA")]
+
+
+@lru_cache(maxsize=None)
+def _gradient_overlay():
+    """Top-to-bottom darkening overlay, built once per process"""
+    column = Image.new('L', (1, HEIGHT))
+    column.putdata([int(150 + (80 * (y / HEIGHT))) for y in range(HEIGHT)])
+    overlay = Image.new('RGBA', (WIDTH, HEIGHT), (0, 0, 0, 0))
+    overlay.putalpha(column.resize((WIDTH, HEIGHT), Image.NEAREST))
+    return overlay
+
+
+@lru_cache(maxsize=None)
+def _avatar_mask(size):
+    """Circular alpha mask for the avatar"""
+    mask = Image.new("L", (size, size), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, size, size), fill=255)
+    return mask
+
+
+@lru_cache(maxsize=None)
+def _avatar_ring(size):
+    """Faint border ring drawn around the avatar"""
+    ring_size = size + 8
+    ring = Image.new("RGBA", (ring_size, ring_size), (0, 0, 0, 0))
+    ImageDraw.Draw(ring).ellipse((0, 0, ring_size, ring_size), outline=(255, 255, 255, 50), width=4)
+    return ring
+
+
+def _render_base(request: dict, background, blur: bool):
+    """Render the static part of a quote: background, overlay, avatar ring and text"""
+    bg_img = ImageOps.fit(background, (WIDTH, HEIGHT), centering=(0.5, 0.5))
+    if blur:
+        bg_img = bg_img.filter(ImageFilter.GaussianBlur(radius=20))
+
+    bg_img = Image.alpha_composite(bg_img, _gradient_overlay())
+    draw = ImageDraw.Draw(bg_img)
+
+    # Border ring
+    ring = _avatar_ring(AVATAR_SIZE)
+    ring_x = 100 - (ring.width - AVATAR_SIZE) // 2
+    ring_y = (HEIGHT - AVATAR_SIZE) // 2 - (ring.height - AVATAR_SIZE) // 2
+    bg_img.paste(ring, (ring_x, ring_y), ring)
+
+    font_name = get_font(QUOTE_FONT, 40)
+    font_date = get_font(QUOTE_FONT, 28)
+    font_quote = get_font(QUOTE_FONT, 120)
+
+    # Draw Text (largest size that fits the text box)
+    text_x = 380
+    active_font, lines, line_height = fit_text(
+        request['content'], QUOTE_FONT, TEXT_BOX_WIDTH, TEXT_BOX_HEIGHT,
+        min_size=MIN_TEXT_SIZE, max_size=MAX_TEXT_SIZE,
+    )
+
+    text_block_height = len(lines) * line_height
+    total_height = text_block_height + 80
+    start_y = (HEIGHT - total_height) // 2
+
+    # Quote mark
+    draw.text((text_x - 50, start_y - 60), '"', font=font_quote, fill=(255, 255, 255, 40))
+
+    # Content
+    current_y = start_y
+    for line in lines:
+        draw.text((text_x + 3, current_y + 3), line, font=active_font, fill=(0, 0, 0, 180))
+        draw.text((text_x, current_y), line, font=active_font, fill=TEXT_COLOR)
+        current_y += line_height
+
+    # Separator
+    current_y += 15
+    draw.line([(text_x, current_y), (text_x + 300, current_y)], fill=(255, 255, 255, 100), width=2)
+    current_y += 20
+
+    # Name
+    name_text = request['display_name']
+    draw.text((text_x + 2, current_y + 2), name_text, font=font_name, fill=(0, 0, 0, 180))
+    draw.text((text_x, current_y), name_text, font=font_name, fill=NAME_COLOR)
+
+    # Handle and date
+    meta_text = f"{request['handle']} • {request['date_str']}"
+    draw.text((text_x, current_y + 40), meta_text, font=font_date, fill=DATE_COLOR)
+
+    return bg_img
+
+
+def render_quote(request: dict):
+    """
+    Render a quote image.
+
+    request keys: avatar (bytes), banner (bytes or None), decoration (bytes or None),
+    content, display_name, handle, date_str, and optional avatar_key / banner_key /
+    decoration_key asset cache keys that let this worker reuse decoded images,
+    max_frames and animated_decoration from the render budget
+
+    Returns: (image bytes, file extension) tuple
+    """
+    avatar_frames = _decoded(request.get('avatar_key'), request['avatar'], _decode_animated)
+
+    banner_img = None
+    if request.get('banner'):
+        try:
+            banner_img = _decoded(request.get('banner_key'), request['banner'], _decode_first_frame)[0]
+        except Exception as e:
+            logger.warning(f"Failed to decode banner: {e}")
+
+    # Decorations are only animated when the render budget allows it
+    decoration_frames = []
+    if request.get('decoration'):
+        animated = request.get('animated_decoration', False)
+        key = request.get('decoration_key')
+        try:
+            decoration_frames = _decoded(
+                key and f"{key}:{'animated' if animated else 'static'}", request['decoration'],
+                _decode_animated if animated else _decode_first_frame
+            )
+        except Exception as e:
+            logger.debug(f"Failed to decode avatar decoration: {e}")
+
+    # Calculate number of frames (use max of avatar and decoration frames, within the budget)
+    max_frames = min(request.get('max_frames', MAX_FRAMES), MAX_FRAMES)
+    avatar_frames = avatar_frames[:max_frames]
+    decoration_frames = decoration_frames[:max_frames]
+    num_frames = max(len(avatar_frames), len(decoration_frames), 1)
+
+    # Everything except the avatar is identical across frames, so render it once
+    base = _render_base(request, banner_img or avatar_frames[0], blur=banner_img is None)
+
+    avatar_x = 100
+    avatar_y = (HEIGHT - AVATAR_SIZE) // 2
+    avatar_box = (avatar_x, avatar_y, avatar_x + AVATAR_SIZE, avatar_y + AVATAR_SIZE)
+    mask = _avatar_mask(AVATAR_SIZE)
+    decorations = [frame.resize((AVATAR_SIZE, AVATAR_SIZE)) for frame in decoration_frames]
+
+    # Each frame only differs in the avatar area, so frames are kept as avatar-sized patches
+    patches = []
+
+    for frame_idx in range(num_frames):
+        # Get current frame for avatar and decoration (loop if needed)
+        avatar_frame = avatar_frames[frame_idx % len(avatar_frames)]
+        decoration = decorations[frame_idx % len(decorations)] if decorations else None
+
+        output_avatar = avatar_frame.resize((AVATAR_SIZE, AVATAR_SIZE))
+        output_avatar.putalpha(mask)
+
+        patch = base.crop(avatar_box)
+        patch.paste(output_avatar, (0, 0), output_avatar)
+
+        # Overlay decoration
+        if decoration:
+            try:
+                patch.paste(decoration, (0, 0), decoration)
+            except Exception as e:
+                logger.warning(f"Failed to apply decoration frame {frame_idx}: {e}")
+
+        patches.append(patch)
+
+    if len(patches) > 1:
+        return encode_animation(base, patches, (avatar_x, avatar_y))
+
+    output_buffer = io.BytesIO()
+    compose(base, patches[0], (avatar_x, avatar_y)).save(output_buffer, format='PNG', optimize=True)
+    return output_buffer.getvalue(), 'png'
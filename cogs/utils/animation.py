@@ -0,0 +1,106 @@
+"""
+Animated image encoding for the image renderers.
+Animations are described as a static base image plus per-frame patches for the one region that
+changes (e.g. the avatar), so frames are quantized and held in memory at patch size, not full size.
+"""
+import io
+import logging
+import os
+from PIL import Image, features
+
+logger = logging.getLogger('DiscordBot.Animation')
+
+# gif (default) or webp; webp falls back to gif if Pillow was built without WebP
+ANIMATION_FORMAT = os.getenv('ANIMATION_FORMAT', 'gif').lower()
+WEBP_QUALITY = int(os.getenv('WEBP_QUALITY', '80'))
+PALETTE_SAMPLE_WIDTH = 400  # The base is downscaled to this width before building the palette
+
+
+def animation_format() -> str:
+    """File extension animations will be encoded as"""
+    if ANIMATION_FORMAT == 'webp' and features.check('webp'):
+        return 'webp'
+    return 'gif'
+
+
+def compose(base, patch, offset):
+    """Full frame: the base with a patch pasted at offset"""
+    frame = base.copy()
+    frame.paste(patch, offset)
+    return frame
+
+
+def _global_palette(base, patches):
+    """One 256 colour palette covering the base and every patch, so frames don't flicker"""
+    scale = min(1.0, PALETTE_SAMPLE_WIDTH / base.width)
+    sample = base.convert('RGB').resize((max(1, int(base.width * scale)), max(1, int(base.height * scale))))
+    patch_width = max(patch.width for patch in patches)
+    montage = Image.new('RGB', (max(sample.width, patch_width), sample.height + sum(p.height for p in patches)))
+    montage.paste(sample, (0, 0))
+    y = sample.height
+    for patch in patches:
+        montage.paste(patch.convert('RGB'), (0, y))
+        y += patch.height
+    return montage.quantize(256, method=Image.Quantize.MEDIANCUT)
+
+
+def encode_gif(base, patches, offset, duration=100) -> bytes:
+    """Encode base + patches as a looping GIF with a shared palette"""
+    palette = _global_palette(base, patches)
+    base_p = base.convert('RGB').quantize(palette=palette)
+
+    frames = []
+    for patch in patches:
+        frame = base_p.copy()
+        frame.paste(patch.convert('RGB').quantize(palette=palette), offset)
+        frames.append(frame)
+
+    # Keep frames on screen (disposal 1) so Pillow only writes the region that changed between frames.
+    # optimize=False: the palette is already shared, and Pillow's per-frame transparency pass is slow
+    output = io.BytesIO()
+    frames[0].save(
+        output,
+        format='GIF',
+        save_all=True,
+        append_images=frames[1:],
+        duration=duration,
+        loop=0,
+        disposal=1,
+        optimize=False,
+    )
+    return output.getvalue()
+
+
+def encode_webp(base, patches, offset, duration=100) -> bytes:
+    """Encode base + patches as a looping animated WebP (libwebp crops unchanged areas itself)"""
+    frames = [compose(base, patch, offset) for patch in patches]
+    output = io.BytesIO()
+    frames[0].save(
+        output,
+        format='WEBP',
+        save_all=True,
+        append_images=frames[1:],
+        duration=duration,
+        loop=0,
+        quality=WEBP_QUALITY,
+        method=4,
+    )
+    return output.getvalue()
+
+
+def encode_animation(base, patches, offset, duration=100):
+    """
+    Encode an animation in the configured format.
+
+    base: full-size RGBA image with everything that doesn't change
+    patches: one image per frame, pasted onto the base at offset
+
+    Returns: (bytes, extension) tuple
+    """
+    fmt = animation_format()
+    if fmt == 'webp':
+        try:
+            return encode_webp(base, patches, offset, duration), 'webp'
+        except Exception as e:
+            logger.warning(f"WebP encoding failed, falling back to GIF: {e}")
+    return encode_gif(base, patches, offset, duration), 'gif'
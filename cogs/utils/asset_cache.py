@@ -0,0 +1,93 @@
+"""
+Discord CDN asset cache (avatars, banners, decorations).
+Raw bytes are kept in a memory LRU backed by a disk LRU under data/cache, keyed by asset hash and
+size, so popular users are only downloaded once. Concurrent requests for the same asset share one download.
+"""
+import asyncio
+import logging
+import os
+
+from . import metrics
+from .lru import ByteLRU, DiskLRU
+
+logger = logging.getLogger('DiscordBot.AssetCache')
+
+ASSET_CACHE_DIR = "data/cache/assets"
+ASSET_MEMORY_BYTES = int(os.getenv('ASSET_MEMORY_MB', '32')) * 1024 * 1024
+ASSET_DISK_BYTES = int(os.getenv('ASSET_DISK_MB', '256')) * 1024 * 1024
+
+
+class AssetCache:
+    """Two-tier byte cache with single-flight downloads"""
+
+    def __init__(self, directory: str = ASSET_CACHE_DIR, memory_bytes: int = ASSET_MEMORY_BYTES,
+                 disk_bytes: int = ASSET_DISK_BYTES):
+        self.memory = ByteLRU(memory_bytes)
+        self.disk = DiskLRU(directory, disk_bytes)
+        self._inflight = {}  # key -> Future of bytes
+
+    async def get(self, key: str, fetch):
+        """Get the bytes for key, calling the fetch() coroutine only if no tier has them"""
+        data = self.memory.get(key)
+        if data is not None:
+            metrics.increment('assets.hit')
+            return data
+
+        future = self._inflight.get(key)
+        if future is not None:
+            metrics.increment('assets.hit')
+            metrics.increment('assets.coalesced')
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await self._load(key, fetch)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load(self, key: str, fetch):
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.disk.get, key)
+        if data is not None:
+            metrics.increment('assets.hit')
+            metrics.increment('assets.disk_hit')
+        else:
+            metrics.increment('assets.miss')
+            data = await fetch()
+            await loop.run_in_executor(None, self.disk.put, key, data)
+
+        self.memory.put(key, data)
+        metrics.set_gauge('assets.memory_bytes', self.memory.nbytes)
+        metrics.set_gauge('assets.disk_bytes', self.disk.nbytes)
+        return data
+
+
+_cache = None
+
+
+def get_asset_cache() -> AssetCache:
+    """Get the shared asset cache"""
+    global _cache
+    if _cache is None:
+        _cache = AssetCache()
+    return _cache
+
+
+def asset_key(asset, size: int = None) -> str:
+    """Cache key for a discord.Asset at a given size"""
+    return f"{asset.key}:{size or 'full'}"
+
+
+async def read_asset(asset, size: int = None):
+    """Read a discord.Asset through the cache. Returns (key, bytes)"""
+    if size:
+        asset = asset.with_size(size)
+    key = asset_key(asset, size)
+    return key, await get_asset_cache().get(key, asset.read)
@@ -0,0 +1,92 @@
+"""
+Font registry shared by the image renderers.
+Font files are looked up once per process from the bundled fonts/ folder and the usual system
+folders, and loaded fonts are kept in an LRU keyed by (name, size).
+"""
+import logging
+import os
+from functools import lru_cache
+from PIL import ImageFont
+
+logger = logging.getLogger('DiscordBot.Fonts')
+
+BOT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FONTS_DIR = os.path.join(BOT_ROOT, "fonts")
+
+# Tried in order when a requested font isn't installed (comma separated file names or paths)
+FONT_FALLBACKS = [name.strip() for name in os.getenv(
+    'FONT_FALLBACKS', 'DejaVuSans-Bold.ttf,LiberationSans-Bold.ttf,arialbd.ttf,arial.ttf'
+).split(',') if name.strip()]
+FONT_CACHE_SIZE = int(os.getenv('FONT_CACHE_SIZE', '64'))  # Loaded (name, size) fonts kept in memory
+
+FONT_DIRS = [
+    FONTS_DIR,
+    "C:/Windows/Fonts",
+    "/usr/share/fonts/truetype/dejavu",
+    "/usr/share/fonts/truetype/liberation",
+    "/usr/share/fonts/truetype",
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+]
+
+_index = None  # lowercase file name -> path
+
+
+def _build_index() -> dict:
+    """Map every font file in FONT_DIRS to its path, earlier folders winning"""
+    index = {}
+    for directory in FONT_DIRS:
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(('.ttf', '.otf', '.ttc')):
+                    index.setdefault(entry.name.lower(), entry.path)
+    logger.debug(f"Indexed {len(index)} font file(s)")
+    return index
+
+
+def find_font(name: str):
+    """Get the path of a font file by name or path, or None if it isn't installed"""
+    global _index
+    if os.path.isfile(name):
+        return name
+    if _index is None:
+        _index = _build_index()
+    return _index.get(os.path.basename(name).lower())
+
+
+@lru_cache(maxsize=None)
+def resolve_font(name: str):
+    """Get the path to load for a font, falling back to FONT_FALLBACKS (None = Pillow default)"""
+    path = find_font(name)
+    if path:
+        return path
+
+    for fallback in FONT_FALLBACKS:
+        path = find_font(fallback)
+        if path:
+            logger.warning(f"Font '{name}' not found, using '{os.path.basename(path)}'")
+            return path
+
+    logger.warning(f"Font '{name}' not found and no fallback installed, using default font")
+    return None
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(name: str, size: int):
+    """Get a loaded font, shared by every render in this process"""
+    path = resolve_font(name)
+    if path:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError as e:
+            logger.warning(f"Failed to load font '{path}': {e}")
+
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
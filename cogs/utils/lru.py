@@ -0,0 +1,168 @@
+"""
+Byte-budgeted LRU caches.
+ByteLRU keeps values in memory, DiskLRU keeps raw bytes (or whole files) as files in a cache folder.
+DiskLRU methods do blocking file I/O, so call them from an executor; they are thread-safe.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('DiscordBot.Cache')
+
+
+class ByteLRU:
+    """In-memory LRU that evicts least recently used entries once max_bytes is exceeded"""
+
+    def __init__(self, max_bytes: int, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value) -> None:
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return  # Would evict everything else and still not fit
+        self.pop(key)
+        self._entries[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.nbytes -= evicted
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.nbytes -= entry[1]
+        return entry[0]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.nbytes = 0
+
+
+class DiskLRU:
+    """LRU of byte blobs stored as files, evicting by modification time once max_bytes is exceeded"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._files = None  # file name -> size, oldest first
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        if self._files is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.bin'):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        found.sort()
+        self._files = OrderedDict((name, size) for _, name, size in found)
+        self.nbytes = sum(self._files.values())
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()[:40] + '.bin'
+
+    def get(self, key: str):
+        """Read a cached blob, or None"""
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str):
+        self._load()
+        name = self._name(key)
+        if name not in self._files:
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.nbytes -= self._files.pop(name)
+            return None
+        self._files.move_to_end(name)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store a blob, evicting the oldest files if over budget"""
+        with self._lock:
+            self._put(key, data)
+
+    def _put(self, key: str, data: bytes) -> None:
+        self._load()
+        if len(data) > self.max_bytes:
+            return
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache file {name}: {e}")
+            return
+
+        self._add(name, len(data))
+
+    def path(self, key: str):
+        """Path of the cached file for key, marking it recently used, or None"""
+        with self._lock:
+            self._load()
+            name = self._name(key)
+            if name not in self._files:
+                return None
+            path = os.path.join(self.directory, name)
+            try:
+                os.utime(path)
+            except OSError:
+                self.nbytes -= self._files.pop(name)
+                return None
+            self._files.move_to_end(name)
+            return path
+
+    def put_file(self, key: str, source: str) -> None:
+        """Move a finished file (on the same filesystem) into the cache, for blobs too big to hold in memory"""
+        with self._lock:
+            self._load()
+            size = os.path.getsize(source)
+            if size > self.max_bytes:
+                os.remove(source)
+                return
+            name = self._name(key)
+            os.replace(source, os.path.join(self.directory, name))
+            self._add(name, size)
+
+    def _add(self, name: str, size: int) -> None:
+        self.nbytes -= self._files.pop(name, 0)
+        self._files[name] = size
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and self._files:
+            old_name, size = self._files.popitem(last=False)
+            self.nbytes -= size
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
@@ -0,0 +1,77 @@
+"""
+Reply resolution helpers.
+Resolves the message a reply points at without a REST call whenever possible.
+"""
+from collections import OrderedDict
+import discord
+
+from . import metrics
+
+MAX_TRACKED_BOT_MESSAGES = 5000  # Recent message IDs sent by the bot
+
+_bot_message_ids = OrderedDict()
+
+
+def remember_bot_message(message_id: int) -> None:
+    """Remember that the bot sent a message"""
+    _bot_message_ids[message_id] = None
+    _bot_message_ids.move_to_end(message_id)
+    if len(_bot_message_ids) > MAX_TRACKED_BOT_MESSAGES:
+        _bot_message_ids.popitem(last=False)
+
+
+def is_bot_message_id(message_id: int) -> bool:
+    """Check if a message ID is one the bot recently sent"""
+    return message_id in _bot_message_ids
+
+
+def get_cached_reference(client: discord.Client, message: discord.Message):
+    """
+    Get the referenced message from the gateway payload or the client message cache.
+    Returns None if it is not available locally.
+    """
+    reference = message.reference
+    if not reference or not reference.message_id:
+        return None
+
+    resolved = reference.resolved
+    if isinstance(resolved, discord.Message):
+        return resolved
+
+    return discord.utils.get(client.cached_messages, id=reference.message_id)
+
+
+async def resolve_reference(client: discord.Client, message: discord.Message):
+    """Get the message a reply points at, fetching it over REST only as a last resort"""
+    reference = message.reference
+    if not reference or not reference.message_id:
+        return None
+
+    # Referenced message was deleted, fetching would 404
+    if isinstance(reference.resolved, discord.DeletedReferencedMessage):
+        return None
+
+    cached = get_cached_reference(client, message)
+    if cached:
+        metrics.increment('replies.rest_avoided')
+        return cached
+
+    metrics.increment('replies.rest_fetch')
+    try:
+        return await message.channel.fetch_message(reference.message_id)
+    except discord.HTTPException:
+        return None
+
+
+async def is_reply_to(client: discord.Client, message: discord.Message) -> bool:
+    """Check if a message is a reply to one of the bot's own messages"""
+    reference = message.reference
+    if not reference or not reference.message_id:
+        return False
+
+    if is_bot_message_id(reference.message_id):
+        metrics.increment('replies.rest_avoided')
+        return True
+
+    referenced = await resolve_reference(client, message)
+    return referenced is not None and referenced.author.id == client.user.id
@@ -0,0 +1,81 @@
+"""
+In-process counters, gauges and timing samples shared by all cogs.
+Values live in memory only and are shown with /admin metrics.
+"""
+import threading
+from collections import defaultdict, deque
+
+SAMPLE_WINDOW = 1000  # Keep the last N samples per timing metric
+
+# Metrics are updated from voice/executor threads as well as the event loop
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """Increase a counter"""
+    with _lock:
+        _counters[name] += amount
+
+
+def set_gauge(name: str, value) -> None:
+    """Set a gauge to its current value"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Record a timing (or size) sample"""
+    with _lock:
+        _samples[name].append(value)
+
+
+def get_counter(name: str) -> int:
+    """Get the current value of a counter"""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def hit_rate(prefix: str) -> float:
+    """Hit rate for a '<prefix>.hit' / '<prefix>.miss' counter pair, or None if unused"""
+    with _lock:
+        hits = _counters.get(f"{prefix}.hit", 0)
+        misses = _counters.get(f"{prefix}.miss", 0)
+    total = hits + misses
+    return hits / total if total else None
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(values) -> dict:
+    """Count and p50/p95/p99 of a list of samples"""
+    values = list(values)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+def snapshot() -> dict:
+    """Copy of all metrics, with timing samples summarized"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        samples = {name: list(values) for name, values in _samples.items()}
+
+    return {
+        'counters': counters,
+        'gauges': gauges,
+        'timings': {name: summarize(values) for name, values in samples.items()},
+    }
@@ -0,0 +1,115 @@
+"""
+Shared render service.
+Runs CPU-heavy Pillow work in a bounded process pool so image commands never block the event loop.
+Render functions must be top-level functions that take and return plain data (bytes, str, dict...).
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import metrics
+
+logger = logging.getLogger('DiscordBot.Render')
+
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', str(min(2, os.cpu_count() or 1))))  # 0 = render in a thread
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', '8'))  # Renders allowed to wait for a worker
+RENDER_TIMEOUT = float(os.getenv('RENDER_TIMEOUT', '30'))  # Seconds before a render is abandoned
+
+
+class RenderQueueFull(Exception):
+    """Raised when too many renders are already waiting"""
+
+
+class RenderService:
+    """Bounded process pool with a wait queue and per-render timeouts"""
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_size: int = RENDER_QUEUE_SIZE,
+                 timeout: float = RENDER_TIMEOUT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = None
+        self._slots = asyncio.Semaphore(max(1, workers))
+        self._pending = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Renders running or waiting for a worker"""
+        return self._pending
+
+    def _get_executor(self):
+        if self._executor is None and self.workers > 0:
+            # Spawned workers don't inherit the bot's threads or sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f"Started render pool with {self.workers} worker(s)")
+        return self._executor
+
+    def _recycle(self) -> None:
+        """Throw away the pool, killing workers stuck on an abandoned render"""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # ProcessPoolExecutor can't cancel running work, so stop the processes directly
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        metrics.increment('render.pool_recycled')
+
+    async def render(self, func, *args, timeout: float = None):
+        """Run func(*args) in a worker and return its result"""
+        if self._pending >= max(1, self.workers) + self.queue_size:
+            metrics.increment('render.rejected')
+            raise RenderQueueFull("Too many images are being rendered right now")
+
+        self._pending += 1
+        metrics.set_gauge('render.in_flight', self._pending)
+        queued_at = time.perf_counter()
+        try:
+            async with self._slots:
+                started_at = time.perf_counter()
+                metrics.observe('render.queue_ms', (started_at - queued_at) * 1000)
+
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._get_executor(), func, *args)
+                try:
+                    result = await asyncio.wait_for(future, timeout or self.timeout)
+                except asyncio.TimeoutError:
+                    metrics.increment('render.timeout')
+                    logger.warning(f"Render {func.__name__} timed out, recycling render pool")
+                    self._recycle()
+                    raise
+                except BrokenProcessPool:
+                    metrics.increment('render.pool_broken')
+                    self._executor = None
+                    raise
+
+                metrics.observe('render.run_ms', (time.perf_counter() - started_at) * 1000)
+                metrics.increment('render.completed')
+                return result
+        finally:
+            self._pending -= 1
+            metrics.set_gauge('render.in_flight', self._pending)
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_service = None
+
+
+def get_render_service() -> RenderService:
+    """Get the shared render service"""
+    global _service
+    if _service is None:
+        _service = RenderService()
+    return _service
@@ -0,0 +1,100 @@
+"""
+Render budget controller.
+Picks image quality (frame count, asset resolution, animated decorations) from current memory use
+and render load, so image commands degrade gracefully on a small VM instead of running out of memory.
+"""
+import logging
+import os
+from dataclasses import dataclass
+
+from . import metrics
+from .render import get_render_service
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+logger = logging.getLogger('DiscordBot.RenderBudget')
+
+MEMORY_LIMIT_MB = int(os.getenv('MEMORY_LIMIT_MB', '1024'))  # Machine memory (fly.io VM size)
+# Share of MEMORY_LIMIT_MB in use at which quality steps down
+NORMAL_PRESSURE = float(os.getenv('RENDER_NORMAL_PRESSURE', '0.5'))
+REDUCED_PRESSURE = float(os.getenv('RENDER_REDUCED_PRESSURE', '0.7'))
+MINIMAL_PRESSURE = float(os.getenv('RENDER_MINIMAL_PRESSURE', '0.85'))
+
+
+@dataclass(frozen=True)
+class RenderBudget:
+    """Quality settings for one render"""
+    level: str
+    max_frames: int
+    avatar_size: int
+    banner_size: int
+    animated_decorations: bool
+
+
+BUDGETS = {
+    'full': RenderBudget('full', max_frames=30, avatar_size=256, banner_size=1024, animated_decorations=True),
+    'normal': RenderBudget('normal', max_frames=20, avatar_size=256, banner_size=512, animated_decorations=True),
+    'reduced': RenderBudget('reduced', max_frames=10, avatar_size=256, banner_size=512, animated_decorations=False),
+    'minimal': RenderBudget('minimal', max_frames=1, avatar_size=128, banner_size=256, animated_decorations=False),
+}
+
+
+def _read_proc_rss(pid='self'):
+    """RSS in bytes from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def current_rss_mb():
+    """Resident memory of the bot and its render workers in MB, or None if unknown"""
+    if PSUTIL_AVAILABLE:
+        try:
+            process = psutil.Process()
+            total = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return total / (1024 * 1024)
+        except psutil.Error:
+            pass
+
+    rss = _read_proc_rss()
+    return rss / (1024 * 1024) if rss is not None else None
+
+
+def choose_budget() -> RenderBudget:
+    """Pick the quality for a render that's about to start"""
+    service = get_render_service()
+    workers = max(1, service.workers)
+    in_flight = service.in_flight
+    rss_mb = current_rss_mb()
+    pressure = rss_mb / MEMORY_LIMIT_MB if rss_mb is not None else 0.0
+
+    if pressure >= MINIMAL_PRESSURE or in_flight >= workers + service.queue_size:
+        level = 'minimal'
+    elif pressure >= REDUCED_PRESSURE or in_flight >= workers:
+        level = 'reduced'
+    elif pressure >= NORMAL_PRESSURE or in_flight > 0:
+        level = 'normal'
+    else:
+        level = 'full'
+
+    metrics.increment(f'render.budget.{level}')
+    metrics.set_gauge('render.budget.level', level)
+    metrics.set_gauge('render.budget.in_flight', in_flight)
+    if rss_mb is not None:
+        metrics.set_gauge('render.budget.rss_mb', round(rss_mb))
+    logger.debug(f"Render budget {level} (rss={rss_mb and round(rss_mb)}MB, in_flight={in_flight})")
+    return BUDGETS[level]
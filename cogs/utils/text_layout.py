@@ -0,0 +1,112 @@
+"""
+Text layout for the image renderers.
+Word widths are measured once per (font, word) and lines are broken greedily in one pass,
+so wrapping costs O(words) instead of re-measuring the growing line for every word.
+"""
+import os
+from functools import lru_cache
+
+from .fonts import get_font
+
+WIDTH_CACHE_SIZE = int(os.getenv('TEXT_WIDTH_CACHE_SIZE', '20000'))  # Measured (font, word) pairs
+LINE_SPACING = 1.17  # Line height as a multiple of the font size
+ELLIPSIS = "…"
+
+
+@lru_cache(maxsize=WIDTH_CACHE_SIZE)
+def text_width(font, text: str) -> float:
+    """Advance width of text in font (fonts from get_font are shared, so this caches well)"""
+    return font.getlength(text)
+
+
+def _split_word(font, word: str, max_width: float):
+    """Break a word that is wider than max_width into pieces that fit"""
+    pieces = []
+    while word:
+        # Longest prefix that fits (at least one character so we always make progress)
+        lo, hi = 1, len(word)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if text_width(font, word[:mid]) <= max_width:
+                lo = mid
+            else:
+                hi = mid - 1
+        pieces.append(word[:lo])
+        word = word[lo:]
+    return pieces
+
+
+def wrap_text(text: str, font, max_width: float):
+    """Greedy line breaking. Returns a list of lines no wider than max_width"""
+    space = text_width(font, ' ')
+    lines = []
+    for paragraph in text.split('\n'):
+        current = []
+        current_width = 0.0
+        for word in paragraph.split():
+            width = text_width(font, word)
+            if width > max_width:
+                pieces = _split_word(font, word, max_width)
+                if current:
+                    lines.append(' '.join(current))
+                lines.extend(pieces[:-1])
+                current = [pieces[-1]]
+                current_width = text_width(font, pieces[-1])
+                continue
+
+            if current and current_width + space + width > max_width:
+                lines.append(' '.join(current))
+                current = [word]
+                current_width = width
+            else:
+                current_width += (space if current else 0) + width
+                current.append(word)
+        lines.append(' '.join(current))
+    return lines
+
+
+def _truncate(lines, font, max_lines: int, max_width: float):
+    """Cut lines down to max_lines, ending the last one with an ellipsis"""
+    if len(lines) <= max_lines:
+        return lines
+    last = lines[max_lines - 1]
+    while last and text_width(font, last + ELLIPSIS) > max_width:
+        last = last[:-1]
+    return lines[:max_lines - 1] + [last.rstrip() + ELLIPSIS]
+
+
+def fit_text(text: str, font_name: str, max_width: float, max_height: float,
+             min_size: int = 20, max_size: int = 60, max_lines: int = None):
+    """
+    Find the largest font size between min_size and max_size whose wrapped text fits the box.
+    If even min_size doesn't fit, the text is truncated with an ellipsis.
+
+    Returns: (font, lines, line_height)
+    """
+    def layout(size):
+        font = get_font(font_name, size)
+        line_height = int(size * LINE_SPACING)
+        lines = wrap_text(text, font, max_width)
+        fits = len(lines) * line_height <= max_height and (max_lines is None or len(lines) <= max_lines)
+        return fits, font, lines, line_height
+
+    # Wrapped height only grows with the size, so binary search for the largest that fits
+    best = None
+    lo, hi = min_size, max_size
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        fits, font, lines, line_height = layout(mid)
+        if fits:
+            best = (font, lines, line_height)
+            lo = mid + 1
+        else:
+            hi = mid - 1
+
+    if best:
+        return best
+
+    _, font, lines, line_height = layout(min_size)
+    limit = max(1, int(max_height // line_height))
+    if max_lines is not None:
+        limit = min(limit, max_lines)
+    return font, _truncate(lines, font, limit, max_width), line_height
@@ -0,0 +1,103 @@
+"""
+Shared deadline scheduler.
+Holds at most one cancellable deadline per key (e.g. per guild) in a heap served by a single
+asyncio task, instead of one sleeping coroutine per pending timeout.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+
+from . import metrics
+
+logger = logging.getLogger('DiscordBot.Timers')
+
+
+class TimerManager:
+    """One cancellable deadline per key. Callbacks are coroutine functions run as their own tasks"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._deadlines = {}  # key -> (when, seq, callback)
+        self._heap = []  # (when, seq, key), stale entries are skipped when popped
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, delay: float, callback) -> None:
+        """Run callback() after delay seconds, replacing any deadline already set for key"""
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        seq = next(self._seq)
+        self._deadlines[key] = (when, seq, callback)
+        heapq.heappush(self._heap, (when, seq, key))
+        self._update_gauge()
+
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    def cancel(self, key) -> bool:
+        """Drop the deadline for key. Returns whether there was one"""
+        if self._deadlines.pop(key, None) is None:
+            return False
+        self._update_gauge()
+        return True
+
+    def remaining(self, key):
+        """Seconds until key's deadline, or None if it has none"""
+        entry = self._deadlines.get(key)
+        if entry is None:
+            return None
+        return max(0.0, entry[0] - asyncio.get_running_loop().time())
+
+    def stop(self) -> None:
+        """Cancel every deadline and the scheduler task"""
+        self._deadlines.clear()
+        self._heap.clear()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._update_gauge()
+
+    def _update_gauge(self):
+        metrics.set_gauge(f'timers.{self.name}.active', len(self._deadlines))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._deadlines:
+            when, seq, key = self._heap[0]
+            entry = self._deadlines.get(key)
+            if entry is None or entry[1] != seq:
+                heapq.heappop(self._heap)  # Cancelled or rescheduled
+                continue
+
+            delay = when - loop.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue  # Re-check the heap, a sooner deadline may have been added
+
+            heapq.heappop(self._heap)
+            del self._deadlines[key]
+            self._update_gauge()
+            metrics.increment(f'timers.{self.name}.fired')
+            loop.create_task(self._fire(key, entry[2]))
+        self._heap.clear()
+
+    async def _fire(self, key, callback):
+        try:
+            await callback()
+        except Exception as e:
+            logger.error(f"{self.name} timer for {key} failed: {e}", exc_info=True)